@@ -5,8 +5,6 @@
 
 import logging
 
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-
 from state.charm_state import SynapseConfig
 from state.mas import MASConfiguration
 
@@ -49,6 +47,9 @@ def generate_mas_config(
         "synapse_server_name_config": synapse_configuration.server_name,
         "synapse_main_unit_address": main_unit_address,
     }
+    # pylint: disable=import-outside-toplevel
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
     env = Environment(
         loader=FileSystemLoader("./templates"),
         autoescape=select_autoescape(),
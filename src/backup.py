@@ -3,40 +3,77 @@
 
 """Provides backup functionality for Synapse."""
 
+# pylint: disable=import-outside-toplevel
+
 import datetime
+import json
 import logging
 import os
 import pathlib
-from typing import Any, Dict, Generator, Iterable, NamedTuple, Optional
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
-import boto3
 import ops
-from botocore.config import Config
-from botocore.exceptions import BotoCoreError, ClientError
-from botocore.exceptions import ConnectionError as BotoConnectionError
 from ops.pebble import APIError, ExecError
 
 import synapse
+from backup_manifest import (
+    BACKUP_FILE_PATTERNS,
+    BASH_COMMAND,
+    MANIFEST_SUFFIX,
+    PARENT_BACKUP_METADATA_KEY,
+    SHARD_SUFFIX,
+    SHARDS_METADATA_KEY,
+    Archive,
+    BackupManifest,
+    ManifestError,
+    build_manifest,
+    get_backup_chain,
+    get_deleted_files,
+    get_restore_steps,
+    plan_archives,
+)
+from backup_transfer import TransferSettings, build_aws_config, resolve_transfer_settings
 from s3_parameters import S3Parameters
 
 AWS_COMMAND = "/aws/dist/aws"
-
-# The configuration files to back up consist in the signing keys
-# plus the sqlite db if it exists.
-BACKUP_FILE_PATTERNS = ["*.key", "homeserver.db*"]
+# Downloads a backup object with concurrent range requests, from a presigned URL read
+# from its standard input.
+RANGED_GET_COMMAND = "/usr/local/bin/s3_ranged_get.py"
+# The presigned URLs must stay valid for the whole restore of the largest backups.
+PRESIGNED_URL_EXPIRATION = 24 * 60 * 60
 
 # For the data directory, inside the "media" directory, all directories starting
 # with local_ will be backed up. The directories starting with "remote_" are from
 # other server and is it not necessary to back them up.
 MEDIA_LOCAL_DIR_PATTERN = "local_*"
 
-# A smaller value will minimise memory requirements. A bigger value can make the transfer faster.
-# As an alternative the option max_bandwidth could be used to limit speed.
-S3_MAX_CONCURRENT_REQUESTS = 1
+COMPRESSION_NONE = "none"
+COMPRESSION_ZSTD = "zstd"
+ZSTD_MAX_LEVEL = 19
+# The archive format is recorded in the metadata of the backup object for the restore.
+ARCHIVE_FORMAT_METADATA_KEY = "archive-format"
+ARCHIVE_FORMATS = {COMPRESSION_NONE: "tar", COMPRESSION_ZSTD: "tar+zstd"}
+# Backups without archive format, and the ones in "tar" format, are not decompressed
+# after gpg, which decompresses the data it compressed itself.
+DECOMPRESS_COMMANDS = {"tar+zstd": "zstd -d -c"}
 
+# AWS CLI configuration of the backup transfers, see TransferSettings.
+AWS_CONFIG_FILE = os.path.join(synapse.SYNAPSE_CONFIG_DIR, ".aws_backup_config")
 
 PASSPHRASE_FILE = os.path.join(synapse.SYNAPSE_CONFIG_DIR, ".gpg_backup_passphrase")  # nosec
-BASH_COMMAND = "/usr/bin/bash"
+# Prefix of the files listing the archive members to extract on selective restores.
+RESTORE_MEMBERS_FILE = "/tmp/synapse_restore_members"  # nosec
 BACKUP_ID_FORMAT = "%Y%m%d%H%M%S%f"
 
 
@@ -65,6 +102,50 @@ class S3Backup(NamedTuple):
     size: int
 
 
+class Compression(NamedTuple):
+    """Compression of the backup archives.
+
+    The compression is done before the encryption, so gpg does not compress again.
+
+    Attributes:
+        algorithm: compression algorithm, one of ARCHIVE_FORMATS.
+        level: compression level, from 1 to ZSTD_MAX_LEVEL for zstd.
+    """
+
+    algorithm: str = COMPRESSION_ZSTD
+    level: int = 3
+
+
+class BackupSettings(NamedTuple):
+    """Settings of a backup.
+
+    Attributes:
+        transfer_settings: settings of the upload to S3.
+        compression: compression of the backup archives.
+        parent_backup_id: backup to create an incremental backup of, None for a full
+            backup.
+        shards: maximum number of shards, 0 for one per CPU.
+    """
+
+    transfer_settings: TransferSettings = TransferSettings()
+    compression: Compression = Compression()
+    parent_backup_id: Optional[str] = None
+    shards: int = 0
+
+
+class RestoreSettings(NamedTuple):
+    """Settings of a restore.
+
+    Attributes:
+        transfer_settings: settings of the download from S3.
+        paths: files or directories to restore, shell patterns are allowed. None to
+            restore the whole backup.
+    """
+
+    transfer_settings: TransferSettings = TransferSettings()
+    paths: Optional[List[str]] = None
+
+
 class S3Client:
     """S3 Client Wrapper around boto3 library."""
 
@@ -91,6 +172,10 @@ class S3Client:
         Raises:
             S3Error: If it was not possible to create the client.
         """
+        import boto3
+        from botocore.config import Config
+        from botocore.exceptions import BotoCoreError
+
         try:
             s3_client_config = Config(
                 region_name=self._s3_parameters.region,
@@ -116,6 +201,9 @@ class S3Client:
         Returns:
             True if the bucket exists and is accessible
         """
+        from botocore.exceptions import ClientError
+        from botocore.exceptions import ConnectionError as BotoConnectionError
+
         try:
             self._client.head_bucket(Bucket=self._s3_parameters.bucket)
         except (ClientError, BotoConnectionError):
@@ -129,19 +217,78 @@ class S3Client:
     def delete_backup(self, backup_id: str) -> None:
         """Delete a backup stored in S3 in the current s3 configuration.
 
+        The manifest and the shards of the backup are deleted too.
+
         Args:
             backup_id: backup id to delete.
 
         Raises:
             S3Error: If there was an error deleting the backup.
         """
-        object_key = _s3_path(prefix=self._s3_parameters.path, object_name=backup_id)
+        from botocore.exceptions import ClientError
 
+        object_key = _s3_path(prefix=self._s3_parameters.path, object_name=backup_id)
         try:
-            self._client.delete_object(Bucket=self._s3_parameters.bucket, Key=object_key)
+            object_keys = [object_key, object_key + MANIFEST_SUFFIX]
+            object_keys.extend(
+                item["Key"] for item in self._list_s3_objects(object_key + SHARD_SUFFIX)
+            )
+            for key in object_keys:
+                self._client.delete_object(Bucket=self._s3_parameters.bucket, Key=key)
         except ClientError as exc:
             raise S3Error(f"Cannot delete backup_id {backup_id} from bucket") from exc
 
+    def get_child_backups(self, backup_id: str) -> list[str]:
+        """Get the incremental backups applying on a backup.
+
+        Args:
+            backup_id: backup id of the parent backup.
+
+        Returns:
+            The ids of the backups whose parent is the given backup.
+
+        Raises:
+            S3Error: If there was an error reading the parents of the backups.
+        """
+        from botocore.exceptions import ClientError
+
+        child_backup_ids = []
+        try:
+            for s3_backup in self.list_backups():
+                response = self._client.head_object(
+                    Bucket=self._s3_parameters.bucket,
+                    Key=_s3_path(prefix=self._s3_parameters.path, object_name=s3_backup.backup_id),
+                )
+                if response.get("Metadata", {}).get(PARENT_BACKUP_METADATA_KEY) == backup_id:
+                    child_backup_ids.append(s3_backup.backup_id)
+        except ClientError as exc:
+            raise S3Error(f"Cannot get the backups applying on {backup_id}") from exc
+        return child_backup_ids
+
+    def get_download_url(self, backup_id: str) -> str:
+        """Get a presigned URL to download a backup object.
+
+        Args:
+            backup_id: backup id, or name of an object stored next to the backups.
+
+        Returns:
+            The presigned URL, valid for PRESIGNED_URL_EXPIRATION seconds.
+
+        Raises:
+            S3Error: If there was an error signing the URL.
+        """
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        object_key = _s3_path(prefix=self._s3_parameters.path, object_name=backup_id)
+        try:
+            return self._client.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self._s3_parameters.bucket, "Key": object_key},
+                ExpiresIn=PRESIGNED_URL_EXPIRATION,
+            )
+        except (BotoCoreError, ClientError) as exc:
+            raise S3Error(f"Cannot get the download URL of {backup_id}") from exc
+
     def exists_backup(self, backup_id: str) -> bool:
         """Check if a backup-id exists in S3.
 
@@ -154,6 +301,8 @@ class S3Client:
         Raises:
             S3Error: If there was an error checking the backup.
         """
+        from botocore.exceptions import ClientError
+
         object_key = _s3_path(prefix=self._s3_parameters.path, object_name=backup_id)
         try:
             self._client.head_object(Bucket=self._s3_parameters.bucket, Key=object_key)
@@ -168,35 +317,55 @@ class S3Client:
     def list_backups(self) -> list[S3Backup]:
         """List the backups stored in S3 in the current s3 configuration.
 
+        The manifests and the shards of the backups are not listed, the size of a
+        sharded backup is the size of its shards.
+
         Returns:
             list of backups.
         """
         backups = []
+        shard_sizes: Dict[str, int] = {}
         for item in self._list_s3_objects():
-            s3_object_key = pathlib.Path(item["Key"])
-            backup_id = s3_object_key.relative_to(self._prefix)
+            if item["Key"].endswith(MANIFEST_SUFFIX):
+                continue
+            backup_key, shard_suffix, _ = item["Key"].rpartition(SHARD_SUFFIX)
+            s3_object_key = pathlib.Path(backup_key if shard_suffix else item["Key"])
+            backup_id = str(s3_object_key.relative_to(self._prefix))
+            if shard_suffix:
+                shard_sizes[backup_id] = shard_sizes.get(backup_id, 0) + item["Size"]
+                continue
             backup = S3Backup(
-                backup_id=str(backup_id),
+                backup_id=backup_id,
                 last_modified=item["LastModified"],
                 size=item["Size"],
             )
             backups.append(backup)
-        return backups
+        return [
+            s3_backup._replace(size=shard_sizes.get(s3_backup.backup_id, s3_backup.size))
+            for s3_backup in backups
+        ]
 
-    def _list_s3_objects(self) -> Generator[dict, None, None]:
+    def _list_s3_objects(self, prefix: Optional[str] = None) -> Generator[dict, None, None]:
         """List the backups stored in S3 in the current s3 configuration.
 
         A paginator is used over `list_objects_v2` because there can
         be more than 1000 elements.
 
+        Args:
+            prefix: prefix of the objects to list, the prefix of the backups by default.
+
         Yield:
             Element from list_objects_v2.
 
         Raises:
             S3Error: if listing the objects in S3 fails.
         """
+        from botocore.exceptions import ClientError
+
         paginator = self._client.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=self._s3_parameters.bucket, Prefix=self._prefix)
+        page_iterator = paginator.paginate(
+            Bucket=self._s3_parameters.bucket, Prefix=prefix or self._prefix
+        )
         try:
             for page in page_iterator:
                 if page["KeyCount"] > 0:
@@ -209,13 +378,20 @@ def create_backup(
     container: ops.Container,
     s3_parameters: S3Parameters,
     passphrase: str,
+    settings: BackupSettings = BackupSettings(),
 ) -> str:
     """Create a backup for Synapse running it in the workload.
 
+    The manifest of the backup is stored next to it. If a parent backup is given,
+    only the files that changed since the parent are archived. Large backups are
+    split in shards of about the same size, archived and uploaded in parallel, and
+    an index object is stored with the backup id.
+
     Args:
         container: Synapse Container
         s3_parameters: S3 parameters for the backup.
         passphrase: Passphrase use to encrypt the backup.
+        settings: Settings of the backup.
 
     Returns:
        The backup key used for the backup.
@@ -225,31 +401,63 @@ def create_backup(
     """
     backup_id = "backup-" + datetime.datetime.now().strftime(BACKUP_ID_FORMAT)
 
-    _prepare_container(container, s3_parameters, passphrase)
     paths_to_backup = _get_paths_to_backup(container)
     logger.info("Paths to back up: %s.", list(paths_to_backup))
     if not paths_to_backup:
         raise BackupError("Backup Failed. No paths to back up.")
 
-    expected_size = _calculate_size(container, paths_to_backup)
-    backup_command = _build_backup_command(
-        s3_parameters, backup_id, paths_to_backup, PASSPHRASE_FILE, expected_size
-    )
-
-    logger.info("Backup command: %s", backup_command)
-    environment = _get_environment(s3_parameters)
+    parent_manifest = None
+    if settings.parent_backup_id:
+        parent_manifest = _get_parent_manifest(
+            container,
+            s3_parameters,
+            passphrase,
+            settings.parent_backup_id,
+            settings.transfer_settings,
+        )
     try:
-        exec_process = container.exec(
-            backup_command,
-            environment=environment,
-            user=synapse.SYNAPSE_USER,
-            group=synapse.SYNAPSE_GROUP,
+        manifest, changed_paths = build_manifest(
+            container, paths_to_backup, settings.parent_backup_id, parent_manifest
+        )
+    except ManifestError as exc:
+        raise BackupError(f"Backup Failed. {exc}") from exc
+    if settings.parent_backup_id:
+        logger.info(
+            "Files changed since backup %s: %d.", settings.parent_backup_id, len(changed_paths)
         )
-        stdout, stderr = exec_process.wait_output()
+    manifest, archives = plan_archives(
+        container, backup_id, manifest, changed_paths, settings.shards
+    )
+    _prepare_container(
+        container,
+        s3_parameters,
+        passphrase,
+        resolve_transfer_settings(
+            container,
+            settings.transfer_settings,
+            max(archive.expected_size for archive in archives),
+            len(archives),
+        ),
+    )
+    commands = []
+    for archive in archives:
+        backup_command = _build_backup_command(
+            s3_parameters, archive, paths_to_backup, PASSPHRASE_FILE, settings
+        )
+        logger.info("Backup command: %s", backup_command)
+        # The files are read from the standard input, they can be too many for the
+        # command line.
+        commands.append(
+            (backup_command, None if archive.files is None else "\0".join(archive.files))
+        )
+    try:
+        _exec_in_parallel(container, commands, _get_environment(s3_parameters))
     except (APIError, ExecError) as exc:
         raise BackupError("Backup Command Failed.") from exc
 
-    logger.info("Backup command output: %s. %s.", stdout, stderr)
+    if manifest.shards:
+        _put_index(container, s3_parameters, backup_id, manifest)
+    _put_manifest(container, s3_parameters, backup_id, manifest)
     return backup_id
 
 
@@ -258,46 +466,339 @@ def restore_backup(
     s3_parameters: S3Parameters,
     passphrase: str,
     backup_id: str,
+    settings: RestoreSettings = RestoreSettings(),
 ) -> None:
     """Restore a backup for Synapse overwriting the current data.
 
+    If paths are given, only the matching files are restored, downloading only the
+    archives holding them, and the other files are left untouched.
+
     Args:
         container: Synapse Container
         s3_parameters: S3 parameters for the backup.
         passphrase: Passphrase use to decrypt the backup.
         backup_id: Name of the object in the backup.
+        settings: Settings of the restore.
 
     Raises:
        BackupError: If there was an error restoring the backup.
     """
-    _prepare_container(container, s3_parameters, passphrase)
+    resolved_settings = resolve_transfer_settings(container, settings.transfer_settings, 0)
+    _prepare_container(container, s3_parameters, passphrase, resolved_settings)
+    try:
+        backup_chain = get_backup_chain(
+            backup_id, lambda chain_id: _get_manifest(container, s3_parameters, chain_id)
+        )
+        logger.info("Backups to restore: %s.", [chain_id for chain_id, _ in backup_chain])
+        restore_steps = get_restore_steps(backup_chain, settings.paths)
+    except ManifestError as exc:
+        raise BackupError(f"Backup restore failed. {exc}") from exc
+    # The archives of a step are downloaded in parallel, sharing the memory budget.
+    parallel_transfers = max(len(archive_members) for archive_members in restore_steps)
+    if parallel_transfers > 1:
+        resolved_settings = resolve_transfer_settings(
+            container, settings.transfer_settings, 0, parallel_transfers
+        )
+        _prepare_container(container, s3_parameters, passphrase, resolved_settings)
+    try:
+        s3_client = S3Client(s3_parameters)
+    except S3Error as exc:
+        raise BackupError("Backup restore failed. Error creating the S3 client.") from exc
     container.stop(synapse.SYNAPSE_SERVICE_NAME)
 
-    # Delete the media directory.
-    # Other files to back up will be just overwritten.
-    media_dir = synapse.get_media_store_path(container)
-    container.remove_path(media_dir, recursive=True)
+    if settings.paths is None:
+        # Delete the media directory.
+        # Other files to back up will be just overwritten.
+        media_dir = synapse.get_media_store_path(container)
+        container.remove_path(media_dir, recursive=True)
+    for archive_members in restore_steps:
+        _restore_archives(container, s3_parameters, s3_client, archive_members, resolved_settings)
+    if settings.paths is None:
+        _remove_deleted_files(container, backup_chain)
+    container.start(synapse.SYNAPSE_SERVICE_NAME)
+
+
+def _restore_archives(
+    container: ops.Container,
+    s3_parameters: S3Parameters,
+    s3_client: "S3Client",
+    archive_members: Mapping[str, Optional[List[str]]],
+    transfer_settings: TransferSettings,
+) -> None:
+    """Restore archives of a backup at the same time.
+
+    Args:
+        container: Synapse Container
+        s3_parameters: S3 parameters for the backup.
+        s3_client: S3 client signing the download URLs.
+        archive_members: Files to extract from each archive, by archive name. None to
+            extract the whole archive.
+        transfer_settings: Resolved settings of the downloads.
+
+    Raises:
+       BackupError: If there was an error restoring an archive.
+    """
+    logger.info("Archives to restore: %s.", list(archive_members))
+    commands = []
+    members_files = []
+    try:
+        for index, (archive_name, members) in enumerate(archive_members.items()):
+            members_file = None
+            if members is not None:
+                members_file = f"{RESTORE_MEMBERS_FILE}-{index}"
+                # The members are stored without the leading "/" in the archives.
+                container.push(
+                    members_file,
+                    "\0".join(member.lstrip("/") for member in members),
+                    user=synapse.SYNAPSE_USER,
+                    group=synapse.SYNAPSE_GROUP,
+                )
+                members_files.append(members_file)
+            restore_command = _build_restore_command(
+                s3_parameters, archive_name, PASSPHRASE_FILE, transfer_settings, members_file
+            )
+            logger.info("Restore command: %s", restore_command)
+            # The presigned URL is passed on the standard input so it is not logged.
+            commands.append((restore_command, s3_client.get_download_url(archive_name)))
+        _exec_in_parallel(container, commands, _get_environment(s3_parameters))
+    except (APIError, ExecError, S3Error, ops.pebble.PathError) as exc:
+        raise BackupError("Backup restore failed.") from exc
+    finally:
+        for path in members_files:
+            container.remove_path(path)
+
+
+def _exec_in_parallel(
+    container: ops.Container,
+    commands: Sequence[Tuple[List[str], Optional[str]]],
+    environment: Dict[str, str],
+) -> None:
+    """Run commands at the same time in the container and wait for all of them.
 
-    restore_command = _build_restore_command(s3_parameters, backup_id, PASSPHRASE_FILE)
-    logger.info("Restore command: %s", restore_command)
-    environment = _get_environment(s3_parameters)
+    Args:
+        container: Synapse Container.
+        commands: command and standard input of each process.
+        environment: environment variables of the processes.
+
+    Raises:
+        APIError: If a process could not be started.
+        ExecError: If a process failed, once all of them finished.
+    """
+    processes = []
+    error: Optional[Exception] = None
+    for command, stdin in commands:
+        try:
+            processes.append(
+                container.exec(
+                    command,
+                    stdin=stdin,
+                    environment=environment,
+                    user=synapse.SYNAPSE_USER,
+                    group=synapse.SYNAPSE_GROUP,
+                )
+            )
+        except APIError as exc:
+            error = exc
+            break
+    for process in processes:
+        try:
+            stdout, stderr = process.wait_output()
+            logger.info("Backup command output: %s. %s.", stdout, stderr)
+        except ExecError as exc:
+            logger.error("Backup command failed: %s. %s.", exc.stdout, exc.stderr)
+            error = error or exc
+    if error:
+        raise error
+
+
+def _remove_deleted_files(
+    container: ops.Container, backup_chain: List[Tuple[str, Optional[BackupManifest]]]
+) -> None:
+    """Remove the files restored from a parent backup that are not in the last backup.
+
+    Args:
+        container: Synapse Container.
+        backup_chain: id and manifest of each restored backup, in restore order.
+
+    Raises:
+        BackupError: If there was an error removing the files.
+    """
+    deleted_paths = get_deleted_files(backup_chain)
+    if not deleted_paths:
+        return
+    logger.info("Removing %d files deleted since the parent backups.", len(deleted_paths))
     try:
-        exec_process = container.exec(
-            restore_command,
-            environment=environment,
+        container.exec(
+            [BASH_COMMAND, "-c", "set -euo pipefail; xargs -0 -r rm -f --"],
+            stdin="\0".join(deleted_paths),
             user=synapse.SYNAPSE_USER,
             group=synapse.SYNAPSE_GROUP,
-        )
-        stdout, stderr = exec_process.wait_output()
+        ).wait_output()
     except (APIError, ExecError) as exc:
-        raise BackupError("Backup restore failed.") from exc
-    logger.info("Backup command output: %s. %s.", stdout, stderr)
+        raise BackupError("Backup restore failed. Error removing deleted files.") from exc
 
-    container.start(synapse.SYNAPSE_SERVICE_NAME)
+
+def _get_parent_manifest(
+    container: ops.Container,
+    s3_parameters: S3Parameters,
+    passphrase: str,
+    parent_backup_id: str,
+    transfer_settings: TransferSettings,
+) -> BackupManifest:
+    """Download the manifest of the parent of an incremental backup.
+
+    The parent manifest is downloaded before the size of the upload is known.
+
+    Args:
+        container: Synapse Container.
+        s3_parameters: S3 parameters for the backup.
+        passphrase: Passphrase use to encrypt the backup.
+        parent_backup_id: Backup to create an incremental backup of.
+        transfer_settings: Settings of the upload to S3.
+
+    Returns:
+        The manifest of the parent backup.
+
+    Raises:
+        BackupError: If the parent backup has no manifest.
+    """
+    _prepare_container(
+        container,
+        s3_parameters,
+        passphrase,
+        resolve_transfer_settings(container, transfer_settings, 0),
+    )
+    parent_manifest = _get_manifest(container, s3_parameters, parent_backup_id)
+    if parent_manifest is None:
+        raise BackupError(f"Backup Failed. Backup {parent_backup_id} has no manifest.")
+    return parent_manifest
+
+
+def _get_manifest(
+    container: ops.Container, s3_parameters: S3Parameters, backup_id: str
+) -> Optional[BackupManifest]:
+    """Download and decrypt the manifest of a backup.
+
+    Args:
+        container: Synapse Container.
+        s3_parameters: S3 parameters for the backup.
+        backup_id: Backup of the manifest.
+
+    Returns:
+        The manifest, None if the backup has no manifest.
+
+    Raises:
+        BackupError: If there was an error getting the manifest.
+    """
+    try:
+        if not S3Client(s3_parameters).exists_backup(backup_id + MANIFEST_SUFFIX):
+            return None
+    except S3Error as exc:
+        raise BackupError(f"Error checking the manifest of backup {backup_id}.") from exc
+    s3_url = _s3_path(
+        prefix=s3_parameters.path,
+        object_name=backup_id + MANIFEST_SUFFIX,
+        bucket=s3_parameters.bucket,
+    )
+    command = (
+        f"set -euo pipefail; {AWS_COMMAND} s3 cp '{s3_url}' - | "
+        f"gpg --batch --no-symkey-cache --decrypt --passphrase-file '{PASSPHRASE_FILE}'"
+    )
+    try:
+        stdout, _ = container.exec(
+            [BASH_COMMAND, "-c", command],
+            environment=_get_environment(s3_parameters),
+            user=synapse.SYNAPSE_USER,
+            group=synapse.SYNAPSE_GROUP,
+        ).wait_output()
+        return BackupManifest.from_json(stdout)
+    except (APIError, ExecError, ValueError, KeyError) as exc:
+        raise BackupError(f"Error getting the manifest of backup {backup_id}.") from exc
+
+
+def _put_index(
+    container: ops.Container,
+    s3_parameters: S3Parameters,
+    backup_id: str,
+    manifest: BackupManifest,
+) -> None:
+    """Upload the index of a sharded backup with the backup id.
+
+    The index lists the shards. Their number and the parent backup are recorded in
+    its metadata, like in the metadata of an archive.
+
+    Args:
+        container: Synapse Container.
+        s3_parameters: S3 parameters for the backup.
+        backup_id: Backup of the index.
+        manifest: Manifest of the backup.
+
+    Raises:
+        BackupError: If there was an error uploading the index.
+    """
+    s3_url = _s3_path(
+        prefix=s3_parameters.path, object_name=backup_id, bucket=s3_parameters.bucket
+    )
+    metadata = f"{SHARDS_METADATA_KEY}={manifest.shards}"
+    if manifest.parent:
+        metadata += f",{PARENT_BACKUP_METADATA_KEY}={manifest.parent}"
+    command = f"set -euo pipefail; {AWS_COMMAND} s3 cp --metadata '{metadata}' - '{s3_url}'"
+    try:
+        container.exec(
+            [BASH_COMMAND, "-c", command],
+            stdin=json.dumps({"shards": manifest.get_archive_names(backup_id)}),
+            environment=_get_environment(s3_parameters),
+            user=synapse.SYNAPSE_USER,
+            group=synapse.SYNAPSE_GROUP,
+        ).wait_output()
+    except (APIError, ExecError) as exc:
+        raise BackupError("Backup Failed. Error uploading the index.") from exc
+
+
+def _put_manifest(
+    container: ops.Container,
+    s3_parameters: S3Parameters,
+    backup_id: str,
+    manifest: BackupManifest,
+) -> None:
+    """Encrypt and upload the manifest of a backup next to it.
+
+    Args:
+        container: Synapse Container.
+        s3_parameters: S3 parameters for the backup.
+        backup_id: Backup of the manifest.
+        manifest: Manifest to upload.
+
+    Raises:
+        BackupError: If there was an error uploading the manifest.
+    """
+    s3_url = _s3_path(
+        prefix=s3_parameters.path,
+        object_name=backup_id + MANIFEST_SUFFIX,
+        bucket=s3_parameters.bucket,
+    )
+    command = (
+        "set -euo pipefail; "
+        f"gpg --batch --no-symkey-cache --passphrase-file '{PASSPHRASE_FILE}' --symmetric | "
+        f"{AWS_COMMAND} s3 cp - '{s3_url}'"
+    )
+    try:
+        container.exec(
+            [BASH_COMMAND, "-c", command],
+            stdin=manifest.to_json(),
+            environment=_get_environment(s3_parameters),
+            user=synapse.SYNAPSE_USER,
+            group=synapse.SYNAPSE_GROUP,
+        ).wait_output()
+    except (APIError, ExecError) as exc:
+        raise BackupError("Backup Failed. Error uploading the manifest.") from exc
 
 
 def _prepare_container(
-    container: ops.Container, s3_parameters: S3Parameters, passphrase: str
+    container: ops.Container,
+    s3_parameters: S3Parameters,
+    passphrase: str,
+    transfer_settings: TransferSettings,
 ) -> None:
     """Prepare container for create or restore backup.
 
@@ -307,40 +808,19 @@ def _prepare_container(
         container: Synapse Container.
         s3_parameters: S3 parameters for the backup.
         passphrase: Passphrase for the backup (used for gpg).
+        transfer_settings: Transfer settings to use.
 
     Raises:
        BackupError: if there was an error preparing the configuration.
     """
-    aws_set_addressing_style = [
-        AWS_COMMAND,
-        "configure",
-        "set",
-        "default.s3.addressing_style",
-        s3_parameters.addressing_style,
-    ]
-
-    aws_set_concurrent_requests = [
-        AWS_COMMAND,
-        "configure",
-        "set",
-        "default.s3.max_concurrent_requests",
-        str(S3_MAX_CONCURRENT_REQUESTS),
-    ]
-
     try:
-        process = container.exec(
-            aws_set_addressing_style,
-            user=synapse.SYNAPSE_USER,
-            group=synapse.SYNAPSE_GROUP,
-        )
-        process.wait()
-        process = container.exec(
-            aws_set_concurrent_requests,
+        container.push(
+            AWS_CONFIG_FILE,
+            build_aws_config(s3_parameters, transfer_settings),
             user=synapse.SYNAPSE_USER,
             group=synapse.SYNAPSE_GROUP,
         )
-        process.wait()
-    except (APIError, ExecError) as exc:
+    except ops.pebble.PathError as exc:
         raise BackupError("Backup Failed. Error configuring AWS.") from exc
 
     try:
@@ -358,26 +838,59 @@ def _build_restore_command(
     s3_parameters: S3Parameters,
     backup_id: str,
     passphrase_file: str,
+    transfer_settings: TransferSettings,
+    members_file: Optional[str] = None,
 ) -> list[str]:
     """Build the command to execute the backup restore.
 
+    The backup object is downloaded with concurrent range requests, from a presigned
+    URL given on the standard input. The chunks downloaded ahead of the one being
+    decrypted are bounded by the memory budget.
+
     Args:
         s3_parameters: S3 parameters.
         backup_id: The name of the object to back up.
         passphrase_file: Passphrase to use to encrypt the backup file.
+        transfer_settings: Resolved settings of the download.
+        members_file: File listing the archive members to extract, separated by null
+            characters. None to extract the whole archive.
 
     Returns:
-        The restore command to execute.
+        The restore command to execute, decompressing the archive format found in
+        the metadata of the backup.
     """
     bash_strict_command = "set -euxo pipefail; "
-    s3_url = _s3_path(
-        prefix=s3_parameters.path, object_name=backup_id, bucket=s3_parameters.bucket
+    object_key = _s3_path(prefix=s3_parameters.path, object_name=backup_id)
+    format_command = (
+        f"archive_format=$({AWS_COMMAND} s3api head-object --bucket '{s3_parameters.bucket}'"
+        f" --key '{object_key}' --query 'Metadata.\"{ARCHIVE_FORMAT_METADATA_KEY}\"'"
+        " --output text); "
+    )
+    decompress_cases = "".join(
+        f"{archive_format}) decompress='{command}';; "
+        for archive_format, command in DECOMPRESS_COMMANDS.items()
+    )
+    decompress_command = f'case "$archive_format" in {decompress_cases}*) decompress=cat;; esac; '
+    buffer_chunks = max(
+        transfer_settings.max_concurrent_requests,
+        transfer_settings.memory_budget // transfer_settings.multipart_chunksize,
+    )
+    download_command = (
+        f"{RANGED_GET_COMMAND} --chunk-size {transfer_settings.multipart_chunksize}"
+        f" --concurrency {transfer_settings.max_concurrent_requests}"
+        f" --buffer-chunks {buffer_chunks}"
     )
-    aws_command = f"{AWS_COMMAND} s3 cp '{s3_url}' -"
     gpg_command = f"gpg --batch --no-symkey-cache --decrypt --passphrase-file '{passphrase_file}'"
     # restoring with "-C /" is something to review.
     tar_command = "tar -x -C /"
-    full_command = bash_strict_command + " | ".join((aws_command, gpg_command, tar_command))
+    if members_file:
+        tar_command += f" --null -T '{members_file}'"
+    full_command = (
+        bash_strict_command
+        + format_command
+        + decompress_command
+        + " | ".join((download_command, gpg_command, "$decompress", tar_command))
+    )
     return [BASH_COMMAND, "-c", full_command]
 
 
@@ -399,69 +912,51 @@ def _get_paths_to_backup(container: ops.Container) -> Iterable[str]:
     return [path.path for path in paths]
 
 
-def _calculate_size(container: ops.Container, paths: Iterable[str]) -> int:
-    """Return the combined size of all the paths given.
-
-    Args:
-        container: Container where to check the size of the paths.
-        paths: Paths to check.
-
-    Returns:
-        Total size in bytes.
-
-    Raises:
-        BackupError: If there was a problem calculating the size.
-    """
-    command = "set -euxo pipefail; du -bsc " + _paths_to_args(paths) + " | tail -n1 | cut -f 1"
-    try:
-        exec_process = container.exec(
-            [BASH_COMMAND, "-c", command],
-            user=synapse.SYNAPSE_USER,
-            group=synapse.SYNAPSE_GROUP,
-        )
-        stdout, stderr = exec_process.wait_output()
-    except (APIError, ExecError) as exc:
-        raise BackupError("Cannot calculate size of paths. du failed.") from exc
-
-    logger.info(
-        "Calculating size of paths. Command: %s. stdout: %s. stderr: %s", command, stdout, stderr
-    )
-
-    return int(stdout)
-
-
 def _build_backup_command(
     s3_parameters: S3Parameters,
-    backup_id: str,
+    archive: Archive,
     backup_paths: Iterable[str],
     passphrase_file: str,
-    expected_size: int,
+    settings: BackupSettings = BackupSettings(),
 ) -> list[str]:
     """Build the command to execute the backup.
 
     Args:
         s3_parameters: S3 parameters.
-        backup_id: The name of the object to back up.
-        backup_paths: List of paths to back up.
+        archive: Archive to create. The files it lists are read from the standard
+            input, separated by null characters.
+        backup_paths: List of paths to back up, archived if the archive lists no files.
         passphrase_file: Passphrase to use to encrypt the backup file.
-        expected_size: expected size of the backup, so AWS S3 Client can calculate
-            a reasonable size for the upload parts.
+        settings: Settings of the backup. The compression of the archive and the
+            parent backup are recorded in the object metadata.
 
     Returns:
         The backup command to execute.
     """
     bash_strict_command = "set -euxo pipefail; "
-    paths = _paths_to_args(backup_paths)
-    tar_command = f"tar -c {paths}"
-    gpg_command = (
-        f"gpg --batch --no-symkey-cache " f"--passphrase-file '{passphrase_file}' " f"--symmetric"
+    if archive.files is not None:
+        commands = ["tar -c --null -T -"]
+    else:
+        commands = [f"tar -c {_paths_to_args(backup_paths)}"]
+    compression = settings.compression
+    if compression.algorithm == COMPRESSION_ZSTD:
+        commands.append(f"zstd -T0 -{compression.level} -c")
+    commands.append(
+        f"gpg --batch --no-symkey-cache --compress-algo none "
+        f"--passphrase-file '{passphrase_file}' --symmetric"
     )
 
     s3_url = _s3_path(
-        prefix=s3_parameters.path, object_name=backup_id, bucket=s3_parameters.bucket
+        prefix=s3_parameters.path, object_name=archive.name, bucket=s3_parameters.bucket
+    )
+    metadata = f"{ARCHIVE_FORMAT_METADATA_KEY}={ARCHIVE_FORMATS[compression.algorithm]}"
+    if settings.parent_backup_id:
+        metadata += f",{PARENT_BACKUP_METADATA_KEY}={settings.parent_backup_id}"
+    commands.append(
+        f"{AWS_COMMAND} s3 cp --expected-size={archive.expected_size} --metadata '{metadata}'"
+        f" - '{s3_url}'"
     )
-    aws_command = f"{AWS_COMMAND} s3 cp --expected-size={expected_size} - '{s3_url}'"
-    full_command = bash_strict_command + " | ".join((tar_command, gpg_command, aws_command))
+    full_command = bash_strict_command + " | ".join(commands)
     return [BASH_COMMAND, "-c", full_command]
 
 
@@ -477,6 +972,7 @@ def _get_environment(s3_parameters: S3Parameters) -> Dict[str, str]:
     environment = {
         "AWS_ACCESS_KEY_ID": s3_parameters.access_key,
         "AWS_SECRET_ACCESS_KEY": s3_parameters.secret_key,
+        "AWS_CONFIG_FILE": AWS_CONFIG_FILE,
     }
     if s3_parameters.endpoint:
         environment["AWS_ENDPOINT_URL"] = s3_parameters.endpoint
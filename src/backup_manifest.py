@@ -0,0 +1,518 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Provides the manifests of the Synapse backups and the planning of their archives."""
+
+import fnmatch
+import heapq
+import json
+import logging
+import math
+import os
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+import ops
+from ops.pebble import APIError, ExecError
+
+import synapse
+
+# The configuration files to back up consist in the signing keys
+# plus the sqlite db if it exists.
+BACKUP_FILE_PATTERNS = ["*.key", "homeserver.db*"]
+
+# The manifest of a backup is stored next to it, with this suffix appended to its id.
+MANIFEST_SUFFIX = ".manifest"
+PARENT_BACKUP_METADATA_KEY = "parent-backup"
+# The archives of a sharded backup are stored next to its index, with this suffix and
+# the shard number appended to its id.
+SHARD_SUFFIX = ".shard-"
+SHARDS_METADATA_KEY = "shards"
+# Backups are not split in shards smaller than this size.
+MIN_SHARD_SIZE = 128 * 1024 * 1024
+# Files hashed by each sha256sum process. The processes run in parallel and a batch
+# must be written to the output pipe at once, so the records are not interleaved.
+HASH_BATCH_SIZE = 16
+# Every member of a tar archive has a header block and its content padded to whole
+# blocks, and the archive is padded to whole records.
+TAR_BLOCK_SIZE = 512
+TAR_RECORD_SIZE = 20 * TAR_BLOCK_SIZE
+
+BASH_COMMAND = "/usr/bin/bash"
+
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestError(Exception):
+    """Exception raised when the manifest of a backup cannot be built or used."""
+
+
+class BackupManifest(NamedTuple):
+    """Files of a backup, to build incremental backups and restore them.
+
+    An incremental backup archives only the files that changed since its parent.
+    Its manifest lists all the files, so the files deleted since the parent are
+    deleted on restore.
+
+    It is also the index of the archive members: each file points to the archive of
+    the backup holding it, so selected files are restored without downloading the
+    other archives.
+
+    Attributes:
+        parent: backup the archive applies on, None for a full backup.
+        files: size, modification time, SHA-256 hash and archive index of each file,
+            by path. The hash is None for the files never hashed, and the archive
+            index for the files archived by a parent.
+        shards: number of archives of a sharded backup, 0 if the archive is stored
+            in the backup object itself.
+    """
+
+    parent: Optional[str]
+    files: Dict[str, Tuple[int, str, Optional[str], Optional[int]]]
+    shards: int = 0
+
+    def to_json(self) -> str:
+        """Serialize the manifest to JSON.
+
+        Returns:
+            The JSON manifest.
+        """
+        return json.dumps(
+            {"parent": self.parent, "files": self.files, "shards": self.shards},
+            separators=(",", ":"),
+            sort_keys=True,
+        )
+
+    @classmethod
+    def from_json(cls, content: str) -> "BackupManifest":
+        """Deserialize a JSON manifest.
+
+        Args:
+            content: JSON manifest.
+
+        Returns:
+            The manifest.
+        """
+        data = json.loads(content)
+        # The files of the manifests written before the archive index have no
+        # archive, their backups cannot be restored selectively.
+        return cls(
+            parent=data["parent"],
+            files={
+                path: (*file[:3], file[3] if len(file) > 3 else None)  # type: ignore
+                for path, file in data["files"].items()
+            },
+            shards=data.get("shards", 0),
+        )
+
+    def get_archive_names(self, backup_id: str) -> List[str]:
+        """Get the names of the objects holding the archive of the backup.
+
+        Args:
+            backup_id: id of the backup of the manifest.
+
+        Returns:
+            The backup object, or its shards for a sharded backup.
+        """
+        if not self.shards:
+            return [backup_id]
+        return [f"{backup_id}{SHARD_SUFFIX}{shard}" for shard in range(self.shards)]
+
+
+class Archive(NamedTuple):
+    """Archive of the files of a backup.
+
+    Attributes:
+        name: name of the object holding the archive.
+        files: files to archive, None to archive the whole paths to back up.
+        expected_size: expected size of the archive in bytes.
+    """
+
+    name: str
+    files: Optional[List[str]]
+    expected_size: int
+
+
+def build_manifest(
+    container: ops.Container,
+    paths: Iterable[str],
+    parent_backup_id: Optional[str],
+    parent_manifest: Optional[BackupManifest],
+) -> Tuple[BackupManifest, List[str]]:
+    """Build the manifest of a backup of the given paths.
+
+    The files whose size and modification time did not change since the parent
+    backup are not archived again. Only the files of the parent backup that changed
+    are hashed, so the ones touched without changing their content are not archived
+    either. The new files and the files of a full backup are not hashed.
+
+    Args:
+        container: Synapse Container.
+        paths: Paths to back up.
+        parent_backup_id: Backup the incremental backup applies on, None for a full backup.
+        parent_manifest: Manifest of the parent backup.
+
+    Returns:
+        The manifest of the backup and the files to archive.
+    """
+    parent_files = parent_manifest.files if parent_manifest else {}
+    listed_files = _list_files(container, paths)
+    hashes = _hash_files(
+        container,
+        [
+            path
+            for path, (size, mtime) in listed_files.items()
+            if path in parent_files and parent_files[path][:2] != (size, mtime)
+        ],
+    )
+    files: Dict[str, Tuple[int, str, Optional[str], Optional[int]]] = {}
+    changed_paths = []
+    for path, (size, mtime) in listed_files.items():
+        if path in parent_files and parent_files[path][:2] == (size, mtime):
+            files[path] = (size, mtime, parent_files[path][2], None)
+            continue
+        if path in parent_files and path not in hashes:
+            # removed since it was listed
+            continue
+        file_hash = hashes.get(path)
+        if path not in parent_files or parent_files[path][2] != file_hash:
+            changed_paths.append(path)
+        files[path] = (size, mtime, file_hash, None)
+    return BackupManifest(parent=parent_backup_id, files=files), changed_paths
+
+
+def plan_archives(
+    container: ops.Container,
+    backup_id: str,
+    manifest: BackupManifest,
+    changed_paths: List[str],
+    shards: int,
+) -> Tuple[BackupManifest, List[Archive]]:
+    """Split the files to archive between the archives of a backup.
+
+    Large backups are split in shards of about the same size. When the media is
+    large, the configuration files are archived in a shard of their own.
+
+    Args:
+        container: Synapse Container.
+        backup_id: Backup of the archives.
+        manifest: Manifest of the backup.
+        changed_paths: Files to archive.
+        shards: Maximum number of shards, 0 for one per CPU.
+
+    Returns:
+        The manifest recording the archive of each file, and the archives. The files
+        of a full backup archived in a single object are not listed.
+    """
+    file_sizes = {path: manifest.files[path][0] for path in changed_paths}
+    archive_files = []
+    media_sizes = {path: size for path, size in file_sizes.items() if not _is_config_file(path)}
+    if sum(media_sizes.values()) >= MIN_SHARD_SIZE:
+        # The configuration files are small but the first ones needed to recover a
+        # server, they get an archive of their own to be restored without the media.
+        archive_files.append([path for path in changed_paths if path not in media_sizes])
+        archive_files.extend(
+            _partition_files(media_sizes, _get_shard_count(container, shards, media_sizes))
+        )
+    archive_files = [files for files in archive_files if files]
+    if len(archive_files) <= 1:
+        archive_files = _partition_files(
+            file_sizes, _get_shard_count(container, shards, file_sizes)
+        )
+    if len(archive_files) > 1:
+        manifest = manifest._replace(shards=len(archive_files))
+        archives = [
+            Archive(name, files, _estimate_archive_size(file_sizes[path] for path in files))
+            for name, files in zip(manifest.get_archive_names(backup_id), archive_files)
+        ]
+    else:
+        archives = [
+            Archive(
+                backup_id,
+                changed_paths if manifest.parent else None,
+                _estimate_archive_size(file_sizes.values()),
+            )
+        ]
+    # The archive of each file is recorded to restore selected files.
+    archive_indexes = {
+        path: index
+        for index, archive in enumerate(archives)
+        for path in (changed_paths if archive.files is None else archive.files)
+    }
+    manifest = manifest._replace(
+        files={
+            path: (*file[:3], archive_indexes.get(path)) for path, file in manifest.files.items()
+        }
+    )
+    return manifest, archives
+
+
+def get_backup_chain(
+    backup_id: str, get_manifest: Callable[[str], Optional[BackupManifest]]
+) -> List[Tuple[str, Optional[BackupManifest]]]:
+    """Get the backups to restore in order, from the full backup to the given one.
+
+    Args:
+        backup_id: Backup to restore.
+        get_manifest: Function getting the manifest of a backup, None if it has none.
+
+    Returns:
+        The id and manifest of each backup to restore, the manifest is None for
+        the backups created without one.
+
+    Raises:
+        ManifestError: If a parent backup has no manifest or the parents form a cycle.
+    """
+    backup_chain = [(backup_id, get_manifest(backup_id))]
+    manifest = backup_chain[0][1]
+    while manifest is not None and manifest.parent is not None:
+        parent_backup_id = manifest.parent
+        if any(chain_id == parent_backup_id for chain_id, _ in backup_chain):
+            raise ManifestError(f"Backup {parent_backup_id} is its own parent.")
+        manifest = get_manifest(parent_backup_id)
+        if manifest is None:
+            raise ManifestError(f"Backup {parent_backup_id} has no manifest.")
+        backup_chain.append((parent_backup_id, manifest))
+    return list(reversed(backup_chain))
+
+
+def get_restore_steps(
+    backup_chain: List[Tuple[str, Optional[BackupManifest]]], paths: Optional[List[str]]
+) -> List[Mapping[str, Optional[List[str]]]]:
+    """Get the archives to restore, in restore order.
+
+    The archives of a step hold different files, so they are restored at the same
+    time. Each backup of the chain is a step when it is restored whole.
+
+    Args:
+        backup_chain: id and manifest of each backup to restore, in restore order.
+        paths: Files or directories to restore, shell patterns are allowed. None to
+            restore the whole backup.
+
+    Returns:
+        The files to extract from each archive of each step, by archive name. The
+        files are None to extract the whole archive.
+    """
+    if paths is None:
+        return [
+            dict.fromkeys(manifest.get_archive_names(chain_id) if manifest else [chain_id])
+            for chain_id, manifest in backup_chain
+        ]
+    return [_select_archive_members(backup_chain, paths)]
+
+
+def _select_archive_members(
+    backup_chain: List[Tuple[str, Optional[BackupManifest]]], paths: List[str]
+) -> Dict[str, List[str]]:
+    """Find the archives holding the files of a backup matching the given paths.
+
+    A file changed in an incremental backup is taken from the archive of the last
+    backup that archived it.
+
+    Args:
+        backup_chain: id and manifest of each backup to restore, in restore order.
+        paths: Files or directories to restore, shell patterns are allowed.
+
+    Returns:
+        The files to extract from each archive, by archive name.
+
+    Raises:
+        ManifestError: If the backup has no manifest or no file matches the paths.
+    """
+    backup_id, last_manifest = backup_chain[-1]
+    if last_manifest is None:
+        raise ManifestError(f"Backup {backup_id} has no manifest.")
+    archive_members: Dict[str, List[str]] = {}
+    for path in sorted(last_manifest.files):
+        if not any(
+            fnmatch.fnmatch(path, pattern) or path.startswith(pattern.rstrip("/") + "/")
+            for pattern in paths
+        ):
+            continue
+        for chain_id, manifest in reversed(backup_chain):
+            archive = manifest.files[path][3] if manifest and path in manifest.files else None
+            if archive is not None:
+                archive_name = manifest.get_archive_names(chain_id)[archive]  # type: ignore
+                archive_members.setdefault(archive_name, []).append(path)
+                break
+        else:
+            raise ManifestError(f"No archive of {path} in the manifests.")
+    if not archive_members:
+        raise ManifestError(f"No file of {backup_id} matches {paths}.")
+    return archive_members
+
+
+def get_deleted_files(backup_chain: List[Tuple[str, Optional[BackupManifest]]]) -> List[str]:
+    """Get the files restored from a parent backup that are not in the last backup.
+
+    Args:
+        backup_chain: id and manifest of each restored backup, in restore order.
+
+    Returns:
+        The files deleted since the parent backups, sorted.
+    """
+    last_manifest = backup_chain[-1][1]
+    if last_manifest is None:
+        return []
+    restored_paths: set[str] = set()
+    for _, manifest in backup_chain[:-1]:
+        restored_paths.update(manifest.files if manifest else {})
+    return sorted(restored_paths.difference(last_manifest.files))
+
+
+def _list_files(container: ops.Container, paths: Iterable[str]) -> Dict[str, Tuple[int, str]]:
+    """List the files under the given paths.
+
+    Args:
+        container: Synapse Container.
+        paths: Paths to list.
+
+    Returns:
+        The size and modification time of each file, by path.
+
+    Raises:
+        ManifestError: If there was an error listing the files.
+    """
+    quoted_paths = " ".join(f"'{path}'" for path in paths)
+    command = f"set -euo pipefail; find {quoted_paths} -type f -printf '%s %T@ %p\\0'"
+    try:
+        stdout, _ = container.exec(
+            [BASH_COMMAND, "-c", command],
+            user=synapse.SYNAPSE_USER,
+            group=synapse.SYNAPSE_GROUP,
+        ).wait_output()
+    except (APIError, ExecError) as exc:
+        raise ManifestError("Error listing the files.") from exc
+    files = {}
+    for entry in stdout.split("\0"):
+        if not entry:
+            continue
+        size, mtime, path = entry.split(" ", 2)
+        files[path] = (int(size), mtime)
+    return files
+
+
+def _hash_files(container: ops.Container, paths: List[str]) -> Dict[str, str]:
+    """Hash the content of the given files with SHA-256.
+
+    Args:
+        container: Synapse Container.
+        paths: Files to hash.
+
+    Returns:
+        The hash of each file, by path. Files removed in the meantime are missing.
+
+    Raises:
+        ManifestError: If there was an error hashing the files, or a file that still
+            exists could not be hashed.
+    """
+    if not paths:
+        return {}
+    command = (
+        "set -uo pipefail; "
+        f'xargs -0 -r -n {HASH_BATCH_SIZE} -P "$(nproc)" sha256sum --zero; '
+        # Files removed since they were listed make sha256sum fail.
+        "status=$?; [ $status -eq 0 ] || [ $status -eq 123 ]"
+    )
+    try:
+        stdout, _ = container.exec(
+            [BASH_COMMAND, "-c", command],
+            stdin="\0".join(paths),
+            user=synapse.SYNAPSE_USER,
+            group=synapse.SYNAPSE_GROUP,
+        ).wait_output()
+    except (APIError, ExecError) as exc:
+        raise ManifestError("Error hashing the files.") from exc
+    hashes = {}
+    for entry in stdout.split("\0"):
+        if not entry:
+            continue
+        file_hash, _, path = entry.partition(" ")
+        # sha256sum separates the hash from the path with " " or " *" on binary mode.
+        hashes[path[1:]] = file_hash
+    try:
+        unreadable_paths = [
+            path for path in paths if path not in hashes and container.exists(path)
+        ]
+    except APIError as exc:
+        raise ManifestError("Error checking the files not hashed.") from exc
+    if unreadable_paths:
+        logger.error("Files that cannot be hashed: %s", unreadable_paths)
+        raise ManifestError(f"{len(unreadable_paths)} files cannot be hashed, see the logs.")
+    return hashes
+
+
+def _get_shard_count(container: ops.Container, shards: int, file_sizes: Dict[str, int]) -> int:
+    """Get the number of shards to split a backup in.
+
+    Args:
+        container: Synapse Container.
+        shards: Maximum number of shards, 0 for one per CPU of the container.
+        file_sizes: size of each file to archive, by path.
+
+    Returns:
+        The number of shards, each of them at least MIN_SHARD_SIZE, 1 if the backup
+        is not split.
+    """
+    shard_count = min(len(file_sizes), sum(file_sizes.values()) // MIN_SHARD_SIZE)
+    if shard_count <= 1:
+        # The CPUs are not read for the backups too small to be split.
+        return 1
+    if shards <= 0:
+        shards = synapse.get_cpu_count(container)
+    return max(1, min(shards, shard_count))
+
+
+def _partition_files(file_sizes: Dict[str, int], shard_count: int) -> List[List[str]]:
+    """Partition files in shards of about the same total size.
+
+    Each file, from the largest, goes to the shard with the smallest total size.
+
+    Args:
+        file_sizes: size of each file, by path.
+        shard_count: number of shards.
+
+    Returns:
+        The files of each shard.
+    """
+    shards: List[Tuple[int, int, List[str]]] = [(0, shard, []) for shard in range(shard_count)]
+    for path, size in sorted(file_sizes.items(), key=lambda item: item[1], reverse=True):
+        total_size, shard, paths = heapq.heappop(shards)
+        paths.append(path)
+        heapq.heappush(shards, (total_size + size, shard, paths))
+    return [paths for _, _, paths in sorted(shards, key=lambda item: item[1])]
+
+
+def _is_config_file(path: str) -> bool:
+    """Check if a file to back up is a configuration file rather than media.
+
+    Args:
+       path: Path of the file.
+
+    Returns:
+       True if the file is one of the configuration files to back up.
+    """
+    return os.path.dirname(path) == synapse.SYNAPSE_CONFIG_DIR and any(
+        fnmatch.fnmatch(os.path.basename(path), pattern) for pattern in BACKUP_FILE_PATTERNS
+    )
+
+
+def _estimate_archive_size(file_sizes: Iterable[int]) -> int:
+    """Estimate the size of the tar archive of files from their sizes.
+
+    The sizes come from the listing of the files made to build the manifest, so
+    the files are not walked again to size the upload. The entries of the
+    directories and the long names add a few blocks not counted here.
+
+    Args:
+        file_sizes: Size of each file to archive.
+
+    Returns:
+        The size of the archive in bytes.
+    """
+    size = sum(
+        TAR_BLOCK_SIZE + math.ceil(file_size / TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+        for file_size in file_sizes
+    )
+    # The archive ends with two empty blocks and is padded to a whole record.
+    return math.ceil((size + 2 * TAR_BLOCK_SIZE) / TAR_RECORD_SIZE) * TAR_RECORD_SIZE
@@ -13,6 +13,7 @@ from ops.framework import Object
 from ops.pebble import APIError, ExecError
 
 import backup
+import backup_transfer
 import synapse
 from s3_parameters import S3Parameters
 
@@ -91,16 +92,101 @@ class BackupObserver(Object):
             event.fail("Missing backup_passphrase config option.")
             return
 
+        try:
+            compression = self._get_compression()
+            parent_backup_id = self._get_parent_backup_id(
+                s3_parameters, bool(event.params.get("incremental"))
+            )
+        except ValueError as exc:
+            event.fail(str(exc))
+            return
+        except backup.S3Error:
+            logger.exception("Error accessing S3 in create backup action")
+            event.fail("Error accessing S3 in create backup action.")
+            return
+
         container = self._charm.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
 
         try:
-            backup_id = backup.create_backup(container, s3_parameters, backup_passphrase)
+            backup_id = backup.create_backup(
+                container,
+                s3_parameters,
+                backup_passphrase,
+                backup.BackupSettings(
+                    transfer_settings=self._get_transfer_settings(),
+                    compression=compression,
+                    parent_backup_id=parent_backup_id,
+                    shards=int(self._charm.config.get("backup_shards") or 0),
+                ),
+            )
         except (backup.BackupError, APIError, ExecError):
             logger.exception("Error Creating Backup.")
             event.fail("Error Creating Backup.")
             return
 
-        event.set_results({"result": "correct", "backup-id": backup_id})
+        results = {"result": "correct", "backup-id": backup_id}
+        if parent_backup_id:
+            results["parent-backup-id"] = parent_backup_id
+        event.set_results(results)
+
+    def _get_compression(self) -> backup.Compression:
+        """Get the compression of the backup archives from the charm configuration.
+
+        Returns:
+            The compression of the backup archives.
+
+        Raises:
+            ValueError: if the compression config options are invalid.
+        """
+        compression = backup.Compression(
+            algorithm=str(self._charm.config.get("backup_compression", backup.COMPRESSION_ZSTD)),
+            level=int(self._charm.config.get("backup_compression_level", 3)),
+        )
+        if compression.algorithm not in backup.ARCHIVE_FORMATS:
+            raise ValueError("Invalid backup_compression config option.")
+        if not 1 <= compression.level <= backup.ZSTD_MAX_LEVEL:
+            raise ValueError("Invalid backup_compression_level config option.")
+        return compression
+
+    def _get_parent_backup_id(
+        self, s3_parameters: S3Parameters, incremental: bool
+    ) -> typing.Optional[str]:
+        """Get the backup a new backup applies on.
+
+        Args:
+            s3_parameters: S3 parameters for the backup.
+            incremental: if the new backup is incremental.
+
+        Returns:
+            The latest backup for an incremental backup if it has a manifest, None
+            otherwise.
+        """
+        if not incremental:
+            return None
+        s3_client = backup.S3Client(s3_parameters)
+        backups = s3_client.list_backups()
+        if not backups:
+            return None
+        latest_backup = max(backups, key=lambda s3_backup: s3_backup.last_modified)
+        if not s3_client.exists_backup(latest_backup.backup_id + backup.MANIFEST_SUFFIX):
+            return None
+        logger.info("Parent backup of the incremental backup: %s", latest_backup.backup_id)
+        return latest_backup.backup_id
+
+    def _get_transfer_settings(self) -> backup_transfer.TransferSettings:
+        """Get the settings of the backup transfers from the charm configuration.
+
+        Returns:
+            The transfer settings, 0 for the ones picked by the charm.
+        """
+        config = self._charm.config
+        return backup_transfer.TransferSettings(
+            max_concurrent_requests=int(config.get("backup_max_concurrent_requests") or 0),
+            multipart_chunksize=int(config.get("backup_multipart_chunksize") or 0)
+            * backup_transfer.MIB,
+            max_bandwidth=str(config.get("backup_max_bandwidth") or ""),
+            memory_budget=int(config.get("backup_memory_budget") or 0) * backup_transfer.MIB,
+        )
 
     def _generate_backup_list_formatted(self, backup_list: list[backup.S3Backup]) -> str:
         """Generate a formatted string for the backups.
@@ -189,7 +275,16 @@ class BackupObserver(Object):
         container = self._charm.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
 
         try:
-            backup.restore_backup(container, s3_parameters, backup_passphrase, backup_id)
+            backup.restore_backup(
+                container,
+                s3_parameters,
+                backup_passphrase,
+                backup_id,
+                backup.RestoreSettings(
+                    transfer_settings=self._get_transfer_settings(),
+                    paths=event.params.get("paths"),
+                ),
+            )
         except (backup.BackupError, APIError, ExecError):
             logger.exception("Error Restoring Backup.")
             event.fail("Error Restoring Backup.")
@@ -215,15 +310,22 @@ class BackupObserver(Object):
 
         try:
             s3_client = backup.S3Client(s3_parameters)
-            if s3_client.exists_backup(backup_id):
-                s3_client.delete_backup(backup_id)
-                result = "correct"
-            else:
+            if not s3_client.exists_backup(backup_id):
                 logger.warning("backup-id %s to delete does not exist.", backup_id)
-                result = f"backup-id {backup_id} does not exist"
+                event.set_results({"result": f"backup-id {backup_id} does not exist"})
+                return
+            # The incremental backups applying on the backup cannot be restored without it.
+            child_backup_ids = s3_client.get_child_backups(backup_id)
+            if child_backup_ids:
+                event.fail(
+                    f"backup-id {backup_id} is the parent of {', '.join(child_backup_ids)},"
+                    " delete them first."
+                )
+                return
+            s3_client.delete_backup(backup_id)
         except backup.S3Error:
             logger.exception("Error deleting backup.")
             event.fail("Error deleting backup.")
             return
 
-        event.set_results({"result": result})
+        event.set_results({"result": "correct"})
@@ -0,0 +1,137 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Provides the settings of the backup transfers to and from S3."""
+
+import logging
+import math
+from typing import NamedTuple, Optional
+
+import ops
+
+from s3_parameters import S3Parameters
+
+MIB = 1024 * 1024
+
+MEMORY_LIMIT_PATH = "/sys/fs/cgroup/memory.max"
+# Memory used by the transfers when the container has no memory limit.
+DEFAULT_MEMORY_BUDGET = 512 * MIB
+# A S3 multipart upload has at most 10000 parts, of at least 5 MiB.
+S3_MAX_PARTS = 10000
+S3_MIN_MULTIPART_CHUNKSIZE = 8 * MIB
+# Upper bound of the concurrent requests picked from the memory budget. A smaller value
+# will minimise memory requirements. A bigger value can make the transfer faster.
+S3_MAX_CONCURRENT_REQUESTS = 10
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransferSettings(NamedTuple):
+    """Settings of the AWS S3 client for the backup transfers.
+
+    The values set to 0 are picked from the size of the backup and the memory
+    limit of the container.
+
+    Attributes:
+        max_concurrent_requests: number of parts transferred at the same time.
+        multipart_chunksize: size of the parts in bytes.
+        max_bandwidth: bandwidth limit in the AWS CLI format, unlimited if empty.
+        memory_budget: memory the transfers can use in bytes.
+    """
+
+    max_concurrent_requests: int = 0
+    multipart_chunksize: int = 0
+    max_bandwidth: str = ""
+    memory_budget: int = 0
+
+
+def resolve_transfer_settings(
+    container: ops.Container,
+    transfer_settings: TransferSettings,
+    expected_size: int,
+    parallel_transfers: int = 1,
+) -> TransferSettings:
+    """Pick the transfer settings set to 0.
+
+    The parts are as small as possible while fitting a multipart upload of the
+    expected size. Each concurrent request holds about two parts in memory, so
+    there are as many requests as fit in the memory budget, up to the number of
+    parts. The memory budget is shared between the parallel transfers, the
+    resolved settings hold the budget of a single transfer.
+
+    Args:
+        container: Synapse Container.
+        transfer_settings: Transfer settings, the ones set to 0 are picked.
+        expected_size: expected size of the largest transfer in bytes, 0 if unknown.
+        parallel_transfers: number of transfers sharing the memory budget.
+
+    Returns:
+        The transfer settings to use.
+    """
+    multipart_chunksize = transfer_settings.multipart_chunksize
+    if multipart_chunksize <= 0:
+        multipart_chunksize = max(
+            S3_MIN_MULTIPART_CHUNKSIZE, math.ceil(expected_size / S3_MAX_PARTS / MIB) * MIB
+        )
+    memory_budget = transfer_settings.memory_budget
+    if memory_budget <= 0:
+        memory_limit = _get_memory_limit(container)
+        memory_budget = memory_limit // 4 if memory_limit else DEFAULT_MEMORY_BUDGET
+    memory_budget //= max(parallel_transfers, 1)
+    max_concurrent_requests = transfer_settings.max_concurrent_requests
+    if max_concurrent_requests <= 0:
+        max_concurrent_requests = min(
+            memory_budget // (2 * multipart_chunksize), S3_MAX_CONCURRENT_REQUESTS
+        )
+        if expected_size:
+            max_concurrent_requests = min(
+                max_concurrent_requests, math.ceil(expected_size / multipart_chunksize)
+            )
+        max_concurrent_requests = max(max_concurrent_requests, 1)
+    resolved_settings = TransferSettings(
+        max_concurrent_requests=max_concurrent_requests,
+        multipart_chunksize=multipart_chunksize,
+        max_bandwidth=transfer_settings.max_bandwidth,
+        memory_budget=memory_budget,
+    )
+    logger.info("Backup transfer settings: %s", resolved_settings)
+    return resolved_settings
+
+
+def build_aws_config(s3_parameters: S3Parameters, transfer_settings: TransferSettings) -> str:
+    """Build the AWS CLI configuration file of the backup transfers.
+
+    Args:
+        s3_parameters: S3 parameters for the backup.
+        transfer_settings: Transfer settings to use.
+
+    Returns:
+        The content of the AWS CLI configuration file.
+    """
+    s3_settings = {
+        "addressing_style": s3_parameters.addressing_style,
+        "max_concurrent_requests": str(transfer_settings.max_concurrent_requests),
+        "multipart_chunksize": str(transfer_settings.multipart_chunksize),
+    }
+    if transfer_settings.max_bandwidth:
+        s3_settings["max_bandwidth"] = transfer_settings.max_bandwidth
+    lines = ["[default]", "s3 ="]
+    lines.extend(f"  {name} = {value}" for name, value in s3_settings.items())
+    return "\n".join(lines) + "\n"
+
+
+def _get_memory_limit(container: ops.Container) -> Optional[int]:
+    """Get the memory limit of the container from its cgroup.
+
+    Args:
+        container: Synapse Container.
+
+    Returns:
+        The memory limit in bytes, None if the container has no limit.
+    """
+    try:
+        with container.pull(MEMORY_LIMIT_PATH) as memory_limit_file:
+            return int(memory_limit_file.read().strip())
+    except (ops.pebble.PathError, ValueError):
+        return None
@@ -5,7 +5,6 @@
 
 """Charm for Synapse on kubernetes."""
 
-
 import logging
 import re
 import typing
@@ -19,18 +18,22 @@ from ops.charm import ActionEvent, RelationDepartedEvent
 
 import actions
 import pebble
+import pebble_tracing
 import synapse
 from admin_access_token import AdminAccessTokenService
 from auth.mas import generate_mas_config
 from backup_observer import BackupObserver
 from database_observer import DatabaseObserver, SynapseDatabaseObserver
+from hook_profiler import HookProfiler
 from matrix_auth_observer import MatrixAuthObserver
 from media_observer import MediaObserver
 from mjolnir import Mjolnir
 from observability import Observability
 from redis_observer import RedisObserver
+from restart_coordinator import RestartCoordinator
 from smtp_observer import SMTPObserver
 from state.charm_state import CharmState
+from state.fingerprint import compute_fingerprint
 from state.mas import MAS_DATABASE_INTEGRATION_NAME, MAS_DATABASE_NAME, MASConfiguration
 from state.validation import CharmBaseWithState, validate_charm_state
 from user import User
@@ -38,6 +41,7 @@ from user import User
 logger = logging.getLogger(__name__)
 
 MAIN_UNIT_ID = "main_unit_id"
+WORKER_PROCESSES = "worker_processes"
 INGRESS_INTEGRATION_NAME = "ingress"
 
 
@@ -52,6 +56,7 @@ class SynapseCharm(CharmBaseWithState):
     # Consider refactoring if more attributes are added.
     # pylint: disable=too-many-instance-attributes
     on = RedisRelationCharmEvents()
+    _stored = ops.StoredState()
 
     def __init__(self, *args: typing.Any) -> None:
         """Construct.
@@ -60,6 +65,12 @@ class SynapseCharm(CharmBaseWithState):
             args: class arguments.
         """
         super().__init__(*args)
+        # The profiler goes first to also cover the construction of the other observers.
+        self._hook_profiler = HookProfiler(self)
+        self._pebble_tracer = pebble_tracing.PebbleTracer(self)
+        self._stored.set_default(reconcile_fingerprint="")
+        self._cpu_count: typing.Optional[int] = None
+        self._restart_coordinator = RestartCoordinator(self, get_main_unit=self.get_main_unit)
         self._backup = BackupObserver(self)
         self._matrix_auth = MatrixAuthObserver(self)
         self._media = MediaObserver(self)
@@ -89,6 +100,7 @@ class SynapseCharm(CharmBaseWithState):
         self._observability = Observability(self)
         self._mjolnir = Mjolnir(self, token_service=self.token_service)
         self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
         self.framework.observe(self.on.leader_elected, self._on_leader_elected)
         self.framework.observe(
             self.on[synapse.SYNAPSE_PEER_RELATION_NAME].relation_departed,
@@ -148,6 +160,34 @@ class SynapseCharm(CharmBaseWithState):
         logger.debug("Unit id from %s is %s", unit_name, unit_id)
         return unit_id
 
+    def get_worker_processes(self, unit: typing.Optional[ops.Unit] = None) -> int:
+        """Get the number of Synapse processes of a worker unit.
+
+        When the worker_processes configuration is 0, each unit runs one process per
+        CPU of its Synapse container and publishes it in the peer relation.
+
+        Args:
+            unit: worker unit, this unit if unset.
+
+        Returns:
+            The number of Synapse processes.
+        """
+        unit = unit or self.unit
+        worker_processes = int(typing.cast(int, self.config.get(WORKER_PROCESSES, 1)))
+        if worker_processes > 0:
+            return worker_processes
+        if unit == self.unit:
+            if self._cpu_count is None:
+                container = self.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+                self._cpu_count = (
+                    synapse.get_cpu_count(container) if container.can_connect() else 1
+                )
+            return self._cpu_count
+        peer_relation = self.model.relations[synapse.SYNAPSE_PEER_RELATION_NAME]
+        if not peer_relation:
+            return 1
+        return int(peer_relation[0].data[unit].get(WORKER_PROCESSES, 1))
+
     def instance_map(self) -> typing.Optional[typing.Dict]:
         """Build instance_map config.
 
@@ -157,9 +197,8 @@ class SynapseCharm(CharmBaseWithState):
         if self.peer_units_total() == 1:
             logger.debug("Only 1 unit found, skipping instance_map.")
             return None
-        unit_name = self.unit.name.replace("/", "-")
         app_name = self.app.name
-        addresses = [f"{unit_name}.{app_name}-endpoints"]
+        units = [self.unit]
         peer_relation = self.model.relations[synapse.SYNAPSE_PEER_RELATION_NAME]
         if peer_relation:
             relation = peer_relation[0]
@@ -167,17 +206,15 @@ class SynapseCharm(CharmBaseWithState):
             # since a relation-changed is emitted for every relation-joined event,
             # the relation-changed handler will reconcile the configuration and
             # instance_map will be properly set.
-            for u in relation.units:
-                # <unit-name>.<app-name>-endpoints.<model-name>.svc.cluster.local
-                unit_name = u.name.replace("/", "-")
-                address = f"{unit_name}.{app_name}-endpoints"
-                addresses.append(address)
-        logger.debug("addresses values are: %s", str(addresses))
+            units.extend(relation.units)
+        # <unit-name>.<app-name>-endpoints.<model-name>.svc.cluster.local
+        addresses = {f"{unit.name.replace('/', '-')}.{app_name}-endpoints": unit for unit in units}
+        logger.debug("addresses values are: %s", str(list(addresses)))
         instance_map = {
             "main": {"host": self.get_main_unit_address(), "port": 8035},
             "federationsender1": {"host": self.get_main_unit_address(), "port": 8034},
         }
-        for address in addresses:
+        for address, unit in addresses.items():
             match = re.search(r"-(\d+)", address)
             # A Juju unit name is s always named on the
             # pattern <application>/<unit ID>, where <application> is the name
@@ -188,6 +225,11 @@ class SynapseCharm(CharmBaseWithState):
             unit_number = match.group(1)  # type: ignore[union-attr]
             instance_name = f"worker{unit_number}"
             instance_map[instance_name] = {"host": address, "port": 8034}
+            for process in range(2, self.get_worker_processes(unit) + 1):
+                instance_map[f"{instance_name}-{process}"] = {
+                    "host": address,
+                    "port": synapse.WORKER_PROCESS_REPLICATION_BASE_PORT + process,
+                }
         logger.debug("instance_map is: %s", str(instance_map))
         return instance_map
 
@@ -207,16 +249,27 @@ class SynapseCharm(CharmBaseWithState):
         if not container.can_connect():
             self.unit.status = ops.MaintenanceStatus("Waiting for Synapse pebble")
             return
+        self._publish_worker_processes()
+        reconcile_fingerprint = self._reconcile_fingerprint(charm_state, mas_configuration)
+        if self._stored.reconcile_fingerprint == reconcile_fingerprint and (
+            pebble.services_are_healthy(container)
+        ):
+            logger.info("Reconcile inputs have not changed, skipping reconcile.")
+            self._set_unit_status()
+            return
+        self._stored.reconcile_fingerprint = ""
+        self._pebble_tracer.record_dispatch()
         self.model.unit.status = ops.MaintenanceStatus("Configuring Synapse")
+        # Start from a fresh read of the configuration file, it is then shared by
+        # every step of the reconcile until it is pushed again.
+        synapse.get_config_snapshot(container).invalidate()
         try:
             # check signing key
             signing_key_path = f"/data/{charm_state.synapse_config.server_name}.signing.key"
             signing_key_from_secret = self.get_signing_key()
             if signing_key_from_secret:
                 logger.debug("Signing key secret was found, pushing it to the container")
-                container.push(
-                    signing_key_path, signing_key_from_secret, make_dirs=True, encoding="utf-8"
-                )
+                synapse.push_files(container, {signing_key_path: signing_key_from_secret})
             rendered_mas_configuration = generate_mas_config(
                 mas_configuration, charm_state.synapse_config, self.get_main_unit_address()
             )
@@ -225,8 +278,12 @@ class SynapseCharm(CharmBaseWithState):
                 charm_state,
                 rendered_mas_configuration,
                 container,
-                is_main=self.is_main(),
-                unit_number=self.get_unit_number(),
+                pebble.UnitSettings(
+                    is_main=self.is_main(),
+                    unit_number=self.get_unit_number(),
+                    worker_processes=self.get_worker_processes(),
+                    acquire_restart=self._restart_coordinator.acquire,
+                ),
             )
 
             # create new signing key if needed
@@ -239,12 +296,70 @@ class SynapseCharm(CharmBaseWithState):
             # update matrix-auth integration with configuration data
             if self.unit.is_leader():
                 self._matrix_auth.update_matrix_auth_integration(charm_state)
+        except pebble.RestartNotGrantedError as exc:
+            # The restart will be granted by the leader through the peer relation.
+            self.model.unit.status = ops.MaintenanceStatus(str(exc))
+            return
         except (pebble.PebbleServiceError, FileNotFoundError) as exc:
+            # Do not hold the other units back on a failed reconcile.
+            self._restart_coordinator.release()
             self.model.unit.status = ops.BlockedStatus(str(exc))
             return
-        pebble.restart_nginx(container, self.get_main_unit_address())
+        self._restart_coordinator.release_when_ready()
+        pebble.restart_nginx(
+            container,
+            synapse.NginxSettings(
+                main_unit_address=self.get_main_unit_address(),
+                worker_role=synapse.get_worker_role(
+                    charm_state, self.get_unit_number(), self.is_main()
+                ),
+                worker_processes=1 if self.is_main() else self.get_worker_processes(),
+                is_main=self.is_main(),
+                sync_servers=synapse.get_sync_servers(charm_state),
+            ),
+        )
+        self._stored.reconcile_fingerprint = reconcile_fingerprint
         self._set_unit_status()
 
+    def _publish_worker_processes(self) -> None:
+        """Publish the number of Synapse processes of this unit to the other units."""
+        peer_relation = self.model.relations[synapse.SYNAPSE_PEER_RELATION_NAME]
+        if not peer_relation:
+            return
+        unit_data = peer_relation[0].data[self.unit]
+        worker_processes = str(self.get_worker_processes())
+        if unit_data.get(WORKER_PROCESSES, "1") != worker_processes:
+            unit_data[WORKER_PROCESSES] = worker_processes
+
+    def _reconcile_fingerprint(
+        self, charm_state: CharmState, mas_configuration: MASConfiguration
+    ) -> str:
+        """Compute the fingerprint of every input of the reconcile.
+
+        Args:
+            charm_state: Instance of CharmState
+            mas_configuration: Charm state component to configure MAS
+
+        Returns:
+            The reconcile fingerprint.
+        """
+        matrix_auth_relations = [
+            (relation.id, sorted(unit.name for unit in relation.units))
+            for relation in self.model.relations["matrix-auth"]
+        ]
+        return compute_fingerprint(
+            charm_state,
+            charm_state.proxy,
+            mas_configuration,
+            self.get_main_unit_address(),
+            self.get_unit_number(),
+            self.get_worker_processes(),
+            self.get_signing_key(),
+            self.is_main(),
+            self.unit.is_leader(),
+            matrix_auth_relations,
+        )
+
     def _set_unit_status(self) -> None:
         """Set unit status depending on Synapse and NGINX state."""
         # This method contains a similar check that the one in mjolnir.py for Synapse
@@ -306,6 +421,14 @@ class SynapseCharm(CharmBaseWithState):
         self.reconcile(charm_state, mas_configuration)
         self._set_workload_version()
 
+    def _on_upgrade_charm(self, _: ops.HookEvent) -> None:
+        """Handle charm upgrade.
+
+        The new charm code may configure the workload differently, so the next
+        reconcile must not be skipped.
+        """
+        self._stored.reconcile_fingerprint = ""
+
     @validate_charm_state
     def _on_relation_departed(self, event: RelationDepartedEvent) -> None:
         """Handle Synapse peer relation departed event.
@@ -351,6 +474,8 @@ class SynapseCharm(CharmBaseWithState):
             self.unit.status = ops.BlockedStatus("Redis integration is required.")
             return
         self.unit.status = ops.ActiveStatus()
+        # The workload container may have been restarted, losing anything not in /data.
+        self._stored.reconcile_fingerprint = ""
         logger.debug("_on_synapse_pebble_ready emitting reconcile")
         self.reconcile(charm_state, mas_configuration)
 
@@ -2,16 +2,18 @@
 # See LICENSE file for licensing details.
 
 """The DatabaseClient class."""
+
+# pylint: disable=import-outside-toplevel
+
 import logging
 import typing
 
-import psycopg2
-from psycopg2 import sql
-from psycopg2.extensions import connection
-
 from charm_types import DatasourcePostgreSQL
 from exceptions import CharmDatabaseRelationNotFoundError
 
+if typing.TYPE_CHECKING:  # pragma: no cover
+    from psycopg2.extensions import connection
+
 logger = logging.getLogger(__name__)
 
 
@@ -36,7 +38,7 @@ class DatabaseClient:
         self._datasource = datasource
         self._database_name = datasource["db"]
         self._alternative_database = alternative_database
-        self._conn: connection = None
+        self._conn: "connection" = None
 
     def _connect(self) -> None:
         """Get connection.
@@ -44,6 +46,8 @@ class DatabaseClient:
         Raises:
             Error: something went wrong while connecting to the database.
         """
+        import psycopg2
+
         if self._conn is None or self._conn.closed != 0:
             logger.debug("Connecting to database")
             try:
@@ -76,6 +80,9 @@ class DatabaseClient:
         Raises:
             Error: something went wrong while preparing the database.
         """
+        import psycopg2
+        from psycopg2 import sql
+
         try:
             self._connect()
             with self._conn.cursor() as curs:
@@ -112,6 +119,9 @@ class DatabaseClient:
         """
         # Since is not possible to delete the database while connected to it
         # this connection will use the template1 database, provided by PostgreSQL.
+        import psycopg2
+        from psycopg2 import sql
+
         try:
             self._connect()
             with self._conn.cursor() as curs:
@@ -0,0 +1,156 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Provide the HookProfiler class to profile the charm hooks."""
+
+# pylint: disable=import-outside-toplevel
+
+import atexit
+import io
+import logging
+import os
+import pathlib
+import time
+import typing
+
+import ops
+from ops.charm import ActionEvent
+
+if typing.TYPE_CHECKING:
+    from cProfile import Profile
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HOOKS_CONFIG_NAME = "profile_hooks"
+# Kept in the charm directory, next to the unit state.
+PROFILE_DIR_NAME = ".hook-profiles"
+PROFILE_RING_SIZE = 20
+PROFILE_SUFFIX = ".pstats"
+GET_HOOK_PROFILE_ACTION_NAME = "get-hook-profile"
+
+
+def get_hook_name() -> str:
+    """Get the name of the hook or action being dispatched.
+
+    Returns:
+        The hook or action name, "unknown" if it is not set by Juju.
+    """
+    dispatch_path = os.environ.get("JUJU_DISPATCH_PATH", "")
+    return pathlib.PurePath(dispatch_path).name or "unknown"
+
+
+def get_profiles(profile_dir: pathlib.Path) -> list[pathlib.Path]:
+    """Get the stored hook profiles.
+
+    Args:
+        profile_dir: directory of the hook profiles.
+
+    Returns:
+        The hook profile files, from the oldest to the most recent.
+    """
+    if not profile_dir.is_dir():
+        return []
+    return sorted(profile_dir.glob(f"*{PROFILE_SUFFIX}"))
+
+
+def format_profile(profile: pathlib.Path, limit: int) -> str:
+    """Format the functions of a hook profile with the highest cumulative time.
+
+    Args:
+        profile: hook profile file.
+        limit: number of functions to include.
+
+    Returns:
+        The formatted statistics.
+    """
+    import pstats
+
+    output = io.StringIO()
+    stats = pstats.Stats(str(profile), stream=output)
+    stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return output.getvalue().strip()
+
+
+class HookProfiler(ops.Object):
+    """Profile each hook dispatch when the profile_hooks configuration is enabled.
+
+    The profiler is started when the charm is constructed and stopped when the
+    framework commits, so it covers the handlers of every observer. Hooks failing
+    before the commit are stored when the interpreter exits. Profiles are kept in a
+    ring buffer of PROFILE_RING_SIZE files in the charm directory.
+
+    Attrs:
+        profile_dir: directory of the hook profiles.
+    """
+
+    def __init__(self, charm: ops.CharmBase):
+        """Initialize a new instance of the HookProfiler class.
+
+        Args:
+            charm: The charm object that the HookProfiler instance belongs to.
+        """
+        super().__init__(charm, "hook-profiler")
+        self._charm = charm
+        self.profile_dir = pathlib.Path(charm.charm_dir) / PROFILE_DIR_NAME
+        self._hook_name = get_hook_name()
+        self._profile: typing.Optional["Profile"] = None
+        self.framework.observe(charm.on.get_hook_profile_action, self._on_get_hook_profile_action)
+        if (
+            charm.config.get(PROFILE_HOOKS_CONFIG_NAME)
+            and self._hook_name != GET_HOOK_PROFILE_ACTION_NAME
+        ):
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            self.framework.observe(self.framework.on.commit, self._on_commit)
+            atexit.register(self.store_profile)
+
+    def _on_commit(self, _: ops.EventBase) -> None:
+        """Store the profile of the hook once the framework commits."""
+        self.store_profile()
+
+    def store_profile(self) -> None:
+        """Store the profile of the hook, if not stored yet, and drop the oldest ones."""
+        if self._profile is None:
+            return
+        atexit.unregister(self.store_profile)
+        self._profile.disable()
+        try:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            # Zero padded so the profiles sort by name from the oldest to the most recent.
+            profile_name = f"{time.time_ns():020d}-{self._hook_name}{PROFILE_SUFFIX}"
+            profile_path = self.profile_dir / profile_name
+            self._profile.dump_stats(profile_path)
+            for profile in get_profiles(self.profile_dir)[:-PROFILE_RING_SIZE]:
+                profile.unlink(missing_ok=True)
+        except OSError:
+            logger.exception("Failed to store the profile of hook %s", self._hook_name)
+        self._profile = None
+
+    def _on_get_hook_profile_action(self, event: ActionEvent) -> None:
+        """Return the functions with the highest cumulative time of the last hooks.
+
+        Args:
+            event: Event triggering the get hook profile action.
+        """
+        hooks = int(event.params["hooks"])
+        limit = int(event.params["limit"])
+        profiles = get_profiles(self.profile_dir)[-hooks:] if hooks > 0 else []
+        if not profiles:
+            event.fail(
+                f"No hook profile found, set the {PROFILE_HOOKS_CONFIG_NAME} configuration "
+                "to profile the hooks."
+            )
+            return
+        results = {}
+        for index, profile in enumerate(reversed(profiles), start=1):
+            timestamp, _, hook_name = profile.stem.partition("-")
+            results[str(index)] = {
+                "hook": hook_name,
+                "timestamp": time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ", time.gmtime(int(timestamp) / 1_000_000_000)
+                ),
+                "stats": format_profile(profile, limit),
+            }
+        event.set_results({"profiles": results})
@@ -3,6 +3,7 @@
 
 """Provide the Observability class to represent the observability stack for Synapse."""
 
+import pathlib
 
 import ops
 from charms.grafana_k8s.v0.grafana_dashboard import GrafanaDashboardProvider
@@ -33,6 +34,9 @@ class Observability:  # pylint: disable=too-few-public-methods
         synapse_stats_target = [
             f"*:{synapse.STATS_EXPORTER_PORT}",
         ]
+        charm_pebble_target = [
+            f"*:{synapse.PEBBLE_METRICS_PORT}",
+        ]
         self._metrics_endpoint = MetricsEndpointProvider(
             charm,
             relation_name="metrics-endpoint",
@@ -45,6 +49,11 @@ class Observability:  # pylint: disable=too-few-public-methods
                     "job_name": "synapse_stats_exporter",
                     "static_configs": [{"targets": synapse_stats_target}],
                 },
+                {
+                    "job_name": "synapse_charm_pebble",
+                    "metrics_path": f"/{pathlib.PurePath(synapse.PEBBLE_METRICS_PATH).name}",
+                    "static_configs": [{"targets": charm_pebble_target}],
+                },
             ],
         )
         self._logging = LogProxyConsumer(
@@ -8,12 +8,13 @@
 
 """Class to interact with pebble."""
 
+# pylint: disable=import-outside-toplevel
+
 import logging
 import typing
 
 import ops
 import yaml
-from deepdiff import DeepDiff
 from ops.pebble import Check
 
 import synapse
@@ -23,6 +24,35 @@ logger = logging.getLogger(__name__)
 
 STATS_EXPORTER_SERVICE_NAME = "stats-exporter"
 MAS_CONFIGURATION_PATH = "/mas/config.yaml"
+FEDERATION_SENDERS_LAYER_NAME = "synapse-federation-senders"
+WORKER_PROCESSES_LAYER_NAME = "synapse-worker-processes"
+# Prefix of the names of the services of each generic worker services layer.
+GENERIC_WORKER_SERVICE_PREFIXES = {
+    FEDERATION_SENDERS_LAYER_NAME: synapse.SYNAPSE_FEDERATION_SENDERS_SERVICE_PREFIX,
+    WORKER_PROCESSES_LAYER_NAME: synapse.SYNAPSE_WORKER_PROCESS_SERVICE_PREFIX,
+}
+
+
+class UnitSettings(typing.NamedTuple):
+    """Settings of the Synapse processes of the unit.
+
+    Attributes:
+        is_main: if unit is main.
+        unit_number: unit number id to set the worker name.
+        worker_processes: number of Synapse processes of a worker unit.
+        acquire_restart: called before changing anything that restarts a running Synapse,
+            returns False if the restart is not allowed yet. Restarts are always allowed
+            if unset.
+    """
+
+    is_main: bool = True
+    unit_number: str = ""
+    worker_processes: int = 1
+    acquire_restart: typing.Optional[typing.Callable[[], bool]] = None
+
+
+class RestartNotGrantedError(Exception):
+    """Exception raised when Synapse needs a restart that is not granted yet."""
 
 
 class PebbleServiceError(Exception):
@@ -130,16 +160,51 @@ def check_mjolnir_ready() -> ops.pebble.CheckDict:
     return check.to_dict()
 
 
-def restart_nginx(container: ops.model.Container, main_unit_address: str) -> None:
-    """Restart Synapse NGINX service and regenerate configuration.
+def restart_nginx(container: ops.model.Container, settings: synapse.NginxSettings) -> None:
+    """Regenerate NGINX configuration and apply it to the Synapse NGINX service.
+
+    NGINX is only reloaded when the configuration changed, so the proxied
+    connections are kept. It is restarted if it is not running or the reload fails.
 
     Args:
         container: Charm container.
-        main_unit_address: Main unit address to be used in configuration.
+        settings: Settings of the NGINX configuration of the unit.
     """
     container.add_layer("synapse-nginx", _nginx_pebble_layer(), combine=True)
-    synapse.generate_nginx_config(container=container, main_unit_address=main_unit_address)
-    container.restart(synapse.SYNAPSE_NGINX_SERVICE_NAME)
+    config_changed = synapse.generate_nginx_config(container, settings)
+    services = container.get_services(synapse.SYNAPSE_NGINX_SERVICE_NAME)
+    if not any(service.is_running() for service in services.values()):
+        container.restart(synapse.SYNAPSE_NGINX_SERVICE_NAME)
+        return
+    if not config_changed:
+        return
+    try:
+        synapse.reload_nginx(container)
+    except synapse.InvalidNginxConfigError:
+        logger.exception("NGINX keeps running with its previous configuration")
+    except synapse.WorkloadError:
+        logger.exception("Failed to reload NGINX, restarting it")
+        container.restart(synapse.SYNAPSE_NGINX_SERVICE_NAME)
+
+
+def services_are_healthy(container: ops.model.Container) -> bool:
+    """Check if Synapse and NGINX services are running and no check is failing.
+
+    Args:
+        container: Charm container.
+
+    Returns:
+        True if the services are healthy.
+    """
+    service_names = (synapse.SYNAPSE_SERVICE_NAME, synapse.SYNAPSE_NGINX_SERVICE_NAME)
+    services = container.get_services(*service_names)
+    if services.keys() != set(service_names) or not all(
+        service.is_running() for service in services.values()
+    ):
+        return False
+    return all(
+        check.status != ops.pebble.CheckStatus.DOWN for check in container.get_checks().values()
+    )
 
 
 def restart_federation_sender(container: ops.model.Container, charm_state: CharmState) -> None:
@@ -155,6 +220,171 @@ def restart_federation_sender(container: ops.model.Container, charm_state: Charm
     container.restart(synapse.SYNAPSE_FEDERATION_SENDER_SERVICE_NAME)
 
 
+def _interrupts_running_services(
+    container: ops.model.Container, layer: ops.pebble.LayerDict
+) -> bool:
+    """Check if replanning a layer restarts or stops running services.
+
+    Args:
+        container: Charm container.
+        layer: layer to replan.
+
+    Returns:
+        True if a running service of the layer changes.
+    """
+    layer_services = layer.get("services", {})
+    if not layer_services:
+        return False
+    plan_services = container.get_plan().services
+    return any(
+        service.is_running()
+        and (
+            name not in plan_services
+            or plan_services[name].to_dict()
+            != ops.pebble.Service(name, layer_services[name]).to_dict()
+        )
+        for name, service in container.get_services(*layer_services).items()
+    )
+
+
+def _replan_generic_worker_services(
+    container: ops.model.Container,
+    charm_state: CharmState,
+    layer_name: str,
+    worker_configs: dict[str, tuple[str, dict]],
+    acquire_restart: typing.Optional[typing.Callable[[], bool]],
+) -> list[str]:
+    """Replan extra generic worker services of a unit.
+
+    The services of the layer that are not needed anymore are disabled and
+    stopped. Restarting or stopping running services needs the restart to be
+    allowed, like restarting Synapse.
+
+    Args:
+        container: Charm container.
+        charm_state: Instance of CharmState.
+        layer_name: name of the Pebble layer of the services.
+        worker_configs: configuration path and configuration by service name.
+        acquire_restart: returns False if the restart is not allowed yet.
+
+    Returns:
+        The service names running on the unit.
+
+    Raises:
+        PebbleServiceError: if something goes wrong while interacting with Pebble.
+    """
+    try:
+        synapse.push_files(
+            container,
+            {
+                config_path: yaml.safe_dump(worker_config)
+                for config_path, worker_config in worker_configs.values()
+            },
+        )
+    except ops.pebble.PathError as exc:
+        raise PebbleServiceError(str(exc)) from exc
+    stopped_service_names = [
+        service_name
+        for service_name in container.get_services()
+        if service_name.startswith(GENERIC_WORKER_SERVICE_PREFIXES[layer_name])
+        and service_name not in worker_configs
+    ]
+    if not worker_configs and not stopped_service_names:
+        return []
+    layer = _pebble_layer_generic_worker_services(
+        charm_state,
+        {service_name: config_path for service_name, (config_path, _) in worker_configs.items()},
+        stopped_service_names,
+    )
+    if _interrupts_running_services(container, layer):
+        _acquire_restart(container, acquire_restart)
+    try:
+        container.add_layer(layer_name, layer, combine=True)
+        if stopped_service_names:
+            container.stop(*stopped_service_names)
+        container.replan()
+    except ops.pebble.Error as exc:
+        raise PebbleServiceError(str(exc)) from exc
+    return list(worker_configs)
+
+
+def replan_federation_senders(
+    container: ops.model.Container,
+    charm_state: CharmState,
+    unit_settings: UnitSettings = UnitSettings(),
+) -> list[str]:
+    """Replan the federation senders placed on a worker.
+
+    The federation senders moved to another worker are disabled and stopped.
+
+    Args:
+        container: Charm container.
+        charm_state: Instance of CharmState.
+        unit_settings: Settings of the Synapse processes of the unit.
+
+    Returns:
+        The service names of the federation senders running on the worker.
+    """
+    worker_configs = {}
+    for name, worker in charm_state.federation_sender_workers.items():
+        if (
+            worker != f"worker{unit_settings.unit_number}"
+            or charm_state.instance_map_config is None
+        ):
+            continue
+        port = charm_state.instance_map_config[name]["port"]
+        worker_configs[f"synapse-{name}"] = (
+            synapse.get_federation_sender_config_path(name),
+            synapse.generate_federation_sender_config(name, port),
+        )
+    return _replan_generic_worker_services(
+        container,
+        charm_state,
+        FEDERATION_SENDERS_LAYER_NAME,
+        worker_configs,
+        unit_settings.acquire_restart,
+    )
+
+
+def replan_worker_processes(
+    container: ops.model.Container,
+    charm_state: CharmState,
+    unit_settings: UnitSettings,
+    worker_role: str,
+) -> list[str]:
+    """Replan the extra worker processes of a worker.
+
+    The processes above the number of worker processes are disabled and stopped.
+    The main unit runs a single process.
+
+    Args:
+        container: Charm container.
+        charm_state: Instance of CharmState.
+        unit_settings: Settings of the Synapse processes of the unit.
+        worker_role: role of the worker processes.
+
+    Returns:
+        The service names of the extra worker processes.
+    """
+    worker_processes = 1 if unit_settings.is_main else unit_settings.worker_processes
+    worker_configs = {
+        f"{synapse.SYNAPSE_WORKER_PROCESS_SERVICE_PREFIX}{process}": (
+            synapse.get_worker_process_config_path(process),
+            synapse.generate_worker_process_config(
+                unit_settings.unit_number, process, worker_role
+            ),
+        )
+        for process in range(2, worker_processes + 1)
+    }
+    return _replan_generic_worker_services(
+        container,
+        charm_state,
+        WORKER_PROCESSES_LAYER_NAME,
+        worker_configs,
+        unit_settings.acquire_restart,
+    )
+
+
 def replan_mjolnir(container: ops.model.Container) -> None:
     """Replan Synapse Mjolnir service.
 
@@ -207,22 +437,21 @@ def replan_synapse_federation_sender(
     container.replan()
 
 
-def _get_synapse_config(container: ops.model.Container) -> dict:
+def _get_synapse_config(container: ops.model.Container) -> typing.Tuple[dict, dict]:
     """Get the current Synapse configuration.
 
     Args:
         container: Synapse container.
 
     Returns:
-        dict: Synapse configuration.
+        tuple: existing Synapse configuration and a copy of it to be modified.
 
     Raises:
         PebbleServiceError: if something goes wrong while interacting with Pebble.
     """
     try:
-        config = container.pull(synapse.SYNAPSE_CONFIG_PATH).read()
-        current_synapse_config = yaml.safe_load(config)
-        return current_synapse_config
+        config_snapshot = synapse.get_config_snapshot(container)
+        return config_snapshot.existing(), config_snapshot.desired()
     except ops.pebble.PathError as exc:
         raise PebbleServiceError(str(exc)) from exc
 
@@ -243,9 +472,13 @@ def _push_synapse_config(
         PebbleServiceError: if something goes wrong while interacting with Pebble.
     """
     try:
-        container.push(config_path, yaml.dump(current_synapse_config).encode("utf-8"))
+        container.push(config_path, yaml.safe_dump(current_synapse_config).encode("utf-8"))
     except ops.pebble.PathError as exc:
         raise PebbleServiceError(str(exc)) from exc
+    finally:
+        config_snapshot = synapse.get_config_snapshot(container)
+        if config_path == config_snapshot.path:
+            config_snapshot.invalidate()
 
 
 def _push_mas_config(
@@ -264,7 +497,7 @@ def _push_mas_config(
         PebbleServiceError: if something goes wrong while interacting with Pebble.
     """
     try:
-        container.push(config_path, rendered_mas_config.encode("utf-8"))
+        synapse.push_files(container, {config_path: rendered_mas_config})
     except ops.pebble.PathError as exc:
         raise PebbleServiceError(str(exc)) from exc
 
@@ -282,6 +515,8 @@ def _environment_has_changed(
     Returns:
         True if environment has changed.
     """
+    from deepdiff import DeepDiff
+
     existing_services = container.get_plan().to_dict().get("services", {})
     current_services = _pebble_layer(charm_state, is_main).get("services", {})
 
@@ -298,13 +533,111 @@ def _environment_has_changed(
     return env_has_changed is not None
 
 
+# The complexity of this method will be reviewed.
+def _change_config(  # noqa: C901 pylint: disable=too-many-branches,too-many-statements
+    current_synapse_config: dict, charm_state: CharmState, is_main: bool = True
+) -> None:
+    """Change the Synapse configuration according to the charm state.
+
+    Only the configuration is modified, the services are managed by reconcile.
+
+    Args:
+        current_synapse_config: Synapse configuration to be modified.
+        charm_state: Instance of CharmState
+        is_main: if unit is main.
+    """
+    synapse.set_public_baseurl(current_synapse_config, charm_state)
+    if charm_state.synapse_config.block_non_admin_invites:
+        logger.debug("pebble.change_config: Enabling Block non admin invites")
+        synapse.block_non_admin_invites(current_synapse_config, charm_state=charm_state)
+    synapse.enable_metrics(current_synapse_config)
+    synapse.enable_forgotten_room_retention(current_synapse_config)
+    synapse.enable_media_retention(current_synapse_config)
+    synapse.enable_stale_devices_deletion(current_synapse_config)
+    synapse.enable_rc_joins_remote_rate(current_synapse_config, charm_state=charm_state)
+    synapse.enable_serve_server_wellknown(current_synapse_config)
+    synapse.enable_replication(current_synapse_config)
+    if (
+        charm_state.synapse_config.invite_checker_policy_rooms
+        or charm_state.synapse_config.invite_checker_blocklist_allowlist_url
+    ):
+        logger.debug("pebble.change_config: Enabling enable_synapse_invite_checker")
+        synapse.enable_synapse_invite_checker(current_synapse_config, charm_state=charm_state)
+    if charm_state.synapse_config.limit_remote_rooms_complexity:
+        logger.debug("pebble.change_config: Enabling limit_remote_rooms_complexity")
+        synapse.enable_limit_remote_rooms_complexity(
+            current_synapse_config, charm_state=charm_state
+        )
+    if charm_state.instance_map_config is not None:
+        logger.debug("pebble.change_config: Enabling instance_map")
+        synapse.enable_instance_map(current_synapse_config, charm_state=charm_state)
+        logger.debug("pebble.change_config: Enabling stream_writers")
+        synapse.enable_stream_writers(current_synapse_config, charm_state=charm_state)
+        # the main unit also runs the federation sender worker, the workers running
+        # federation senders need the list of senders to share the destinations
+        if is_main or charm_state.federation_sender_workers:
+            logging.info("pebble.change_config: Enabling Federation Sender")
+            synapse.enable_federation_sender(current_synapse_config, charm_state=charm_state)
+    # also run without roles to give the tasks of removed roles back to the main process
+    synapse.enable_worker_roles(current_synapse_config, charm_state=charm_state)
+    if charm_state.registration_secrets:
+        logger.debug("pebble.change_config: Enabling registration_secrets")
+        synapse.enable_registration_secrets(current_synapse_config, charm_state=charm_state)
+    if charm_state.smtp_config is not None:
+        logger.debug("pebble.change_config: Enabling SMTP")
+        synapse.enable_smtp(current_synapse_config, charm_state=charm_state)
+    if charm_state.media_config is not None:
+        logger.debug("pebble.change_config: Enabling Media")
+        synapse.enable_media(current_synapse_config, charm_state=charm_state)
+    if charm_state.redis_config is not None:
+        logger.debug("pebble.change_config: Enabling Redis")
+        synapse.enable_redis(current_synapse_config, charm_state=charm_state)
+    if not charm_state.synapse_config.enable_password_config:
+        synapse.disable_password_config(current_synapse_config)
+    if charm_state.synapse_config.federation_domain_whitelist:
+        synapse.enable_federation_domain_whitelist(current_synapse_config, charm_state=charm_state)
+    if charm_state.synapse_config.allow_public_rooms_over_federation:
+        synapse.enable_allow_public_rooms_over_federation(current_synapse_config)
+    if not charm_state.synapse_config.enable_room_list_search:
+        synapse.disable_room_list_search(current_synapse_config)
+    if charm_state.synapse_config.trusted_key_servers:
+        synapse.enable_trusted_key_servers(current_synapse_config, charm_state=charm_state)
+    if charm_state.synapse_config.ip_range_whitelist:
+        synapse.enable_ip_range_whitelist(current_synapse_config, charm_state=charm_state)
+    if charm_state.synapse_config.publish_rooms_allowlist:
+        synapse.enable_room_list_publication_rules(current_synapse_config, charm_state=charm_state)
+
+
+def _acquire_restart(
+    container: ops.model.Container, acquire_restart: typing.Optional[typing.Callable[[], bool]]
+) -> None:
+    """Acquire the right to restart Synapse.
+
+    Starting Synapse for the first time does not interrupt anything, so only
+    restarting a running Synapse needs to be allowed.
+
+    Args:
+        container: Charm container.
+        acquire_restart: returns False if the restart is not allowed yet.
+
+    Raises:
+        RestartNotGrantedError: if the restart is not allowed yet.
+    """
+    if acquire_restart is None:
+        return
+    services = container.get_services(synapse.SYNAPSE_SERVICE_NAME)
+    if not any(service.is_running() for service in services.values()):
+        return
+    if not acquire_restart():
+        raise RestartNotGrantedError("Waiting to restart Synapse")
+
+
 # The complexity of this method will be reviewed.
 def reconcile(  # noqa: C901 pylint: disable=too-many-branches,too-many-statements
     charm_state: CharmState,
     rendered_mas_configuration: str,
     container: ops.model.Container,
-    is_main: bool = True,
-    unit_number: str = "",
+    unit_settings: UnitSettings = UnitSettings(),
 ) -> None:
     """Reconcile Synapse configuration with charm state.
 
@@ -314,108 +647,82 @@ def reconcile(  # noqa: C901 pylint: disable=too-many-branches,too-many-statemen
         charm_state: Instance of CharmState
         rendered_mas_configuration: Rendered MAS yaml configuration.
         container: Charm container.
-        is_main: if unit is main.
-        unit_number: unit number id to set the worker name.
+        unit_settings: Settings of the Synapse processes of the unit.
 
     Raises:
         PebbleServiceError: if something goes wrong while interacting with Pebble.
+        RestartNotGrantedError: if Synapse needs a restart that is not allowed yet.
     """
+    from deepdiff import DeepDiff
+
     try:
-        if _environment_has_changed(container=container, charm_state=charm_state, is_main=is_main):
+        if _environment_has_changed(
+            container=container, charm_state=charm_state, is_main=unit_settings.is_main
+        ):
             # Configurations set via environment variables:
             # synapse_report_stats, database, and proxy
             logging.info("Environment has changed, configuration will be recreated.")
+            _acquire_restart(container, unit_settings.acquire_restart)
             synapse.execute_migrate_config(container=container, charm_state=charm_state)
-        existing_synapse_config = _get_synapse_config(container)
-        current_synapse_config = _get_synapse_config(container)
-
-        synapse.set_public_baseurl(current_synapse_config, charm_state)
-        if charm_state.synapse_config.block_non_admin_invites:
-            logger.debug("pebble.change_config: Enabling Block non admin invites")
-            synapse.block_non_admin_invites(current_synapse_config, charm_state=charm_state)
-        synapse.enable_metrics(current_synapse_config)
-        synapse.enable_forgotten_room_retention(current_synapse_config)
-        synapse.enable_media_retention(current_synapse_config)
-        synapse.enable_stale_devices_deletion(current_synapse_config)
-        synapse.enable_rc_joins_remote_rate(current_synapse_config, charm_state=charm_state)
-        synapse.enable_serve_server_wellknown(current_synapse_config)
-        synapse.enable_replication(current_synapse_config)
-        if (
-            charm_state.synapse_config.invite_checker_policy_rooms
-            or charm_state.synapse_config.invite_checker_blocklist_allowlist_url
-        ):
-            logger.debug("pebble.change_config: Enabling enable_synapse_invite_checker")
-            synapse.enable_synapse_invite_checker(current_synapse_config, charm_state=charm_state)
-        if charm_state.synapse_config.limit_remote_rooms_complexity:
-            logger.debug("pebble.change_config: Enabling limit_remote_rooms_complexity")
-            synapse.enable_limit_remote_rooms_complexity(
-                current_synapse_config, charm_state=charm_state
-            )
-        if charm_state.instance_map_config is not None:
-            logger.debug("pebble.change_config: Enabling instance_map")
-            synapse.enable_instance_map(current_synapse_config, charm_state=charm_state)
-            logger.debug("pebble.change_config: Enabling stream_writers")
-            synapse.enable_stream_writers(current_synapse_config, charm_state=charm_state)
-            # the main unit will have an additional layer for running federation sender worker
-            if is_main:
-                logging.info("pebble.change_config: Adding Federation Sender layer")
-                synapse.enable_federation_sender(current_synapse_config)
-                replan_synapse_federation_sender(container=container, charm_state=charm_state)
+        existing_synapse_config, current_synapse_config = _get_synapse_config(container)
+
+        _change_config(
+            current_synapse_config, charm_state=charm_state, is_main=unit_settings.is_main
+        )
+        # the main unit will have an additional layer for running federation sender worker
+        if charm_state.instance_map_config is not None and unit_settings.is_main:
+            logging.info("pebble.change_config: Adding Federation Sender layer")
+            replan_synapse_federation_sender(container=container, charm_state=charm_state)
+        worker_role = synapse.get_worker_role(
+            charm_state, unit_settings.unit_number, unit_settings.is_main
+        )
+        generic_worker_services = [
+            *replan_federation_senders(container, charm_state, unit_settings),
+            *replan_worker_processes(container, charm_state, unit_settings, worker_role),
+        ]
         if charm_state.registration_secrets:
-            logger.debug("pebble.change_config: Enabling registration_secrets")
             synapse.create_registration_secrets_files(container=container, charm_state=charm_state)
-            synapse.enable_registration_secrets(current_synapse_config, charm_state=charm_state)
-        if charm_state.smtp_config is not None:
-            logger.debug("pebble.change_config: Enabling SMTP")
-            synapse.enable_smtp(current_synapse_config, charm_state=charm_state)
-        if charm_state.media_config is not None:
-            logger.debug("pebble.change_config: Enabling Media")
-            synapse.enable_media(current_synapse_config, charm_state=charm_state)
-        if charm_state.redis_config is not None:
-            logger.debug("pebble.change_config: Enabling Redis")
-            synapse.enable_redis(current_synapse_config, charm_state=charm_state)
-        if not charm_state.synapse_config.enable_password_config:
-            synapse.disable_password_config(current_synapse_config)
-        if charm_state.synapse_config.federation_domain_whitelist:
-            synapse.enable_federation_domain_whitelist(
-                current_synapse_config, charm_state=charm_state
-            )
-        if charm_state.synapse_config.allow_public_rooms_over_federation:
-            synapse.enable_allow_public_rooms_over_federation(current_synapse_config)
-        if not charm_state.synapse_config.enable_room_list_search:
-            synapse.disable_room_list_search(current_synapse_config)
-        if charm_state.synapse_config.trusted_key_servers:
-            synapse.enable_trusted_key_servers(current_synapse_config, charm_state=charm_state)
-        if charm_state.synapse_config.ip_range_whitelist:
-            synapse.enable_ip_range_whitelist(current_synapse_config, charm_state=charm_state)
-        if charm_state.synapse_config.publish_rooms_allowlist:
-            synapse.enable_room_list_publication_rules(
-                current_synapse_config, charm_state=charm_state
-            )
-        if charm_state.datasource and is_main:
+        if charm_state.datasource and unit_settings.is_main:
             logger.info("Synapse Stats Exporter enabled.")
             replan_stats_exporter(container=container, charm_state=charm_state)
+        # Compare and push the canonical form so a reconcile with the same inputs
+        # never reports a change.
+        current_synapse_config = synapse.canonicalize_config(current_synapse_config)
         config_has_changed = DeepDiff(
-            existing_synapse_config,
+            synapse.canonicalize_config(existing_synapse_config),
             current_synapse_config,
             ignore_order=True,
             ignore_string_case=True,
         )
-        if config_has_changed:
+        worker_config = {
+            synapse.SYNAPSE_WORKER_CONFIG_PATH: yaml.safe_dump(
+                synapse.generate_worker_config(
+                    unit_settings.unit_number, unit_settings.is_main, worker_role
+                )
+            )
+        }
+        # the role of a worker is only in its worker configuration
+        worker_config_has_changed = (
+            not unit_settings.is_main
+            and not config_has_changed
+            and synapse.get_pushed_files(container).get_changed(worker_config)
+        )
+        if config_has_changed or worker_config_has_changed:
             logging.info("Configuration has changed, Synapse will be restarted.")
             logging.debug("The change is: %s", config_has_changed)
+            _acquire_restart(container, unit_settings.acquire_restart)
             # Push worker configuration
-            _push_synapse_config(
-                container,
-                synapse.generate_worker_config(unit_number, is_main),
-                config_path=synapse.SYNAPSE_WORKER_CONFIG_PATH,
-            )
+            synapse.push_files(container, worker_config)
             # Push main configuration
             _push_synapse_config(container, current_synapse_config)
             synapse.validate_config(container=container)
-            restart_synapse(container=container, charm_state=charm_state, is_main=is_main)
-            if is_main and charm_state.instance_map_config is not None:
+            restart_synapse(
+                container=container, charm_state=charm_state, is_main=unit_settings.is_main
+            )
+            if unit_settings.is_main and charm_state.instance_map_config is not None:
                 restart_federation_sender(container=container, charm_state=charm_state)
+            if generic_worker_services:
+                container.restart(*generic_worker_services)
         else:
             logging.info("Configuration has not changed, no action.")
 
@@ -575,6 +882,42 @@ def _stats_exporter_pebble_layer() -> ops.pebble.LayerDict:
     return typing.cast(ops.pebble.LayerDict, layer)
 
 
+def _pebble_layer_generic_worker_services(
+    charm_state: CharmState, config_paths: dict[str, str], stopped_service_names: list[str]
+) -> ops.pebble.LayerDict:
+    """Return a dictionary representing a Pebble layer.
+
+    Args:
+        charm_state: Instance of CharmState
+        config_paths: worker configuration path by service name.
+        stopped_service_names: services not needed anymore.
+
+    Returns:
+        pebble layer for extra Synapse generic worker services
+    """
+    services: dict[str, dict] = {}
+    for service_name, config_path in config_paths.items():
+        services[service_name] = {
+            "override": "replace",
+            "summary": "Synapse generic worker service",
+            "startup": "enabled",
+            "command": (
+                f"{synapse.SYNAPSE_COMMAND_PATH} run -m synapse.app.generic_worker "
+                f"--config-path {synapse.SYNAPSE_CONFIG_PATH} "
+                f"--config-path {config_path}"
+            ),
+            "environment": synapse.get_environment(charm_state),
+        }
+    for service_name in stopped_service_names:
+        services[service_name] = {"override": "merge", "startup": "disabled"}
+    layer = {
+        "summary": "Synapse generic workers layer",
+        "description": "pebble config layer for extra Synapse generic workers",
+        "services": services,
+    }
+    return typing.cast(ops.pebble.LayerDict, layer)
+
+
 def _pebble_layer_federation_sender(charm_state: CharmState) -> ops.pebble.LayerDict:
     """Return a dictionary representing a Pebble layer.
 
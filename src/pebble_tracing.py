@@ -0,0 +1,382 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Provide the PebbleTracer class to trace the Pebble operations of the charm."""
+
+import contextlib
+import dataclasses
+import functools
+import logging
+import time
+import typing
+import weakref
+
+import ops
+
+import synapse
+from hook_profiler import get_hook_name
+
+logger = logging.getLogger(__name__)
+
+# Pebble client methods used by ops.Container for the operations worth tracing.
+TRACED_OPERATIONS = (
+    "push",
+    "pull",
+    "exec",
+    "add_layer",
+    "replan_services",
+    "restart_services",
+    "list_files",
+    "get_services",
+)
+METRICS_PREFIX = "synapse_charm_pebble"
+
+
+@dataclasses.dataclass
+class OperationStats:
+    """Counters of a Pebble operation.
+
+    Attrs:
+        calls: number of calls.
+        seconds: time spent in the calls.
+        transferred_bytes: bytes pushed, pulled or sent to the standard input.
+    """
+
+    calls: int = 0
+    seconds: float = 0.0
+    transferred_bytes: int = 0
+
+
+# The Pebble operations of the current dispatch, there is one dispatch per process.
+_operation_stats: dict[str, OperationStats] = {}
+
+
+def get_operation_stats() -> dict[str, OperationStats]:
+    """Get the Pebble operations traced since the last reset.
+
+    Returns:
+        The counters of each traced operation.
+    """
+    return dict(_operation_stats)
+
+
+def reset_operation_stats() -> None:
+    """Reset the counters of the traced Pebble operations."""
+    _operation_stats.clear()
+
+
+def _record(operation: str, seconds: float, transferred_bytes: int = 0, calls: int = 1) -> None:
+    """Record a call to a Pebble operation.
+
+    Args:
+        operation: name of the operation.
+        seconds: duration of the call.
+        transferred_bytes: bytes transferred by the call.
+        calls: number of calls, 0 to add time to a call already recorded.
+    """
+    stats = _operation_stats.setdefault(operation, OperationStats())
+    stats.calls += calls
+    stats.seconds += seconds
+    stats.transferred_bytes += transferred_bytes
+
+
+@contextlib.contextmanager
+def _trace(operation: str, transferred_bytes: int = 0, calls: int = 1) -> typing.Iterator[None]:
+    """Time a call to a Pebble operation, failed calls included.
+
+    Args:
+        operation: name of the operation.
+        transferred_bytes: bytes transferred by the call.
+        calls: number of calls, 0 to add time to a call already recorded.
+
+    Yields:
+        Nothing, the call is timed until the context exits.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(operation, time.perf_counter() - start, transferred_bytes, calls)
+
+
+def _size(data: typing.Any, encoding: typing.Optional[str] = "utf-8") -> int:
+    """Get the size of data sent to Pebble.
+
+    Args:
+        data: bytes or string sent, files are not measured.
+        encoding: encoding of the string.
+
+    Returns:
+        The size in bytes, 0 if it cannot be measured without reading the data.
+    """
+    if isinstance(data, bytes):
+        return len(data)
+    if isinstance(data, str):
+        return len(data.encode(encoding or "utf-8"))
+    return 0
+
+
+class _CountingFile:
+    """File pulled from the container that records the bytes read as pulled bytes."""
+
+    def __init__(self, file: typing.Union[typing.BinaryIO, typing.TextIO], encoding: str):
+        """Initialize a new instance of the _CountingFile class.
+
+        Args:
+            file: file returned by Pebble.
+            encoding: encoding of the file, to measure the strings read.
+        """
+        self._file = file
+        self._encoding = encoding
+
+    def read(self, *args: typing.Any) -> typing.Union[bytes, str]:
+        """Read from the file.
+
+        Args:
+            args: read arguments.
+
+        Returns:
+            The data read.
+        """
+        data = self._file.read(*args)
+        _operation_stats.setdefault("pull", OperationStats()).transferred_bytes += _size(
+            data, self._encoding
+        )
+        return data
+
+    def __enter__(self) -> "_CountingFile":
+        """Enter the file context.
+
+        Returns:
+            The file itself.
+        """
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        """Close the file when leaving the context.
+
+        Args:
+            args: exception details.
+        """
+        self._file.close()
+
+    def __getattr__(self, name: str) -> typing.Any:
+        """Get any other attribute from the pulled file.
+
+        Args:
+            name: attribute name.
+
+        Returns:
+            The attribute of the pulled file.
+        """
+        return getattr(self._file, name)
+
+
+def _timed_wait(wait: typing.Callable[..., typing.Any]) -> typing.Callable[..., typing.Any]:
+    """Add the time spent waiting for an executed process to the exec operation.
+
+    Args:
+        wait: wait method of the process.
+
+    Returns:
+        The timed wait method.
+    """
+
+    @functools.wraps(wait)
+    def timed_wait(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        """Wait for the process.
+
+        Args:
+            args: wait arguments.
+            kwargs: wait keyword arguments.
+
+        Returns:
+            The result of the wait method.
+        """
+        with _trace("exec", calls=0):
+            return wait(*args, **kwargs)
+
+    return timed_wait
+
+
+def _traced(
+    operation: str, method: typing.Callable[..., typing.Any]
+) -> typing.Callable[..., typing.Any]:
+    """Count and time the calls to a method of the Pebble client.
+
+    Args:
+        operation: name of the operation.
+        method: method of the Pebble client.
+
+    Returns:
+        The traced method.
+    """
+
+    @functools.wraps(method)
+    def traced(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        """Call the Pebble client method.
+
+        Args:
+            args: method arguments.
+            kwargs: method keyword arguments.
+
+        Returns:
+            The method result, pulled files count the bytes read and executed
+            processes are timed while waited for.
+        """
+        sent = kwargs.get("stdin") if operation == "exec" else None
+        if operation == "push":
+            sent = args[1] if len(args) > 1 else kwargs.get("source")
+        with _trace(operation, _size(sent, kwargs.get("encoding"))):
+            result = method(*args, **kwargs)
+        if operation == "pull":
+            return _CountingFile(result, kwargs.get("encoding") or "utf-8")
+        if operation == "exec":
+            for wait_method in ("wait", "wait_output"):
+                setattr(result, wait_method, _timed_wait(getattr(result, wait_method)))
+        return result
+
+    return traced
+
+
+_traced_clients: "weakref.WeakSet[ops.pebble.Client]" = weakref.WeakSet()
+
+
+def trace_container(container: ops.Container) -> None:
+    """Trace the Pebble operations made through a container.
+
+    The methods of its Pebble client are wrapped once, so every ops.Container method
+    using them is traced, whoever gets the container.
+
+    Args:
+        container: container to trace.
+    """
+    client = container.pebble
+    if client in _traced_clients:
+        return
+    for operation in TRACED_OPERATIONS:
+        setattr(client, operation, _traced(operation, getattr(client, operation)))
+    _traced_clients.add(client)
+
+
+def format_summary(operation_stats: dict[str, OperationStats]) -> str:
+    """Format the Pebble operations in a compact summary.
+
+    Args:
+        operation_stats: counters of each operation.
+
+    Returns:
+        The summary, one entry per operation.
+    """
+    return ", ".join(
+        f"{operation}={stats.calls} ({stats.seconds:.3f}s, {stats.transferred_bytes}B)"
+        for operation, stats in sorted(operation_stats.items())
+    )
+
+
+def render_metrics(totals: dict[str, list]) -> str:
+    """Render the Pebble operation counters in the Prometheus text format.
+
+    Args:
+        totals: calls, seconds and bytes of each "hook operation" key.
+
+    Returns:
+        The Prometheus textfile content.
+    """
+    metrics = (
+        ("operations_total", "Pebble operations made by the charm.", 0),
+        ("operation_seconds_total", "Time spent in Pebble operations by the charm.", 1),
+        ("operation_bytes_total", "Bytes transferred by Pebble operations of the charm.", 2),
+    )
+    lines = []
+    for suffix, description, index in metrics:
+        name = f"{METRICS_PREFIX}_{suffix}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for key, values in sorted(totals.items()):
+            hook, _, operation = key.partition(" ")
+            lines.append(f'{name}{{hook="{hook}",operation="{operation}"}} {values[index]}')
+    return "\n".join(lines) + "\n"
+
+
+class PebbleTracer(ops.Object):
+    """Report the Pebble operations of each hook dispatch.
+
+    The counters of every dispatch are logged before the framework commits. Those of
+    the dispatches that reconcile the workload and of update-status are added to the
+    totals of the previous dispatches, and the totals are written to a Prometheus
+    textfile in the Synapse container on update-status.
+    """
+
+    _stored = ops.StoredState()
+
+    def __init__(self, charm: ops.CharmBase):
+        """Initialize a new instance of the PebbleTracer class.
+
+        Args:
+            charm: The charm object that the PebbleTracer instance belongs to.
+        """
+        super().__init__(charm, "pebble-tracer")
+        self._charm = charm
+        self._hook_name = get_hook_name()
+        self._record_totals = False
+        self._stored.set_default(totals={})
+        reset_operation_stats()
+        for container in charm.unit.containers.values():
+            trace_container(container)
+        self.framework.observe(charm.on.update_status, self._on_update_status)
+        self.framework.observe(self.framework.on.pre_commit, self._on_pre_commit)
+
+    def _get_totals(self) -> dict[str, list]:
+        """Get the totals of the previous dispatches.
+
+        Returns:
+            The calls, seconds and bytes of each "hook operation" key.
+        """
+        # StoredState attributes are typed by an overloaded __getattr__ mypy cannot resolve.
+        return typing.cast(dict[str, list], self._stored.totals)
+
+    def record_dispatch(self) -> None:
+        """Add the Pebble operations of this dispatch to the totals when it commits."""
+        self._record_totals = True
+
+    def _on_update_status(self, _: ops.UpdateStatusEvent) -> None:
+        """Write the totals of the previous dispatches to the Prometheus textfile."""
+        self.record_dispatch()
+        container = self._charm.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+        totals = self._get_totals()
+        if not totals or not container.can_connect():
+            return
+        try:
+            container.push(
+                synapse.PEBBLE_METRICS_PATH,
+                render_metrics(dict(totals)),
+                make_dirs=True,
+            )
+        except ops.pebble.Error:
+            logger.exception("Failed to write the Pebble metrics")
+
+    def _on_pre_commit(self, _: ops.EventBase) -> None:
+        """Log the Pebble operations of the hook and add them to the totals."""
+        operation_stats = get_operation_stats()
+        reset_operation_stats()
+        if not operation_stats:
+            return
+        logger.info(
+            "Pebble operations of hook %s: %s",
+            self._hook_name,
+            format_summary(operation_stats),
+        )
+        if not self._record_totals:
+            return
+        totals = {key: list(values) for key, values in self._get_totals().items()}
+        for operation, stats in operation_stats.items():
+            calls, seconds, transferred_bytes = totals.get(
+                f"{self._hook_name} {operation}", [0, 0.0, 0]
+            )
+            totals[f"{self._hook_name} {operation}"] = [
+                calls + stats.calls,
+                seconds + stats.seconds,
+                transferred_bytes + stats.transferred_bytes,
+            ]
+        self._stored.totals = totals
@@ -0,0 +1,200 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Provide the RestartCoordinator class to roll Synapse restarts across units."""
+
+import json
+import logging
+import time
+import typing
+
+import ops
+
+import synapse
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_RESTARTS_CONFIG_NAME = "max_concurrent_restarts"
+RESTART_GRANTS_KEY = "restart-grants"
+RESTART_RELEASED_KEY = "restart-released"
+RESTART_REQUEST_KEY = "restart-request"
+
+
+def compute_grants(
+    requests: dict[str, str],
+    grants: dict[str, str],
+    main_unit: typing.Optional[str],
+    max_concurrent: int,
+) -> dict[str, str]:
+    """Compute the units allowed to restart.
+
+    Requests are granted in order, at most max_concurrent at the same time. The
+    main unit is never granted together with other units so it does not restart
+    with its workers.
+
+    Args:
+        requests: pending restart request of each unit.
+        grants: restart requests currently granted by unit.
+        main_unit: name of the main unit.
+        max_concurrent: maximum number of units restarting at the same time.
+
+    Returns:
+        The granted restart request of each unit.
+    """
+    new_grants = {
+        unit: request for unit, request in grants.items() if requests.get(unit) == request
+    }
+    for unit, request in sorted(requests.items(), key=lambda item: (item[1], item[0])):
+        if unit in new_grants:
+            continue
+        if len(new_grants) >= max_concurrent or main_unit in new_grants:
+            break
+        if unit == main_unit and new_grants:
+            break
+        new_grants[unit] = request
+    return new_grants
+
+
+class RestartCoordinator(ops.Object):
+    """Coordinate the Synapse restarts of the units through the peer relation.
+
+    A unit that needs to restart Synapse publishes a request in its unit data and
+    waits until the leader grants it in the application data. After restarting, the
+    grant is held until Synapse is ready again, checked when the synapse-ready check
+    recovers, on update-status and on peer changes, so the next unit only restarts
+    after the previous one passes the synapse-ready check.
+    """
+
+    _stored = ops.StoredState()
+
+    def __init__(
+        self, charm: ops.CharmBase, get_main_unit: typing.Callable[[], typing.Optional[str]]
+    ):
+        """Initialize a new instance of the RestartCoordinator class.
+
+        Args:
+            charm: The charm object that the RestartCoordinator instance belongs to.
+            get_main_unit: function returning the name of the main unit.
+        """
+        super().__init__(charm, "restart-coordinator")
+        self._charm = charm
+        self._get_main_unit = get_main_unit
+        self._acquired_request: typing.Optional[str] = None
+        self._stored.set_default(pending_release="")
+        peer_events = charm.on[synapse.SYNAPSE_PEER_RELATION_NAME]
+        self.framework.observe(peer_events.relation_changed, self._on_check_ready)
+        self.framework.observe(peer_events.relation_changed, self._on_peer_relation_changed)
+        self.framework.observe(peer_events.relation_departed, self._on_peer_relation_changed)
+        self.framework.observe(charm.on.leader_elected, self._on_peer_relation_changed)
+        self.framework.observe(charm.on.update_status, self._on_check_ready)
+        self.framework.observe(charm.on.synapse_pebble_check_recovered, self._on_check_ready)
+
+    def _get_relation(self) -> typing.Optional[ops.Relation]:
+        """Get the peer relation when the restarts need to be coordinated.
+
+        Returns:
+            The peer relation, None if this is the only unit.
+        """
+        peer_relation = self._charm.model.relations[synapse.SYNAPSE_PEER_RELATION_NAME]
+        if not peer_relation or self._charm.app.planned_units() <= 1:
+            return None
+        return peer_relation[0]
+
+    def acquire(self) -> bool:
+        """Request a Synapse restart for this unit.
+
+        Returns:
+            True if the unit can restart Synapse now.
+        """
+        relation = self._get_relation()
+        if relation is None:
+            return True
+        unit_data = relation.data[self._charm.unit]
+        request = unit_data.get(RESTART_REQUEST_KEY)
+        if not request or unit_data.get(RESTART_RELEASED_KEY) == request:
+            request = str(time.time_ns())
+            unit_data[RESTART_REQUEST_KEY] = request
+            logger.info("Requesting a Synapse restart: %s", request)
+        if self._charm.unit.is_leader():
+            self._update_grants(relation)
+        grants = json.loads(relation.data[self._charm.app].get(RESTART_GRANTS_KEY, "{}"))
+        if grants.get(self._charm.unit.name) != request:
+            logger.info("Synapse restart %s not granted yet", request)
+            return False
+        self._acquired_request = request
+        return True
+
+    def release(self) -> None:
+        """Release the restart request of this unit, granted or not."""
+        relation = self._get_relation()
+        self._stored.pending_release = ""
+        if relation is None:
+            return
+        unit_data = relation.data[self._charm.unit]
+        request = unit_data.get(RESTART_REQUEST_KEY)
+        if not request or unit_data.get(RESTART_RELEASED_KEY) == request:
+            return
+        logger.info("Releasing Synapse restart %s", request)
+        unit_data[RESTART_RELEASED_KEY] = request
+        if self._charm.unit.is_leader():
+            self._update_grants(relation)
+
+    def release_when_ready(self) -> None:
+        """Release the restart request of this unit once Synapse is ready.
+
+        If Synapse was restarted in this dispatch, the grant is held until a later
+        hook finds Synapse ready. Otherwise, the request is not needed anymore and
+        is released now.
+        """
+        if self._acquired_request is None:
+            self.release()
+            return
+        logger.info("Holding Synapse restart %s until Synapse is ready", self._acquired_request)
+        self._stored.pending_release = self._acquired_request
+
+    def _update_grants(self, relation: ops.Relation) -> None:
+        """Grant the pending restart requests as the leader.
+
+        Args:
+            relation: peer relation.
+        """
+        requests = {}
+        for unit in (self._charm.unit, *relation.units):
+            request = relation.data[unit].get(RESTART_REQUEST_KEY)
+            if request and relation.data[unit].get(RESTART_RELEASED_KEY) != request:
+                requests[unit.name] = request
+        app_data = relation.data[self._charm.app]
+        grants = json.loads(app_data.get(RESTART_GRANTS_KEY, "{}"))
+        max_concurrent = int(self._charm.config.get(MAX_CONCURRENT_RESTARTS_CONFIG_NAME, 1))
+        new_grants = compute_grants(
+            requests, grants, self._get_main_unit(), max(max_concurrent, 1)
+        )
+        if new_grants != grants:
+            logger.info("Granting Synapse restarts: %s", new_grants)
+            app_data[RESTART_GRANTS_KEY] = json.dumps(new_grants, sort_keys=True)
+
+    def _on_peer_relation_changed(self, _: ops.HookEvent) -> None:
+        """Grant the pending restart requests when the peers change."""
+        relation = self._get_relation()
+        if relation is None or not self._charm.unit.is_leader():
+            return
+        self._update_grants(relation)
+
+    def _is_synapse_ready(self) -> bool:
+        """Check if the Synapse service of the unit is running and ready.
+
+        Returns:
+            If Synapse is ready or not.
+        """
+        container = self._charm.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+        if not container.can_connect():
+            return False
+        service = container.get_services(synapse.SYNAPSE_SERVICE_NAME).get(
+            synapse.SYNAPSE_SERVICE_NAME
+        )
+        return service is not None and service.is_running() and synapse.is_ready()
+
+    def _on_check_ready(self, _: ops.HookEvent) -> None:
+        """Release a restart held until Synapse is ready."""
+        if typing.cast(str, self._stored.pending_release) and self._is_synapse_ready():
+            self.release()
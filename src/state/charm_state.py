@@ -2,6 +2,7 @@
 # See LICENSE file for licensing details.
 
 """State of the Charm."""
+
 import dataclasses
 import itertools
 import logging
@@ -31,6 +32,24 @@ from charm_types import (
 
 logger = logging.getLogger(__name__)
 
+# Replication port of a federation sender running on a worker is this port plus its
+# number, so several federation senders can run on the same worker.
+FEDERATION_SENDER_BASE_PORT = 8040
+GENERIC_WORKER_ROLE = "generic"
+WORKER_ROLES = (
+    GENERIC_WORKER_ROLE,
+    "sync",
+    "client_reader",
+    "federation_reader",
+    "media",
+    "pusher",
+    "appservice",
+    "user_directory",
+    "background",
+)
+# Roles of the workers serving the sync requests.
+SYNC_WORKER_ROLES = (GENERIC_WORKER_ROLE, "sync")
+
 
 class CharmConfigInvalidError(Exception):
     """Exception raised when a charm configuration is found to be invalid."""
@@ -60,11 +79,14 @@ class SynapseConfig(BaseModel):  # pylint: disable=too-few-public-methods
         enable_mjolnir: enable_mjolnir config.
         enable_password_config: enable_password_config config.
         enable_room_list_search: enable_room_list_search config.
+        event_persisters: event_persisters config.
         federation_domain_whitelist: federation_domain_whitelist config.
+        federation_senders: federation_senders config.
         invite_checker_blocklist_allowlist_url: invite_checker_blocklist_allowlist_url config.
         invite_checker_policy_rooms: invite_checker_policy_rooms config.
         ip_range_whitelist: ip_range_whitelist config.
         limit_remote_rooms_complexity: limit_remote_rooms_complexity config.
+        max_concurrent_restarts: max_concurrent_restarts config.
         notif_from: defines the "From" address to use when sending emails.
         public_baseurl: public_baseurl config.
         publish_rooms_allowlist: publish_rooms_allowlist config.
@@ -73,7 +95,10 @@ class SynapseConfig(BaseModel):  # pylint: disable=too-few-public-methods
         rc_joins_remote_per_second: rc_join per_second config.
         report_stats: report_stats config.
         server_name: server_name config.
+        sync_affinity: sync_affinity config.
         trusted_key_servers: trusted_key_servers config.
+        worker_processes: worker_processes config.
+        worker_roles: worker_roles config.
         workers_ignore_list: workers_ignore_list config.
     """
 
@@ -83,12 +108,17 @@ class SynapseConfig(BaseModel):  # pylint: disable=too-few-public-methods
     enable_mjolnir: bool = False
     enable_password_config: bool = True
     enable_room_list_search: bool = True
+    event_persisters: str | None = Field(
+        None, regex=r"^\s*(?:[1-9]\d*|worker[\d-]+(?:\s*,\s*worker[\d-]+)*)\s*$"
+    )
     experimental_alive_check: str | None = Field(None)
     federation_domain_whitelist: str | None = Field(None)
+    federation_senders: int = Field(1, ge=1)
     invite_checker_blocklist_allowlist_url: str | None = Field(None)
     invite_checker_policy_rooms: str | None = Field(None)
     ip_range_whitelist: str | None = Field(None, regex=r"^[\.:,/\d]+\d+(?:,[:,\d]+)*$")
     limit_remote_rooms_complexity: float | None = Field(None)
+    max_concurrent_restarts: int = Field(1, ge=1)
     public_baseurl: str = Field(..., min_length=2)
     publish_rooms_allowlist: str | None = Field(None)
     rc_joins_remote_burst_count: int | None = Field(None)
@@ -97,9 +127,12 @@ class SynapseConfig(BaseModel):  # pylint: disable=too-few-public-methods
     server_name: str = Field(..., min_length=2)
     # notif_from should be after server_name because of how the validator is set.
     notif_from: str | None = Field(None)
+    sync_affinity: bool = False
     trusted_key_servers: str | None = Field(
         None, regex=r"^[A-Za-z0-9][A-Za-z0-9-.]*(?:,[A-Za-z0-9][A-Za-z0-9-.]*)*\.\D{2,4}$"
     )
+    worker_processes: int = Field(1, ge=0)
+    worker_roles: typing.Dict[str, str] | None = Field(None)
     workers_ignore_list: str | None = Field(None)
 
     class Config:  # pylint: disable=too-few-public-methods
@@ -195,6 +228,30 @@ class SynapseConfig(BaseModel):  # pylint: disable=too-few-public-methods
                 raise ValidationError(f"Invalid user ID format: {user_id}", cls)
         return value_list
 
+    @validator("worker_roles", pre=True)
+    @classmethod
+    def roles_to_dict(cls, value: str) -> typing.Dict[str, str]:
+        """Convert a comma separated list of unit number and role pairs to dict.
+
+        Args:
+            value: the input value.
+
+        Returns:
+            The role of each worker by worker name.
+
+        Raises:
+            ValueError: if a pair or a role is not as expected.
+        """
+        if value is None:
+            return {}
+        worker_roles = {}
+        for pair in value.split(","):
+            unit_number, _, role = pair.partition(":")
+            if not unit_number.strip().isdigit() or role.strip() not in WORKER_ROLES:
+                raise ValueError(f"Invalid worker role: {pair.strip()}")
+            worker_roles[f"worker{unit_number.strip()}"] = role.strip()
+        return worker_roles
+
     @validator("experimental_alive_check")
     @classmethod
     def to_pebble_check(cls, value: str) -> typing.Dict[str, typing.Union[str, int]]:
@@ -235,6 +292,120 @@ class SynapseConfig(BaseModel):  # pylint: disable=too-few-public-methods
             ) from exc
 
 
+def _sorted_workers(instance_map_config: dict) -> list[str]:
+    """Get the workers of the instance_map sorted by unit number.
+
+    Args:
+        instance_map_config: Instance map configuration with main and worker addresses.
+
+    Returns:
+        The worker names.
+    """
+    return sorted(
+        (name for name in instance_map_config if name.startswith("worker")),
+        # the extra processes of a unit are named worker<unit number>-<process>
+        key=lambda name: tuple(int(part) for part in name.removeprefix("worker").split("-")),
+    )
+
+
+def _select_worker_roles(instance_map_config: dict, worker_roles: typing.Optional[dict]) -> dict:
+    """Get the roles of the workers of the instance_map.
+
+    Args:
+        instance_map_config: Instance map configuration with main and worker addresses.
+        worker_roles: Role of the workers by worker name from the configuration.
+
+    Returns:
+        The role of each worker of the instance_map with a configured role.
+    """
+    selected_roles = {}
+    for worker, role in (worker_roles or {}).items():
+        if worker not in instance_map_config:
+            logger.warning("Worker %s in worker_roles not found in instance_map", worker)
+            continue
+        selected_roles[worker] = role
+    return selected_roles
+
+
+def _select_event_persisters(instance_map_config: dict, event_persisters: str) -> dict:
+    """Keep the workers of the event persister pool only in the instance_map.
+
+    Args:
+        instance_map_config: Instance map configuration with main and worker addresses.
+        event_persisters: number of persisters or comma separated list of workers.
+
+    Returns:
+        The instance_map with main, the federation senders and the persisters.
+    """
+    workers = _sorted_workers(instance_map_config)
+    if event_persisters.strip().isdigit():
+        persisters = workers[: int(event_persisters)]
+    else:
+        persisters = [worker.strip() for worker in event_persisters.split(",")]
+        for worker in set(persisters) - set(workers):
+            logger.warning("Worker %s in event_persisters not found in instance_map", worker)
+    return {
+        name: instance
+        for name, instance in instance_map_config.items()
+        if not name.startswith("worker") or name in persisters
+    }
+
+
+def _place_federation_senders(instance_map_config: dict, federation_senders: int) -> dict:
+    """Place the federation senders running on workers and add them to the instance_map.
+
+    The first federation sender runs on the main unit, the others are spread over
+    the workers by unit number. Their names only depend on the number of federation
+    senders, so scaling the workers moves them without changing how the
+    destinations are shared between them.
+
+    Args:
+        instance_map_config: Instance map configuration with main and worker addresses.
+        federation_senders: number of federation senders.
+
+    Returns:
+        The worker running each federation sender placed on a worker.
+    """
+    workers = [name for name in _sorted_workers(instance_map_config) if "-" not in name]
+    if federation_senders > 1 and not workers:
+        logger.warning("No worker to run the federation senders, only the main unit sends")
+        return {}
+    federation_sender_workers = {}
+    for number in range(2, federation_senders + 1):
+        name = f"federationsender{number}"
+        worker = workers[(number - 2) % len(workers)]
+        federation_sender_workers[name] = worker
+        instance_map_config[name] = {
+            "host": instance_map_config[worker]["host"],
+            "port": FEDERATION_SENDER_BASE_PORT + number,
+        }
+    return federation_sender_workers
+
+
+def _select_sync_workers(
+    instance_map_config: dict, worker_roles: dict, sync_affinity: bool
+) -> dict:
+    """Get the workers of the instance_map serving the sync requests.
+
+    Args:
+        instance_map_config: Instance map configuration with main and worker addresses.
+        worker_roles: Role of the workers by worker name.
+        sync_affinity: sync_affinity config.
+
+    Returns:
+        The host of each worker serving the sync requests, empty if sync_affinity
+        is disabled.
+    """
+    if not sync_affinity:
+        return {}
+    return {
+        name: instance_map_config[name]["host"]
+        for name in _sorted_workers(instance_map_config)
+        # the extra processes of a unit have the role of the unit
+        if worker_roles.get(name.split("-")[0], GENERIC_WORKER_ROLE) in SYNC_WORKER_ROLES
+    }
+
+
 @dataclasses.dataclass(frozen=True)
 class CharmState:  # pylint: disable=too-many-instance-attributes
     """State of the Charm.
@@ -248,6 +419,11 @@ class CharmState:  # pylint: disable=too-many-instance-attributes
         proxy: proxy information.
         instance_map_config: Instance map configuration with main and worker addresses.
         registration_secrets: Registration secrets received via matrix-auth integration.
+        worker_roles: Role of the workers in the deployment by worker name.
+        federation_sender_workers: Worker running each federation sender placed on
+            a worker.
+        sync_workers: Host of each worker the sync requests are routed to by access
+            token, empty if sync_affinity is disabled.
     """
 
     synapse_config: SynapseConfig
@@ -257,6 +433,9 @@ class CharmState:  # pylint: disable=too-many-instance-attributes
     redis_config: typing.Optional[RedisConfiguration]
     instance_map_config: typing.Optional[typing.Dict]
     registration_secrets: typing.Optional[typing.List]
+    worker_roles: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+    federation_sender_workers: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+    sync_workers: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
 
     @property
     def proxy(self) -> "ProxyConfig":
@@ -337,6 +516,25 @@ class CharmState:  # pylint: disable=too-many-instance-attributes
                         logger.warning(
                             "Worker %s in workers_ignore_list not found in instance_map", worker
                         )
+            # roles only apply to the workers of the instance_map
+            worker_roles = {}
+            sync_workers = {}
+            federation_sender_workers = {}
+            if instance_map_config:
+                worker_roles = _select_worker_roles(
+                    instance_map_config, valid_synapse_config.worker_roles
+                )
+                # every sync-capable worker, event persisters or not
+                sync_workers = _select_sync_workers(
+                    instance_map_config, worker_roles, valid_synapse_config.sync_affinity
+                )
+                federation_sender_workers = _place_federation_senders(
+                    instance_map_config, valid_synapse_config.federation_senders
+                )
+            if instance_map_config and valid_synapse_config.event_persisters:
+                instance_map_config = _select_event_persisters(
+                    instance_map_config, valid_synapse_config.event_persisters
+                )
         except ValidationError as exc:
             error_fields = set(
                 itertools.chain.from_iterable(error["loc"] for error in exc.errors())
@@ -351,4 +549,7 @@ class CharmState:  # pylint: disable=too-many-instance-attributes
             redis_config=redis_config,
             instance_map_config=instance_map_config,
             registration_secrets=registration_secrets,
+            worker_roles=worker_roles,
+            federation_sender_workers=federation_sender_workers,
+            sync_workers=sync_workers,
         )
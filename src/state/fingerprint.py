@@ -0,0 +1,53 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Fingerprint of the charm state."""
+import dataclasses
+import hashlib
+import json
+import pathlib
+import typing
+
+import pydantic
+
+# pydantic is causing this no-name-in-module problem
+from pydantic import v1 as pydantic_v1  # pylint: disable=no-name-in-module,import-error
+
+
+def _to_json(value: typing.Any) -> typing.Any:
+    """Convert a value not supported by the JSON encoder.
+
+    Args:
+        value: value to be converted.
+
+    Returns:
+        A JSON serializable representation of the value.
+
+    Raises:
+        TypeError: if the value has no stable representation.
+    """
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, pydantic.BaseModel):
+        return value.model_dump()
+    if isinstance(value, pydantic_v1.BaseModel):
+        return value.dict()
+    if isinstance(value, pathlib.PurePath):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} cannot be fingerprinted")
+
+
+def compute_fingerprint(*inputs: typing.Any) -> str:
+    """Compute a stable fingerprint of the given inputs.
+
+    The fingerprint only depends on the content of the inputs, so the same inputs
+    built in different hooks have the same fingerprint.
+
+    Args:
+        inputs: values to be fingerprinted.
+
+    Returns:
+        The fingerprint as an hexadecimal digest.
+    """
+    content = json.dumps(inputs, sort_keys=True, default=_to_json)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
@@ -9,8 +9,6 @@ import secrets
 import typing
 
 import ops
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
 from ops.model import SecretNotFoundError
 from pydantic import BaseModel, Field, ValidationError
 from ulid import ULID
@@ -75,6 +73,10 @@ def generate_rsa_signing_key() -> SigningKey:
     Returns:
         SigningKey: The private_key, key_id pair
     """
+    # pylint: disable=import-outside-toplevel
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
     key_id = secrets.token_hex(4)
     private_key = rsa.generate_private_key(public_exponent=65537, key_size=4096)
     # PKCS#8 PEM-encoded RSA is a supported format
@@ -9,6 +9,7 @@ from .api import (  # noqa: F401
     ADD_USER_ROOM_URL,
     CREATE_ROOM_URL,
     DEACTIVATE_ACCOUNT_URL,
+    HEALTH_URL,
     LIST_ROOMS_URL,
     LIST_USERS_URL,
     LOGIN_URL,
@@ -25,12 +26,29 @@ from .api import (  # noqa: F401
     get_access_token,
     get_room_id,
     get_version,
+    is_ready,
     is_token_valid,
     make_room_admin,
     override_rate_limit,
     promote_user_admin,
     register_user,
 )
+from .nginx import (  # noqa: F401
+    NGINX_LOCATION_FILES,
+    NginxSettings,
+    generate_nginx_config,
+    get_sync_servers,
+)
+from .workers import (  # noqa: F401
+    WORKER_PROCESS_HTTP_BASE_PORT,
+    WORKER_PROCESS_REPLICATION_BASE_PORT,
+    generate_federation_sender_config,
+    generate_worker_config,
+    generate_worker_process_config,
+    get_federation_sender_config_path,
+    get_worker_process_config_path,
+    get_worker_role,
+)
 from .workload import (  # noqa: F401
     CHECK_ALIVE_NAME,
     CHECK_MJOLNIR_READY_NAME,
@@ -40,37 +58,55 @@ from .workload import (  # noqa: F401
     MJOLNIR_CONFIG_PATH,
     MJOLNIR_HEALTH_PORT,
     MJOLNIR_SERVICE_NAME,
+    NGINX_COMMAND_PATH,
+    PEBBLE_METRICS_DIR,
+    PEBBLE_METRICS_PATH,
+    PEBBLE_METRICS_PORT,
+    PUSHED_FILES_MANIFEST_PATH,
     STATS_EXPORTER_PORT,
     SYNAPSE_COMMAND_PATH,
     SYNAPSE_CONFIG_DIR,
     SYNAPSE_CONFIG_PATH,
+    SYNAPSE_CONFIG_TEMPLATE,
     SYNAPSE_CONTAINER_NAME,
     SYNAPSE_CRON_SERVICE_NAME,
     SYNAPSE_DATA_DIR,
     SYNAPSE_DB_RELATION_NAME,
     SYNAPSE_EXPORTER_PORT,
     SYNAPSE_FEDERATION_SENDER_SERVICE_NAME,
+    SYNAPSE_FEDERATION_SENDERS_SERVICE_PREFIX,
     SYNAPSE_GROUP,
+    SYNAPSE_LOG_CONFIG_PATH,
     SYNAPSE_NGINX_PORT,
     SYNAPSE_NGINX_SERVICE_NAME,
     SYNAPSE_PEER_RELATION_NAME,
     SYNAPSE_SERVICE_NAME,
     SYNAPSE_USER,
     SYNAPSE_WORKER_CONFIG_PATH,
+    SYNAPSE_WORKER_PROCESS_SERVICE_PREFIX,
+    ConfigSnapshot,
     ExecResult,
+    InvalidNginxConfigError,
+    PushedFiles,
+    RenderConfigError,
     WorkloadError,
     create_registration_secrets_files,
     execute_migrate_config,
     generate_mjolnir_config,
-    generate_nginx_config,
-    generate_worker_config,
+    get_config_snapshot,
+    get_cpu_count,
     get_environment,
     get_media_store_path,
+    get_pushed_files,
     get_registration_shared_secret,
+    push_files,
+    reload_nginx,
+    render_homeserver_config,
     validate_config,
 )
 from .workload_configuration import (  # noqa: F401
     block_non_admin_invites,
+    canonicalize_config,
     disable_password_config,
     disable_room_list_search,
     enable_allow_public_rooms_over_federation,
@@ -94,5 +130,6 @@ from .workload_configuration import (  # noqa: F401
     enable_stream_writers,
     enable_synapse_invite_checker,
     enable_trusted_key_servers,
+    enable_worker_roles,
     set_public_baseurl,
 )
@@ -32,6 +32,7 @@ ADD_USER_ROOM_URL = f"{SYNAPSE_URL}/_synapse/admin/v1/join"
 PROMOTE_USER_ADMIN_URL = f"{SYNAPSE_URL}/_synapse/admin/v1/users/user_id/admin"
 CREATE_ROOM_URL = f"{SYNAPSE_URL}/_matrix/client/v3/createRoom"
 DEACTIVATE_ACCOUNT_URL = f"{SYNAPSE_URL}/_synapse/admin/v1/deactivate"
+HEALTH_URL = f"{SYNAPSE_URL}/health"
 LIST_ROOMS_URL = f"{SYNAPSE_URL}/_synapse/admin/v1/rooms"
 LIST_USERS_URL = f"{SYNAPSE_URL}/_synapse/admin/v2/users?from=0&limit=10&name="
 LOGIN_URL = f"{SYNAPSE_URL}/_synapse/admin/v1/users"
@@ -534,3 +535,18 @@ def is_token_valid(access_token: str) -> bool:
         logger.info("Invalid access token")
         return False
     return True
+
+
+def is_ready() -> bool:
+    """Check if Synapse is ready to serve requests making a request to health.
+
+    The request is not retried so it can be polled while Synapse restarts.
+
+    Returns:
+        If Synapse is ready or not.
+    """
+    try:
+        response = requests.get(HEALTH_URL, timeout=5)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        return False
+    return response.ok
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Helper module used to generate the NGINX configuration of a unit."""
+
+# pylint: disable=import-outside-toplevel
+
+import typing
+from pathlib import Path
+
+import ops
+
+from state.charm_state import GENERIC_WORKER_ROLE, CharmState
+
+from .workers import WORKER_PROCESS_HTTP_BASE_PORT, WORKER_ROLE_RESOURCES
+from .workload import push_files
+
+NGINX_LOCAL_UPSTREAM = "synapse_local"
+NGINX_MAIN_UPSTREAM = "synapse_main"
+NGINX_SYNC_UPSTREAM = "synapse_sync"
+# NGINX configuration files proxying the requests of a listener resource.
+NGINX_LOCATION_FILES = {
+    "client": "worker_location.conf",
+    "federation": "federation_location.conf",
+    "media": "media_location.conf",
+}
+
+
+class NginxSettings(typing.NamedTuple):
+    """Settings of the NGINX configuration of a unit.
+
+    Attributes:
+        main_unit_address: Main unit address to be used in configuration.
+        worker_role: role of the local Synapse processes.
+        worker_processes: number of local Synapse processes.
+        is_main: if unit is main.
+        sync_servers: addresses of the workers serving the sync requests by access token.
+    """
+
+    main_unit_address: str
+    worker_role: str = GENERIC_WORKER_ROLE
+    worker_processes: int = 1
+    is_main: bool = True
+    sync_servers: typing.Sequence[str] = ()
+
+
+def generate_nginx_config(container: ops.Container, settings: NginxSettings) -> bool:
+    """Generate NGINX configuration based on templates.
+
+    1. Render the templates.
+    2. Push the rendered files that changed.
+
+    The requests for a resource served by the local Synapse processes are balanced
+    between them, the others are proxied to the main unit. Both upstreams keep
+    their connections alive, and the main unit takes over when the local
+    processes of a worker fail. If sync servers are given, the sync requests are
+    balanced between them by access token instead.
+
+    Args:
+        container: Container of the charm.
+        settings: Settings of the NGINX configuration of the unit.
+
+    Returns:
+        True if the configuration files changed.
+    """
+    from jinja2 import Environment, FileSystemLoader
+
+    file_loader = FileSystemLoader(Path("./templates"), followlinks=True)
+    env = Environment(loader=file_loader, autoescape=True)
+
+    local_ports = [8008] + [
+        WORKER_PROCESS_HTTP_BASE_PORT + process
+        for process in range(2, settings.worker_processes + 1)
+    ]
+    # List of templates and their corresponding output files
+    templates = [
+        ("main_location.conf.j2", "main_location.conf", ""),
+        ("abuse_report_location.conf.j2", "abuse_report_location.conf", ""),
+        ("upstreams.conf.j2", "upstreams.conf", ""),
+    ]
+    for resource, output_file in NGINX_LOCATION_FILES.items():
+        upstream = NGINX_MAIN_UPSTREAM
+        if resource in WORKER_ROLE_RESOURCES[settings.worker_role]:
+            upstream = NGINX_LOCAL_UPSTREAM
+        templates.append(("worker_location.conf.j2", output_file, upstream))
+    # without sync servers, the sync requests are proxied like the other client requests
+    sync_upstream = NGINX_SYNC_UPSTREAM
+    if not settings.sync_servers:
+        sync_upstream = NGINX_MAIN_UPSTREAM
+        if "client" in WORKER_ROLE_RESOURCES[settings.worker_role]:
+            sync_upstream = NGINX_LOCAL_UPSTREAM
+    templates.append(("worker_location.conf.j2", "sync_location.conf", sync_upstream))
+
+    outputs = {}
+    for template_name, output_file, upstream in templates:
+        template = env.get_template(template_name)
+        outputs[output_file] = template.render(
+            main_unit_address=settings.main_unit_address,
+            upstream=upstream,
+            local_upstream=NGINX_LOCAL_UPSTREAM,
+            main_upstream=NGINX_MAIN_UPSTREAM,
+            sync_upstream=NGINX_SYNC_UPSTREAM,
+            local_ports=local_ports,
+            sync_servers=list(settings.sync_servers),
+            is_main=settings.is_main,
+        )
+
+    return bool(
+        push_files(
+            container,
+            {f"/etc/nginx/{output_file}": output for output_file, output in outputs.items()},
+        )
+    )
+
+
+def get_sync_servers(charm_state: CharmState) -> typing.List[str]:
+    """Get the addresses of the workers serving the sync requests by access token.
+
+    Args:
+        charm_state: Instance of CharmState.
+
+    Returns:
+        The HTTP listener address of each sync worker, empty if sync_affinity is disabled.
+    """
+    sync_servers = []
+    for name, host in charm_state.sync_workers.items():
+        _, _, process = name.partition("-")
+        port = WORKER_PROCESS_HTTP_BASE_PORT + int(process) if process else 8008
+        sync_servers.append(f"{host}:{port}")
+    return sync_servers
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Helper module used to generate the configuration of the Synapse workers."""
+
+from state.charm_state import GENERIC_WORKER_ROLE, CharmState
+
+from .workload import SYNAPSE_CONFIG_DIR, SYNAPSE_EXPORTER_PORT
+
+# The HTTP and replication ports of the extra worker processes of a unit are these
+# ports plus the process number.
+WORKER_PROCESS_HTTP_BASE_PORT = 8100
+WORKER_PROCESS_REPLICATION_BASE_PORT = 8200
+
+# Resources of the HTTP listener of a worker by role, the health resource is always
+# served so the worker can be checked.
+WORKER_ROLE_RESOURCES = {
+    GENERIC_WORKER_ROLE: ["client", "federation"],
+    "sync": ["client"],
+    "client_reader": ["client"],
+    "federation_reader": ["federation"],
+    "media": ["media"],
+    "pusher": ["health"],
+    "appservice": ["health"],
+    "user_directory": ["health"],
+    "background": ["health"],
+}
+
+
+def get_worker_role(charm_state: CharmState, unit_number: str, is_main: bool) -> str:
+    """Get the role of the Synapse process of a unit.
+
+    Args:
+        charm_state: Instance of CharmState.
+        unit_number: Unit number of the unit.
+        is_main: if unit is main.
+
+    Returns:
+        The role of the worker, generic for the main unit or workers without role.
+    """
+    if is_main:
+        return GENERIC_WORKER_ROLE
+    return charm_state.worker_roles.get(f"worker{unit_number}", GENERIC_WORKER_ROLE)
+
+
+def generate_worker_config(
+    unit_number: str, is_main: bool, worker_role: str = GENERIC_WORKER_ROLE
+) -> dict:
+    """Generate worker configuration.
+
+    Args:
+        unit_number: Unit number to be used in the worker_name field.
+        is_main: if unit is main.
+        worker_role: role of the worker, setting the resources it serves.
+
+    Returns:
+        Worker configuration.
+    """
+    worker_listeners = [
+        {
+            "type": "http",
+            "bind_addresses": ["::"],
+            "port": 8034,
+            "resources": [{"names": ["replication"]}],
+        }
+    ]
+    if not is_main:
+        worker_listeners.extend(
+            [
+                {
+                    "type": "http",
+                    "bind_addresses": ["::"],
+                    "port": 8008,
+                    "x_forwarded": True,
+                    "resources": [{"names": list(WORKER_ROLE_RESOURCES[worker_role])}],
+                },
+                {
+                    "type": "metrics",
+                    "bind_addresses": ["::"],
+                    "port": int(SYNAPSE_EXPORTER_PORT),
+                },
+            ]
+        )
+    worker_config = {
+        "worker_app": "synapse.app.generic_worker",
+        "worker_name": "federationsender1" if is_main else f"worker{unit_number}",
+        "worker_listeners": worker_listeners,
+        "worker_log_config": "/data/log.config",
+    }
+    return worker_config
+
+
+def generate_worker_process_config(
+    unit_number: str, process: int, worker_role: str = GENERIC_WORKER_ROLE
+) -> dict:
+    """Generate the configuration of an extra worker process of a unit.
+
+    Args:
+        unit_number: Unit number to be used in the worker_name field.
+        process: number of the process in the unit, starting at 2.
+        worker_role: role of the worker, setting the resources it serves.
+
+    Returns:
+        Worker process configuration.
+    """
+    return {
+        "worker_app": "synapse.app.generic_worker",
+        "worker_name": f"worker{unit_number}-{process}",
+        "worker_listeners": [
+            {
+                "type": "http",
+                "bind_addresses": ["::"],
+                "port": WORKER_PROCESS_REPLICATION_BASE_PORT + process,
+                "resources": [{"names": ["replication"]}],
+            },
+            {
+                "type": "http",
+                "bind_addresses": ["::"],
+                "port": WORKER_PROCESS_HTTP_BASE_PORT + process,
+                "x_forwarded": True,
+                "resources": [{"names": list(WORKER_ROLE_RESOURCES[worker_role])}],
+            },
+        ],
+        "worker_log_config": "/data/log.config",
+    }
+
+
+def get_worker_process_config_path(process: int) -> str:
+    """Get the configuration path of an extra worker process of a unit.
+
+    Args:
+        process: number of the process in the unit.
+
+    Returns:
+        The configuration path.
+    """
+    return f"{SYNAPSE_CONFIG_DIR}/worker_process{process}.yaml"
+
+
+def generate_federation_sender_config(name: str, port: int) -> dict:
+    """Generate the configuration of a federation sender running on a worker.
+
+    Args:
+        name: name of the federation sender.
+        port: replication port of the federation sender.
+
+    Returns:
+        Federation sender configuration.
+    """
+    return {
+        "worker_app": "synapse.app.generic_worker",
+        "worker_name": name,
+        "worker_listeners": [
+            {
+                "type": "http",
+                "bind_addresses": ["::"],
+                "port": port,
+                "resources": [{"names": ["replication"]}],
+            }
+        ],
+        "worker_log_config": "/data/log.config",
+    }
+
+
+def get_federation_sender_config_path(name: str) -> str:
+    """Get the configuration path of a federation sender running on a worker.
+
+    Args:
+        name: name of the federation sender.
+
+    Returns:
+        The configuration path.
+    """
+    return f"{SYNAPSE_CONFIG_DIR}/{name}.yaml"
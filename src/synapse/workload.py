@@ -5,14 +5,20 @@
 
 """Helper module used to manage interactions with Synapse."""
 
+# pylint: disable=import-outside-toplevel
+
+import copy
+import hashlib
+import json
 import logging
+import math
 import typing
+import weakref
 from pathlib import Path
 
 import ops
 import yaml
-from jinja2 import Environment, FileSystemLoader
-from ops.pebble import ExecError, PathError
+from ops.pebble import ExecError, FileType, PathError
 
 from state.charm_state import CharmState
 
@@ -28,26 +34,50 @@ COMMAND_MIGRATE_CONFIG = "migrate_config"
 MJOLNIR_CONFIG_PATH = f"{SYNAPSE_CONFIG_DIR}/config/production.yaml"
 MJOLNIR_HEALTH_PORT = 7777
 MJOLNIR_SERVICE_NAME = "mjolnir"
+NGINX_COMMAND_PATH = "/usr/sbin/nginx"
+PEBBLE_METRICS_DIR = "/var/lib/charm-metrics"
+PEBBLE_METRICS_PATH = f"{PEBBLE_METRICS_DIR}/pebble.txt"
+PEBBLE_METRICS_PORT = "9878"
+# Hash of the files pushed by the charm, it is lost with the container like most of them.
+PUSHED_FILES_MANIFEST_PATH = "/run/charm-pushed-files.json"
 SYNAPSE_EXPORTER_PORT = "9000"
 STATS_EXPORTER_PORT = "9877"
 SYNAPSE_COMMAND_PATH = "/start.py"
 SYNAPSE_CONFIG_PATH = f"{SYNAPSE_CONFIG_DIR}/homeserver.yaml"
+SYNAPSE_CONFIG_TEMPLATE = "homeserver.yaml.j2"
 SYNAPSE_CONTAINER_NAME = "synapse"
 SYNAPSE_CRON_SERVICE_NAME = "synapse-cron"
 SYNAPSE_DATA_DIR = "/data"
 SYNAPSE_DEFAULT_MEDIA_STORE_PATH = "/media_store"
 SYNAPSE_FEDERATION_SENDER_SERVICE_NAME = "synapse-federation-sender"
+SYNAPSE_FEDERATION_SENDERS_SERVICE_PREFIX = "synapse-federationsender"
 SYNAPSE_GROUP = "synapse"
+SYNAPSE_LOG_CONFIG_PATH = f"{SYNAPSE_CONFIG_DIR}/log.config"
 SYNAPSE_NGINX_PORT = 8080
 SYNAPSE_NGINX_SERVICE_NAME = "synapse-nginx"
 SYNAPSE_PEER_RELATION_NAME = "synapse-peers"
 SYNAPSE_SERVICE_NAME = "synapse"
 SYNAPSE_USER = "synapse"
 SYNAPSE_WORKER_CONFIG_PATH = f"{SYNAPSE_CONFIG_DIR}/worker.yaml"
+SYNAPSE_WORKER_PROCESS_SERVICE_PREFIX = "synapse-worker-process"
 SYNAPSE_DB_RELATION_NAME = "database"
 
 logger = logging.getLogger(__name__)
 
+# libyaml is much faster than the pure Python loader on large configuration files.
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class ConfigLoader(YamlLoader):  # type: ignore[valid-type,misc]
+    """Safe YAML loader for the Synapse configuration file.
+
+    Configuration files pushed by previous charm revisions may contain tuples,
+    they are loaded as lists.
+    """
+
+
+ConfigLoader.add_constructor("tag:yaml.org,2002:python/tuple", ConfigLoader.construct_yaml_seq)
+
 
 class WorkloadError(Exception):
     """Exception raised when something fails while interacting with workload.
@@ -69,6 +99,10 @@ class CommandMigrateConfigError(WorkloadError):
     """Exception raised when a charm configuration is invalid."""
 
 
+class RenderConfigError(WorkloadError):
+    """Exception raised when the base configuration can not be rendered by the charm."""
+
+
 class ServerNameModifiedError(WorkloadError):
     """Exception raised while checking configuration file."""
 
@@ -85,6 +119,10 @@ class EnableSMTPError(WorkloadError):
     """Exception raised when something goes wrong while enabling SMTP."""
 
 
+class InvalidNginxConfigError(WorkloadError):
+    """Exception raised when the NGINX configuration does not pass its test."""
+
+
 class ExecResult(typing.NamedTuple):
     """A named tuple representing the result of executing a command.
 
@@ -99,6 +137,232 @@ class ExecResult(typing.NamedTuple):
     stderr: str
 
 
+class ConfigSnapshot:
+    """Snapshot of the Synapse configuration file shared during a dispatch.
+
+    The configuration file is pulled and parsed at most once until the snapshot is
+    invalidated. The existing view is shared and must not be modified, the desired
+    view is a copy that can be freely edited.
+
+    Attrs:
+        path: path of the configuration file in the container.
+    """
+
+    def __init__(self, container: ops.Container, path: str = SYNAPSE_CONFIG_PATH):
+        """Initialize the snapshot.
+
+        Args:
+            container: Container of the charm.
+            path: path of the configuration file in the container.
+        """
+        self._container = container
+        self.path = path
+        self._content: typing.Optional[dict] = None
+
+    def existing(self) -> dict:
+        """Get the configuration as found in the container.
+
+        Raises:
+            PathError: if somethings goes wrong while reading the configuration file.
+
+        Returns:
+            configuration shared by all callers, it must not be modified.
+        """
+        if self._content is None:
+            logger.debug("Pulling configuration file %s", self.path)
+            content = self._container.pull(self.path, encoding="utf-8").read()
+            # ConfigLoader is always a safe loader.
+            self._content = yaml.load(content, Loader=ConfigLoader) or {}  # nosec B506
+        return self._content
+
+    def desired(self) -> dict:
+        """Get a copy of the configuration to be modified.
+
+        Returns:
+            configuration copy independent from the existing one.
+        """
+        return copy.deepcopy(self.existing())
+
+    def invalidate(self) -> None:
+        """Discard the parsed configuration so the next read pulls it again."""
+        self._content = None
+
+
+_config_snapshots: "weakref.WeakKeyDictionary[ops.Container, ConfigSnapshot]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_config_snapshot(container: ops.Container) -> ConfigSnapshot:
+    """Get the configuration snapshot shared by everything using this container.
+
+    Args:
+        container: Container of the charm.
+
+    Returns:
+        the configuration snapshot for the container.
+    """
+    config_snapshot = _config_snapshots.get(container)
+    if config_snapshot is None:
+        config_snapshot = ConfigSnapshot(container)
+        _config_snapshots[container] = config_snapshot
+    return config_snapshot
+
+
+class PushedFiles:
+    """Hash of the content of the files pushed by the charm to the container.
+
+    The hashes are kept in a manifest inside the container, pulled at most once.
+    A file missing from the manifest is pulled and hashed instead, so the files
+    are only pushed again when their content changes.
+    """
+
+    def __init__(self, container: ops.Container):
+        """Initialize the pushed files.
+
+        Args:
+            container: Container of the charm.
+        """
+        self._container = container
+        self._manifest: typing.Optional[dict[str, str]] = None
+
+    def _get_manifest(self) -> dict[str, str]:
+        """Get the hash of the files pushed by the charm.
+
+        Returns:
+            The hash of each pushed file by path.
+        """
+        if self._manifest is None:
+            try:
+                with self._container.pull(PUSHED_FILES_MANIFEST_PATH) as manifest_file:
+                    self._manifest = json.load(manifest_file)
+            except (PathError, ValueError):
+                self._manifest = {}
+        return typing.cast(dict[str, str], self._manifest)
+
+    def _get_hash(self, path: str) -> str:
+        """Get the hash of a file in the container.
+
+        Args:
+            path: path of the file.
+
+        Returns:
+            The hash of the file content, empty if the file does not exist.
+        """
+        manifest = self._get_manifest()
+        if path not in manifest:
+            try:
+                with self._container.pull(path, encoding=None) as file:
+                    manifest[path] = hashlib.sha256(file.read()).hexdigest()
+            except PathError:
+                return ""
+        return manifest[path]
+
+    def get_changed(self, files: typing.Mapping[str, typing.Union[str, bytes]]) -> set[str]:
+        """Get the files with a content different from the one in the container.
+
+        Args:
+            files: content of each file by path.
+
+        Returns:
+            The paths of the changed files.
+        """
+        return {
+            path
+            for path, content in files.items()
+            if self._get_hash(path) != _content_hash(content)
+        }
+
+    def push(self, files: typing.Mapping[str, typing.Union[str, bytes]]) -> set[str]:
+        """Push the changed files to the container.
+
+        Args:
+            files: content of each file by path.
+
+        Returns:
+            The paths of the pushed files.
+
+        Raises:
+            PathError: if something goes wrong while pushing the files.
+        """
+        changed = self.get_changed(files)
+        manifest = self._get_manifest()
+        try:
+            for path in sorted(changed):
+                self._container.push(path, files[path], make_dirs=True)
+                manifest[path] = _content_hash(files[path])
+        finally:
+            if changed:
+                self._container.push(
+                    PUSHED_FILES_MANIFEST_PATH, json.dumps(manifest), make_dirs=True
+                )
+        return changed
+
+    def remove(self, paths: typing.Iterable[str]) -> None:
+        """Remove files from the container.
+
+        Args:
+            paths: paths of the files.
+        """
+        manifest = self._get_manifest()
+        removed = False
+        for path in paths:
+            self._container.remove_path(path)
+            removed |= manifest.pop(path, None) is not None
+        if removed:
+            self._container.push(PUSHED_FILES_MANIFEST_PATH, json.dumps(manifest), make_dirs=True)
+
+
+def _content_hash(content: typing.Union[str, bytes]) -> str:
+    """Get the hash of a file content.
+
+    Args:
+        content: file content, strings are encoded in UTF-8.
+
+    Returns:
+        The hexadecimal digest.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+_pushed_files: "weakref.WeakKeyDictionary[ops.Container, PushedFiles]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_pushed_files(container: ops.Container) -> PushedFiles:
+    """Get the pushed files shared by everything using this container.
+
+    Args:
+        container: Container of the charm.
+
+    Returns:
+        the pushed files of the container.
+    """
+    pushed_files = _pushed_files.get(container)
+    if pushed_files is None:
+        pushed_files = PushedFiles(container)
+        _pushed_files[container] = pushed_files
+    return pushed_files
+
+
+def push_files(
+    container: ops.Container, files: typing.Mapping[str, typing.Union[str, bytes]]
+) -> set[str]:
+    """Push files to the container, skipping the ones already there.
+
+    Args:
+        container: Container of the charm.
+        files: content of each file by path.
+
+    Returns:
+        The paths of the pushed files.
+    """
+    return get_pushed_files(container).push(files)
+
+
 def _get_configuration_field(container: ops.Container, fieldname: str) -> typing.Optional[str]:
     """Get configuration field.
 
@@ -113,8 +377,7 @@ def _get_configuration_field(container: ops.Container, fieldname: str) -> typing
         configuration field value.
     """
     try:
-        configuration_content = str(container.pull(SYNAPSE_CONFIG_PATH, encoding="utf-8").read())
-        return yaml.safe_load(configuration_content)[fieldname]
+        return get_config_snapshot(container).existing()[fieldname]
     except PathError as path_error:
         if path_error.kind == "not-found":
             logger.debug(
@@ -245,8 +508,85 @@ def get_environment(charm_state: CharmState) -> typing.Dict[str, str]:
     return environment
 
 
+def _get_migrate_config_environment(
+    container: ops.Container, charm_state: CharmState
+) -> typing.Dict[str, typing.Any]:
+    """Get the template variables `/start.py migrate_config` would use.
+
+    start.py extends the Synapse environment with the registration and macaroon secrets
+    stored in the data directory, the log configuration path and the appservices files.
+    The secrets, the log configuration and the signing key are generated by start.py on
+    first run, so they must already exist for the charm to render the configuration.
+
+    Args:
+        container: Container of the charm.
+        charm_state: Instance of CharmState.
+
+    Returns:
+        The template variables.
+
+    Raises:
+        RenderConfigError: if a file generated by start.py is missing.
+    """
+    server_name = charm_state.synapse_config.server_name
+    secrets = ("SYNAPSE_REGISTRATION_SHARED_SECRET", "SYNAPSE_MACAROON_SECRET_KEY")
+    required_files = {
+        *(f"{server_name}.{secret}.key" for secret in secrets),
+        f"{server_name}.signing.key",
+        Path(SYNAPSE_LOG_CONFIG_PATH).name,
+    }
+    try:
+        data_files = {file.name: file for file in container.list_files(SYNAPSE_DATA_DIR)}
+    except PathError as exc:
+        raise RenderConfigError(str(exc)) from exc
+    missing_files = required_files - data_files.keys()
+    if missing_files:
+        raise RenderConfigError(f"missing files: {', '.join(sorted(missing_files))}")
+
+    environment: typing.Dict[str, typing.Any] = dict(get_environment(charm_state))
+    environment["SYNAPSE_NO_TLS"] = environment["SYNAPSE_NO_TLS"].lower() in (
+        "true",
+        "on",
+        "1",
+        "yes",
+    )
+    environment["SYNAPSE_LOG_CONFIG"] = SYNAPSE_LOG_CONFIG_PATH
+    for secret in secrets:
+        environment[secret] = container.pull(
+            f"{SYNAPSE_DATA_DIR}/{server_name}.{secret}.key", encoding="utf-8"
+        ).read()
+    environment["SYNAPSE_APPSERVICES"] = []
+    if "appservices" in data_files and data_files["appservices"].type == FileType.DIRECTORY:
+        environment["SYNAPSE_APPSERVICES"] = [
+            file.path
+            for file in container.list_files(f"{SYNAPSE_DATA_DIR}/appservices", pattern="*.yaml")
+        ]
+    return environment
+
+
+def render_homeserver_config(environment: typing.Dict[str, typing.Any]) -> str:
+    """Render the base Synapse configuration the same way `/start.py migrate_config` does.
+
+    Args:
+        environment: template variables as prepared by start.py.
+
+    Returns:
+        The rendered configuration file content.
+    """
+    from jinja2 import Environment, FileSystemLoader
+
+    file_loader = FileSystemLoader(Path("./templates"), followlinks=True)
+    # start.py renders the template without autoescaping, the output is YAML.
+    env = Environment(loader=file_loader, autoescape=False)  # nosec B701
+    return env.get_template(SYNAPSE_CONFIG_TEMPLATE).render(**environment)
+
+
 def execute_migrate_config(container: ops.Container, charm_state: CharmState) -> None:
-    """Run the Synapse command migrate_config.
+    """Recreate the base Synapse configuration file.
+
+    The configuration is rendered by the charm whenever possible. The Synapse command
+    migrate_config is used as fallback when the files it generates on first run are
+    not there yet.
 
     Args:
         container: Container of the charm.
@@ -256,13 +596,24 @@ def execute_migrate_config(container: ops.Container, charm_state: CharmState) ->
         CommandMigrateConfigError: something went wrong running migrate_config.
     """
     _check_server_name(container=container, charm_state=charm_state)
-    # TODO validate if is possible to use SDK instead of command  # pylint: disable=fixme
+    try:
+        homeserver_config = render_homeserver_config(
+            _get_migrate_config_environment(container=container, charm_state=charm_state)
+        )
+    except RenderConfigError as exc:
+        logger.info("Configuration not rendered by the charm, running migrate_config: %s", exc.msg)
+    else:
+        container.push(SYNAPSE_CONFIG_PATH, homeserver_config, encoding="utf-8")
+        get_config_snapshot(container).invalidate()
+        return
     migrate_config_command = [SYNAPSE_COMMAND_PATH, COMMAND_MIGRATE_CONFIG]
     migrate_config_result = _exec(
         container,
         migrate_config_command,
         environment=get_environment(charm_state),
     )
+    # migrate_config rewrites the configuration file inside the container.
+    get_config_snapshot(container).invalidate()
     if migrate_config_result.exit_code:
         logger.error(
             "migrate config failed, stdout: %s, stderr: %s",
@@ -295,74 +646,62 @@ def validate_config(container: ops.Container) -> None:
         raise WorkloadError("Validate config failed, please check the logs")
 
 
-def generate_nginx_config(container: ops.Container, main_unit_address: str) -> None:
-    """Generate NGINX configuration based on templates.
+def reload_nginx(container: ops.Container) -> None:
+    """Test the NGINX configuration files and reload NGINX.
 
-    1. Copy template files as configuration files to be used.
-    2. Run sed command to replace string main-unit in configuration files.
-    3. Reload NGINX.
+    NGINX keeps serving the open connections with the previous configuration
+    until they are closed, unlike a restart.
 
     Args:
         container: Container of the charm.
-        main_unit_address: Main unit address to be used in configuration.
-    """
-    file_loader = FileSystemLoader(Path("./templates"), followlinks=True)
-    env = Environment(loader=file_loader, autoescape=True)
 
-    # List of templates and their corresponding output files
-    templates = [
-        ("main_location.conf.j2", "main_location.conf"),
-        ("abuse_report_location.conf.j2", "abuse_report_location.conf"),
-    ]
+    Raises:
+        InvalidNginxConfigError: the configuration files did not pass the test.
+        WorkloadError: NGINX could not be reloaded.
+    """
+    test_result = _exec(container, [NGINX_COMMAND_PATH, "-t"])
+    if test_result.exit_code:
+        logger.error(
+            "NGINX configuration test failed, stdout: %s, stderr: %s",
+            test_result.stdout,
+            test_result.stderr,
+        )
+        raise InvalidNginxConfigError("NGINX configuration test failed, please check the logs")
+    reload_result = _exec(container, [NGINX_COMMAND_PATH, "-s", "reload"])
+    if reload_result.exit_code:
+        logger.error(
+            "NGINX reload failed, stdout: %s, stderr: %s",
+            reload_result.stdout,
+            reload_result.stderr,
+        )
+        raise WorkloadError("NGINX reload failed, please check the logs")
 
-    for template_name, output_file in templates:
-        template = env.get_template(template_name)
-        output = template.render(main_unit_address=main_unit_address)
-        container.push(f"/etc/nginx/{output_file}", output, make_dirs=True)
 
+def get_cpu_count(container: ops.Container) -> int:
+    """Get the number of CPUs available to the Synapse container.
 
-def generate_worker_config(unit_number: str, is_main: bool) -> dict:
-    """Generate worker configuration.
+    The CPU quota of the container cgroup is used, or the CPUs it can run on
+    without quota.
 
     Args:
-        unit_number: Unit number to be used in the worker_name field.
-        is_main: if unit is main.
+        container: Container of the charm.
 
     Returns:
-        Worker configuration.
+        The number of CPUs, 1 if it cannot be read.
     """
-    worker_listeners = [
-        {
-            "type": "http",
-            "bind_addresses": ["::"],
-            "port": 8034,
-            "resources": [{"names": ["replication"]}],
-        }
-    ]
-    if not is_main:
-        worker_listeners.extend(
-            [
-                {
-                    "type": "http",
-                    "bind_addresses": ["::"],
-                    "port": 8008,
-                    "x_forwarded": True,
-                    "resources": [{"names": ["client", "federation"]}],
-                },
-                {
-                    "type": "metrics",
-                    "bind_addresses": ["::"],
-                    "port": int(SYNAPSE_EXPORTER_PORT),
-                },
-            ]
-        )
-    worker_config = {
-        "worker_app": "synapse.app.generic_worker",
-        "worker_name": "federationsender1" if is_main else f"worker{unit_number}",
-        "worker_listeners": worker_listeners,
-        "worker_log_config": "/data/log.config",
-    }
-    return worker_config
+    try:
+        quota, period = container.pull("/sys/fs/cgroup/cpu.max").read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+        cpus = container.pull("/sys/fs/cgroup/cpuset.cpus.effective").read().strip()
+        cpu_count = 0
+        for cpu_range in cpus.split(","):
+            first, _, last = cpu_range.partition("-")
+            cpu_count += int(last or first) - int(first) + 1
+        return max(1, cpu_count)
+    except (PathError, ValueError):
+        logger.warning("Failed to read the CPU quota of the Synapse container")
+        return 1
 
 
 def _get_mjolnir_config(access_token: str, room_id: str) -> typing.Dict:
@@ -397,7 +736,7 @@ def generate_mjolnir_config(container: ops.Container, access_token: str, room_id
     """
     try:
         config = _get_mjolnir_config(access_token, room_id)
-        container.push(MJOLNIR_CONFIG_PATH, yaml.safe_dump(config), make_dirs=True)
+        push_files(container, {MJOLNIR_CONFIG_PATH: yaml.safe_dump(config)})
     except ops.pebble.PathError as exc:
         raise CreateMjolnirConfigError(str(exc)) from exc
 
@@ -409,7 +748,16 @@ def create_registration_secrets_files(container: ops.Container, charm_state: Cha
         container: Container of the charm.
         charm_state: Instance of CharmState.
     """
-    container.exec(["rm", "-f", f"{SYNAPSE_CONFIG_DIR}/appservice-registration-*.yaml"])
-    if charm_state.registration_secrets:
-        for registration_secret in charm_state.registration_secrets:
-            registration_secret.file_path.write_text(registration_secret.value, encoding="utf-8")
+    registration_files = {
+        str(registration_secret.file_path): registration_secret.value
+        for registration_secret in charm_state.registration_secrets or []
+    }
+    pushed_files = get_pushed_files(container)
+    pushed_files.remove(
+        file.path
+        for file in container.list_files(
+            SYNAPSE_CONFIG_DIR, pattern="appservice-registration-*.yaml"
+        )
+        if file.path not in registration_files
+    )
+    pushed_files.push(registration_files)
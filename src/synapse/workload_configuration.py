@@ -6,6 +6,7 @@
 """Helper module used to manage interactions with Synapse homeserver configuration."""
 
 import logging
+import typing
 
 from state.charm_state import CharmState
 
@@ -13,6 +14,21 @@ from .workload import SYNAPSE_EXPORTER_PORT, EnableMetricsError, EnableSMTPError
 
 logger = logging.getLogger(__name__)
 
+# Lists of the configuration whose items are identified by a key. An item added again
+# by a reconcile replaces the existing one instead of being duplicated.
+KEYED_LISTS: dict[str, typing.Callable[[typing.Any], typing.Any]] = {
+    "listeners": lambda listener: (listener.get("port"), listener.get("path")),
+    "modules": lambda module: module.get("module"),
+    "trusted_key_servers": lambda server: server.get("server_name"),
+}
+# Configuration setting the instance running the tasks of a worker role.
+WORKER_ROLE_INSTANCE_KEYS = {
+    "appservice": "notify_appservices_from_worker",
+    "background": "run_background_tasks_on",
+    "media": "media_instance_running_background_jobs",
+    "user_directory": "update_user_directory_from_worker",
+}
+
 
 def _create_tuple_from_string_list(string_list: str) -> tuple[str, ...]:
     """Format IP range whitelist.
@@ -26,6 +42,61 @@ def _create_tuple_from_string_list(string_list: str) -> tuple[str, ...]:
     return tuple(item.strip() for item in string_list.split(","))
 
 
+def _canonical_value(value: typing.Any) -> typing.Any:
+    """Convert a configuration value to the types it has once read from YAML.
+
+    Args:
+        value: configuration value.
+
+    Returns:
+        The value with tuples and sets converted to lists.
+    """
+    if isinstance(value, dict):
+        return {key: _canonical_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(_canonical_value(item) for item in value)
+    return value
+
+
+def _deduplicate(items: list, key: typing.Callable[[typing.Any], typing.Any]) -> list:
+    """Remove the items with a duplicated key.
+
+    Args:
+        items: list to be deduplicated.
+        key: function returning the key of an item.
+
+    Returns:
+        The list with the last item for each key, at the position of the first one.
+    """
+    deduplicated: dict[typing.Any, typing.Any] = {}
+    for item in items:
+        item_key = key(item) if isinstance(item, dict) else repr(item)
+        deduplicated[item_key] = item
+    return list(deduplicated.values())
+
+
+def canonicalize_config(current_yaml: dict) -> dict:
+    """Get the canonical form of the Synapse configuration.
+
+    The canonical form is the one read back from the pushed file and does not depend
+    on how many times the configuration was edited, so it can be compared with the
+    existing configuration without reporting spurious changes.
+
+    Args:
+        current_yaml: current configuration.
+
+    Returns:
+        The canonical configuration.
+    """
+    canonical_yaml = _canonical_value(current_yaml)
+    for field, key in KEYED_LISTS.items():
+        if isinstance(canonical_yaml.get(field), list):
+            canonical_yaml[field] = _deduplicate(canonical_yaml[field], key)
+    return canonical_yaml
+
+
 def set_public_baseurl(current_yaml: dict, charm_state: CharmState) -> None:
     """Set the homeserver's public address.
 
@@ -93,14 +164,21 @@ def enable_federation_domain_whitelist(current_yaml: dict, charm_state: CharmSta
         raise WorkloadError(str(exc)) from exc
 
 
-def enable_federation_sender(current_yaml: dict) -> None:
+def enable_federation_sender(current_yaml: dict, charm_state: CharmState) -> None:
     """Change the Synapse configuration to federation sender config.
 
     Args:
         current_yaml: current configuration.
+        charm_state: Instance of CharmState.
     """
     current_yaml["send_federation"] = True
-    current_yaml["federation_sender_instances"] = ["federationsender1"]
+    current_yaml["federation_sender_instances"] = [
+        "federationsender1",
+        *sorted(
+            charm_state.federation_sender_workers,
+            key=lambda name: int(name.removeprefix("federationsender")),
+        ),
+    ]
 
 
 def enable_forgotten_room_retention(current_yaml: dict) -> None:
@@ -432,9 +510,7 @@ def enable_stream_writers(current_yaml: dict, charm_state: CharmState) -> None:
     persisters = []
     if charm_state.instance_map_config is not None:
         persisters = [
-            key
-            for key in charm_state.instance_map_config.keys()
-            if key not in ["main", "federationsender1"]
+            key for key in charm_state.instance_map_config.keys() if key.startswith("worker")
         ]
         persisters.sort()
     if persisters is not None:
@@ -443,6 +519,31 @@ def enable_stream_writers(current_yaml: dict, charm_state: CharmState) -> None:
         logger.error("Enable stream writers called but no persisters found. Verify peer relation.")
 
 
+def enable_worker_roles(current_yaml: dict, charm_state: CharmState) -> None:
+    """Change the Synapse configuration to run the tasks of a role on its workers.
+
+    The pushers run on every pusher worker. The other tasks run on a single
+    instance, the role worker with the lowest unit number. The tasks of the roles
+    without workers are left to the main process.
+
+    Args:
+        current_yaml: current configuration.
+        charm_state: Instance of CharmState.
+    """
+    role_workers: dict[str, list[str]] = {}
+    for worker, role in sorted(
+        charm_state.worker_roles.items(), key=lambda item: int(item[0].removeprefix("worker"))
+    ):
+        role_workers.setdefault(role, []).append(worker)
+    current_yaml.pop("pusher_instances", None)
+    if "pusher" in role_workers:
+        current_yaml["pusher_instances"] = role_workers["pusher"]
+    for role, key in WORKER_ROLE_INSTANCE_KEYS.items():
+        current_yaml.pop(key, None)
+        if role in role_workers:
+            current_yaml[key] = role_workers[role][0]
+
+
 def enable_trusted_key_servers(current_yaml: dict, charm_state: CharmState) -> None:
     """Change the Synapse configuration to set trusted_key_servers.
 
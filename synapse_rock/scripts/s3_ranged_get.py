@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""
+Download an object with concurrent HTTP range requests and write it to the standard output.
+The chunks are downloaded in parallel but written in order, so the output can be piped to
+gpg and tar like the output of "aws s3 cp <url> -", without being bound by a single stream.
+At most --buffer-chunks chunks are downloaded ahead of the one being written, which bounds
+the memory used to about --buffer-chunks times --chunk-size.
+The URL of the object, a presigned S3 URL, is read from the first line of the standard input
+so it does not show in the process list.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import sys
+import time
+import urllib.error
+import urllib.request
+
+RETRIES = 5
+TIMEOUT = 60
+
+
+def get_size(url: str) -> int:
+    """Get the size of the object.
+
+    Args:
+        url: URL of the object.
+
+    Returns:
+        The size of the object in bytes.
+    """
+    request = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:  # nosec
+            content_range = response.headers.get("Content-Range")
+            if content_range:
+                return int(content_range.rsplit("/", 1)[1])
+            return int(response.headers["Content-Length"])
+    except urllib.error.HTTPError as exc:
+        # The range of an empty object is not satisfiable.
+        if exc.code == 416:
+            return 0
+        raise
+
+
+def fetch(url: str, start: int, end: int) -> bytes:
+    """Download a chunk of the object, retrying on errors.
+
+    Args:
+        url: URL of the object.
+        start: first byte of the chunk.
+        end: last byte of the chunk.
+
+    Returns:
+        The content of the chunk.
+
+    Raises:
+        OSError: if the chunk could not be downloaded.
+    """
+    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"})
+    for attempt in range(RETRIES):
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:  # nosec
+                data = response.read()
+            if len(data) != end - start + 1:
+                raise OSError(f"Incomplete chunk {start}-{end}: {len(data)} bytes")
+            return data
+        except OSError as exc:
+            if attempt == RETRIES - 1:
+                raise
+            print(f"Retrying chunk {start}-{end}: {exc}", file=sys.stderr)
+            time.sleep(2**attempt)
+    raise OSError(f"Could not download chunk {start}-{end}")
+
+
+def main() -> None:
+    """Download the object to the standard output."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--buffer-chunks", type=int, default=20)
+    args = parser.parse_args()
+    url = sys.stdin.readline().strip()
+    size = get_size(url)
+    buffer_chunks = max(args.buffer_chunks, args.concurrency)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency)
+    pending: collections.deque = collections.deque()
+    next_start = 0
+    try:
+        while next_start < size or pending:
+            while next_start < size and len(pending) < buffer_chunks:
+                end = min(next_start + args.chunk_size, size) - 1
+                pending.append(executor.submit(fetch, url, next_start, end))
+                next_start = end + 1
+            sys.stdout.buffer.write(pending.popleft().result())
+        sys.stdout.buffer.flush()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""pytest fixtures for the benchmarks."""
+
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess  # nosec B404
+import sys
+import typing
+
+import pytest
+
+# The benchmarks run the charm with the same Harness as the unit tests.
+from tests.unit.conftest import harness_fixture  # noqa: F401 pylint: disable=unused-import
+
+# Timings only compare on the same machine, so each environment keeps its own baseline.
+BASELINES_DIR = pathlib.Path(__file__).parent / "baselines"
+PROJECT_ROOT = pathlib.Path(__file__).parents[2]
+
+
+def _baseline_path(pytestconfig: pytest.Config) -> pathlib.Path:
+    """Get the path of the benchmark baseline.
+
+    Args:
+        pytestconfig: pytest configuration.
+
+    Returns:
+        The baseline path, by default the one of the machine and Python version.
+    """
+    baseline = pytestconfig.getoption("--benchmark-baseline")
+    if baseline:
+        return pathlib.Path(baseline)
+    python_version = f"py{sys.version_info.major}.{sys.version_info.minor}"
+    return BASELINES_DIR / f"{platform.node()}-{platform.machine()}-{python_version}.json"
+
+
+def _run_baseline_ref(ref: str, work_dir: pathlib.Path) -> dict[str, dict]:
+    """Run the benchmarks of the merge base of a git reference.
+
+    The merge base is checked out in a temporary worktree, so its results are
+    measured on this machine, right before the ones they are compared with.
+
+    Args:
+        ref: git reference of the base branch.
+        work_dir: directory for the worktree and the results.
+
+    Returns:
+        The benchmark results of the merge base, empty if it has no benchmarks.
+    """
+    merge_base = subprocess.run(  # nosec B603 B607
+        ["git", "merge-base", "HEAD", ref],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    worktree = work_dir / "merge-base"
+    output = work_dir / "merge-base.json"
+    subprocess.run(  # nosec B603 B607
+        ["git", "worktree", "add", "--detach", str(worktree), merge_base],
+        cwd=PROJECT_ROOT,
+        check=True,
+    )
+    try:
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(str(worktree / path) for path in (".", "lib", "src"))
+        # A failing benchmark of the merge base still gives its timings.
+        subprocess.run(  # nosec B603
+            [
+                sys.executable,
+                "-m",
+                "pytest",
+                "tests/benchmark",
+                "-q",
+                "-p",
+                "no:cacheprovider",
+                f"--benchmark-output={output}",
+            ],
+            cwd=worktree,
+            env=env,
+            check=False,
+        )
+    finally:
+        subprocess.run(  # nosec B603 B607
+            ["git", "worktree", "remove", "--force", str(worktree)],
+            cwd=PROJECT_ROOT,
+            check=True,
+        )
+    if not output.exists():
+        return {}
+    return json.loads(output.read_text(encoding="utf-8"))["benchmarks"]
+
+
+@pytest.fixture(scope="session", name="benchmark_baseline")
+def benchmark_baseline_fixture(
+    pytestconfig: pytest.Config, tmp_path_factory: pytest.TempPathFactory
+) -> dict[str, dict]:
+    """Benchmark results to compare against, by benchmark name.
+
+    They are the results of the merge base of --benchmark-baseline-ref if set, the
+    stored baseline otherwise.
+    """
+    ref = pytestconfig.getoption("--benchmark-baseline-ref")
+    if ref:
+        return _run_baseline_ref(ref, tmp_path_factory.mktemp("benchmark-baseline"))
+    baseline_path = _baseline_path(pytestconfig)
+    if not baseline_path.exists():
+        return {}
+    return json.loads(baseline_path.read_text(encoding="utf-8"))["benchmarks"]
+
+
+@pytest.fixture(scope="session", name="benchmark_results")
+def benchmark_results_fixture(
+    pytestconfig: pytest.Config,
+    benchmark_baseline: dict[str, dict],
+) -> typing.Generator[dict[str, dict], None, None]:
+    """Benchmark results of the session, by benchmark name.
+
+    The results are written to --benchmark-output, and merged into the stored
+    baseline when --benchmark-update-baseline is set, once the session is finished.
+    """
+    results: dict[str, dict] = {}
+    yield results
+    output = pytestconfig.getoption("--benchmark-output")
+    if output:
+        pathlib.Path(output).write_text(
+            json.dumps({"benchmarks": results}, indent=2, sort_keys=True) + "\n",
+            encoding="utf-8",
+        )
+    if pytestconfig.getoption("--benchmark-update-baseline"):
+        baseline_path = _baseline_path(pytestconfig)
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(
+            json.dumps({"benchmarks": {**benchmark_baseline, **results}}, indent=2, sort_keys=True)
+            + "\n",
+            encoding="utf-8",
+        )
+
+
+@pytest.fixture(name="record_benchmark")
+def record_benchmark_fixture(
+    pytestconfig: pytest.Config,
+    benchmark_results: dict[str, dict],
+    benchmark_baseline: dict[str, dict],
+) -> typing.Callable[..., None]:
+    """Record the durations of a benchmark and check them against its baseline.
+
+    The fastest runs are compared, being the least affected by the load of the machine.
+    """
+
+    def record_benchmark(name: str, durations: list[float], **details: typing.Any) -> None:
+        """Record the durations of a benchmark.
+
+        Args:
+            name: name of the benchmark.
+            durations: duration of each run, in milliseconds.
+            details: parameters of the benchmark stored with the result.
+        """
+        result = {
+            **details,
+            "runs": len(durations),
+            "median_ms": round(statistics.median(durations), 3),
+            "min_ms": round(min(durations), 3),
+            "max_ms": round(max(durations), 3),
+        }
+        benchmark_results[name] = result
+        if name in benchmark_baseline:
+            tolerance = pytestconfig.getoption("--benchmark-tolerance")
+            assert result["min_ms"] <= benchmark_baseline[name]["min_ms"] * tolerance, (
+                f"{name} took {result['min_ms']} ms, "
+                f"baseline {benchmark_baseline[name]['min_ms']} ms"
+            )
+
+    return record_benchmark
@@ -0,0 +1,244 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Synapse charm hook latency benchmarks.
+
+Each benchmark deploys the charm in a simulated topology, dispatches a hook a few
+times and compares the median latency against the stored baseline. The reconcile
+fingerprint is reset before each run so hooks always go through a full reconcile.
+"""
+
+# pylint: disable=protected-access, too-many-arguments, too-many-positional-arguments
+
+import gc
+import time
+import typing
+from secrets import token_hex
+from unittest.mock import MagicMock
+
+import pytest
+from charms.smtp_integrator.v0.smtp import AuthType, TransportSecurity
+from ops.testing import Harness
+
+import backup
+import synapse
+from tests.unit.conftest import TEST_SERVER_NAME
+
+RUNS = 5
+WARMUP_RUNS = 1
+UNITS = (1, 10, 50)
+RELATIONS = ("redis", "media", "smtp", "matrix-auth")
+RELATION_SETS = ((), *((relation,) for relation in RELATIONS), RELATIONS)
+BACKUP_SIZE = 1024 * 1024
+
+
+def _add_redis(harness: Harness) -> None:
+    """Integrate the charm with Redis.
+
+    Args:
+        harness: harness instance.
+    """
+    harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
+
+
+def _s3_app_data(usage: str) -> dict[str, str]:
+    """Get the data of an S3 integrator.
+
+    Args:
+        usage: what the bucket is used for.
+
+    Returns:
+        The application data of the relation.
+    """
+    return {
+        "access-key": token_hex(16),
+        "secret-key": token_hex(16),
+        "bucket": f"synapse-{usage}-bucket",
+        "path": f"/synapse-{usage}",
+        "s3-uri-style": "path",
+        "endpoint": "https://s3.example.com",
+    }
+
+
+def _add_media(harness: Harness) -> None:
+    """Integrate the charm with S3 for media.
+
+    Args:
+        harness: harness instance.
+    """
+    harness.add_relation("media", "s3-integrator", app_data=_s3_app_data("media"))
+
+
+def _add_smtp(harness: Harness) -> None:
+    """Integrate the charm with SMTP.
+
+    Args:
+        harness: harness instance.
+    """
+    password_id = harness.add_model_secret("smtp-integrator", {"password": token_hex(16)})
+    harness.add_relation(
+        "smtp",
+        "smtp-integrator",
+        app_data={
+            "host": "127.0.0.1",
+            "port": "25",
+            "user": "username",
+            "password_id": password_id,
+            "auth_type": AuthType.PLAIN,
+            "transport_security": TransportSecurity.TLS,
+        },
+    )
+    harness.grant_secret(password_id, "synapse")
+
+
+def _add_matrix_auth(harness: Harness) -> None:
+    """Integrate the charm with a matrix-auth requirer.
+
+    Args:
+        harness: harness instance.
+    """
+    relation_id = harness.add_relation("matrix-auth", "maubot")
+    harness.add_relation_unit(relation_id, "maubot/0")
+
+
+ADD_RELATION = {
+    "redis": _add_redis,
+    "media": _add_media,
+    "smtp": _add_smtp,
+    "matrix-auth": _add_matrix_auth,
+}
+
+
+def _emit_peers_relation_changed(harness: Harness) -> None:
+    """Emit the relation changed event of the peer relation.
+
+    Args:
+        harness: harness instance.
+    """
+    relation = harness.model.get_relation(synapse.SYNAPSE_PEER_RELATION_NAME)
+    harness.charm.on[synapse.SYNAPSE_PEER_RELATION_NAME].relation_changed.emit(
+        relation, harness.charm.app, harness.charm.unit
+    )
+
+
+HOOKS: dict[str, typing.Callable[[Harness], typing.Any]] = {
+    "config-changed": lambda harness: harness.charm.on.config_changed.emit(),
+    "synapse-pebble-ready": lambda harness: harness.container_pebble_ready(
+        synapse.SYNAPSE_CONTAINER_NAME
+    ),
+    "synapse-peers-relation-changed": _emit_peers_relation_changed,
+    "leader-elected": lambda harness: harness.charm.on.leader_elected.emit(),
+    "update-status": lambda harness: harness.charm.on.update_status.emit(),
+    "create-backup-action": lambda harness: harness.run_action("create-backup"),
+    "list-backups-action": lambda harness: harness.run_action("list-backups"),
+}
+
+
+def _bash_command_handler(argv: list[str]) -> synapse.ExecResult:
+    """Handle the shell commands of the backup inside the Synapse container.
+
+    Args:
+        argv: arguments list.
+
+    Returns:
+        A backed up file of BACKUP_SIZE for find, an empty output otherwise.
+    """
+    if "find " in argv[-1]:
+        return synapse.ExecResult(0, f"{BACKUP_SIZE} 1.0 /data/homeserver.db\0", "")
+    return synapse.ExecResult(0, "", "")
+
+
+def _deploy(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch, units: int, relations: tuple[str, ...]
+) -> None:
+    """Deploy the charm as the leader of a simulated topology.
+
+    Args:
+        harness: harness instance.
+        monkeypatch: monkey patch instance.
+        units: number of units of the application.
+        relations: integrations of the application.
+    """
+    monkeypatch.setattr(
+        synapse, "get_registration_shared_secret", MagicMock(return_value="shared_secret")
+    )
+    monkeypatch.setattr(backup.S3Client, "can_use_bucket", MagicMock(return_value=True))
+    monkeypatch.setattr(backup.S3Client, "list_backups", MagicMock(return_value=[]))
+    # The AWS CLI and the backup pipeline run in the workload, only their exec is simulated.
+    harness.register_command_handler(  # type: ignore # pylint: disable=no-member
+        container=synapse.SYNAPSE_CONTAINER_NAME,
+        executable=backup.AWS_COMMAND,
+        handler=lambda _: synapse.ExecResult(0, "", ""),
+    )
+    harness.register_command_handler(  # type: ignore # pylint: disable=no-member
+        container=synapse.SYNAPSE_CONTAINER_NAME,
+        executable=backup.BASH_COMMAND,
+        handler=_bash_command_handler,
+    )
+    # The files migrate_config generates on first run, so the configuration is rendered.
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    for secret in ("SYNAPSE_REGISTRATION_SHARED_SECRET", "SYNAPSE_MACAROON_SECRET_KEY"):
+        container.push(
+            f"{synapse.SYNAPSE_DATA_DIR}/{TEST_SERVER_NAME}.{secret}.key", token_hex(16)
+        )
+    container.push(synapse.SYNAPSE_LOG_CONFIG_PATH, "version: 1")
+    container.make_dir(f"{synapse.SYNAPSE_DATA_DIR}/media/local_content", make_parents=True)
+    harness.update_config(
+        {
+            "server_name": TEST_SERVER_NAME,
+            "public_baseurl": f"https://{TEST_SERVER_NAME}",
+            "backup_passphrase": token_hex(16),
+        }
+    )
+    harness.add_relation("backup", "s3-integrator", app_data=_s3_app_data("backup"))
+    for relation in relations:
+        ADD_RELATION[relation](harness)
+    harness.set_leader(True)
+    harness.set_planned_units(units)
+    peers_relation_id = harness.add_relation(synapse.SYNAPSE_PEER_RELATION_NAME, "synapse")
+    for unit in range(1, units):
+        harness.add_relation_unit(peers_relation_id, f"synapse/{unit}")
+    harness.begin_with_initial_hooks()
+
+
+@pytest.mark.parametrize("hook", HOOKS)
+@pytest.mark.parametrize(
+    "relations", RELATION_SETS, ids=["+".join(relations) or "none" for relations in RELATION_SETS]
+)
+@pytest.mark.parametrize("units", UNITS, ids=[f"units={units}" for units in UNITS])
+def test_hook_latency(
+    harness: Harness,
+    monkeypatch: pytest.MonkeyPatch,
+    record_benchmark: typing.Callable[..., None],
+    units: int,
+    relations: tuple[str, ...],
+    hook: str,
+):
+    """
+    arrange: deploy the charm with the given units and integrations.
+    act: dispatch the hook once to warm up, then a few times.
+    assert: the fastest dispatch is within the tolerance of the baseline.
+    """
+    _deploy(harness, monkeypatch, units, relations)
+    durations = []
+    # The first dispatch imports the modules the hook defers, it is not timed.
+    for run in range(WARMUP_RUNS + RUNS):
+        harness.charm._stored.reconcile_fingerprint = ""
+        # Like timeit, the garbage collection is left out of the timed dispatches.
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            HOOKS[hook](harness)
+            duration = (time.perf_counter() - start) * 1000
+        finally:
+            gc.enable()
+        if run >= WARMUP_RUNS:
+            durations.append(duration)
+
+    record_benchmark(
+        f"{hook}[units={units},relations={'+'.join(relations) or 'none'}]",
+        durations,
+        hook=hook,
+        units=units,
+        relations=list(relations),
+    )
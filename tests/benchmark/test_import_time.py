@@ -0,0 +1,21 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Synapse charm import time benchmark."""
+
+import typing
+
+from tests.unit.test_import_time import import_charm
+
+RUNS = 5
+
+
+def test_import_charm_time(record_benchmark: typing.Callable[..., None]):
+    """
+    arrange: nothing.
+    act: import the charm module in a new interpreter a few times.
+    assert: the fastest import is within the tolerance of the baseline.
+    """
+    durations = [import_charm()["charm"] / 1000 for _ in range(RUNS)]
+
+    record_benchmark("import-charm", durations)
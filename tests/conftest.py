@@ -23,3 +23,29 @@ def pytest_addoption(parser: Parser) -> None:
         help="This parameter will skip deploy of Synapse and PostgreSQL",
     )
     parser.addoption("--localstack-address", action="store")
+    parser.addoption(
+        "--benchmark-output", action="store", help="File to write the benchmark results to"
+    )
+    parser.addoption(
+        "--benchmark-baseline",
+        action="store",
+        help="File with the benchmark results to compare against",
+    )
+    parser.addoption(
+        "--benchmark-baseline-ref",
+        action="store",
+        help="Git reference whose merge base is benchmarked to compare against",
+    )
+    parser.addoption(
+        "--benchmark-tolerance",
+        action="store",
+        type=float,
+        default=2.0,
+        help="Maximum ratio between a benchmark result and its baseline",
+    )
+    parser.addoption(
+        "--benchmark-update-baseline",
+        action="store_true",
+        default=False,
+        help="This parameter will store the benchmark results as the new baseline",
+    )
@@ -6,11 +6,13 @@
 import json
 import logging
 import re
+import shlex
 import typing
 from secrets import token_hex
 
 import pytest
 import requests
+import yaml
 from juju.action import Action
 from juju.application import Application
 from juju.errors import JujuUnitError
@@ -151,6 +153,58 @@ async def test_synapse_scale_blocked(synapse_app: Application):
     )
 
 
+async def test_synapse_render_homeserver_config(synapse_app: Application):
+    """
+    arrange: build and deploy the Synapse charm.
+    act: run migrate_config in the workload and render the configuration in the charm.
+    assert: both configurations are the same.
+    """
+    pebble_cmd = "PEBBLE_SOCKET=/charm/containers/synapse/pebble.socket pebble"
+    unit: Unit = synapse_app.units[0]
+
+    async def run(command: str) -> str:
+        """Run a command in the unit and return its output.
+
+        Args:
+            command: command to be run.
+
+        Returns:
+            The command output.
+        """
+        action = await unit.run(command)
+        await action.wait()
+        assert action.results["return-code"] == 0, action.results
+        return action.results.get("stdout", "")
+
+    plan = yaml.safe_load(await run(f"{pebble_cmd} plan"))
+    environment = plan["services"][synapse.SYNAPSE_SERVICE_NAME]["environment"]
+    migrate_config_path = "/tmp/migrate_config.yaml"  # nosec B108
+    env_args = " ".join(
+        shlex.quote(f"--env={name}={value}")
+        for name, value in {**environment, "SYNAPSE_CONFIG_PATH": migrate_config_path}.items()
+    )
+    await run(
+        f"{pebble_cmd} exec {env_args} -- "
+        f"{synapse.SYNAPSE_COMMAND_PATH} {synapse.COMMAND_MIGRATE_CONFIG}"
+    )
+    migrate_config = yaml.safe_load(await run(f"{pebble_cmd} exec -- cat {migrate_config_path}"))
+
+    server_name = environment["SYNAPSE_SERVER_NAME"]
+    template_environment = {
+        **environment,
+        "SYNAPSE_NO_TLS": environment["SYNAPSE_NO_TLS"].lower() in ("true", "on", "1", "yes"),
+        "SYNAPSE_LOG_CONFIG": synapse.SYNAPSE_LOG_CONFIG_PATH,
+        "SYNAPSE_APPSERVICES": [],
+    }
+    for secret in ("SYNAPSE_REGISTRATION_SHARED_SECRET", "SYNAPSE_MACAROON_SECRET_KEY"):
+        template_environment[secret] = await run(
+            f"{pebble_cmd} exec -- cat /data/{server_name}.{secret}.key"
+        )
+    rendered_config = yaml.safe_load(synapse.render_homeserver_config(template_environment))
+
+    assert rendered_config == migrate_config
+
+
 @pytest.mark.asyncio
 async def test_workload_version(
     ops_test: OpsTest,
@@ -20,7 +20,9 @@ from ops.testing import Harness
 
 import synapse
 from charm import SynapseCharm
+from charm_types import DatasourcePostgreSQL
 from s3_parameters import S3Parameters
+from state.mas import MASConfiguration, MASContext
 
 TEST_SERVER_NAME = "server-name-configured.synapse.com"
 TEST_SERVER_NAME_CHANGED = "pebble-layer-1.synapse.com"
@@ -121,8 +123,21 @@ def harness_fixture(request, monkeypatch) -> typing.Generator[Harness, None, Non
     monkeypatch.setattr(synapse, "create_admin_user", lambda *_args, **_kwargs: "")
     monkeypatch.setattr(time, "sleep", lambda *_args, **_kwargs: "")
     # Assume that MAS is working properly
+    mas_configuration = MASConfiguration(
+        datasource=DatasourcePostgreSQL(
+            user="mas", password=token_hex(16), host="10.0.0.2", port="5432", db="mas"
+        ),
+        mas_context=MASContext(
+            encryption_key=token_hex(32),
+            signing_key_id=token_hex(4),
+            signing_key_rsa="rsa",
+            synapse_shared_secret=token_hex(16),
+            synapse_oidc_client_id="01J0000000000000000000000",
+            synapse_oidc_client_secret=token_hex(16),
+        ),
+    )
     monkeypatch.setattr(
-        "state.mas.MASConfiguration.from_charm", MagicMock(return_value=MagicMock())
+        "state.mas.MASConfiguration.from_charm", MagicMock(return_value=mas_configuration)
     )
     monkeypatch.setattr("pebble._push_mas_config", MagicMock())
 
@@ -157,7 +172,7 @@ def harness_fixture(request, monkeypatch) -> typing.Generator[Harness, None, Non
         Raises:
             RuntimeError: command unknown.
         """
-        nonlocal command_path, command_migrate_config, exit_code, synapse_container
+        nonlocal command_path, command_migrate_config
         match argv:
             case [command_path, command_migrate_config]:  # pylint: disable=unused-variable
                 config_content = {
@@ -199,6 +214,11 @@ def harness_fixture(request, monkeypatch) -> typing.Generator[Harness, None, Non
         executable="rm",
         handler=lambda _: synapse.ExecResult(0, "", ""),
     )
+    harness.register_command_handler(  # type: ignore # pylint: disable=no-member
+        container=synapse_container,
+        executable=synapse.NGINX_COMMAND_PATH,
+        handler=lambda _: synapse.ExecResult(0, "", ""),
+    )
     yield harness
     harness.cleanup()
 
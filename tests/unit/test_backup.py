@@ -5,19 +5,20 @@
 
 # pylint: disable=protected-access
 
-import datetime
 import os
 import pathlib
 from secrets import token_hex
+from typing import Optional
 from unittest.mock import MagicMock
 
+import ops
 import pytest
 import yaml
-from botocore.exceptions import ClientError
-from dateutil.tz import tzutc  # type: ignore
 from ops.testing import Harness
 
 import backup
+import backup_manifest
+import backup_transfer
 import synapse
 
 from .conftest import TEST_SERVER_NAME
@@ -123,331 +124,23 @@ def test_s3_relation_data_addressing_style(s3_relation_data, addressing_style):
     assert s3_parameters.addressing_style == addressing_style
 
 
-def test_s3_client_create_correct(s3_parameters_backup):
-    """
-    arrange: Create S3Parameters for the new client.
-    act: Create the new client.
-    assert: The client gets created correctly.
-    """
-    s3_client = backup.S3Client(s3_parameters_backup)
-
-    assert s3_client._client
-
-
-def test_s3_client_create_error(s3_parameters_backup):
-    """
-    arrange: Create S3Parameters for the new client.
-        Put access_key for the boto3 client to fail.
-    act: Create the new client.
-    assert: Raises S3Error.
-    """
-    s3_parameters_backup.access_key = None
-
-    with pytest.raises(backup.S3Error) as err:
-        backup.S3Client(s3_parameters_backup)
-    assert "Error creating S3 client" in str(err.value)
-
-
-def test_can_use_bucket_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create S3Parameters and mock boto3 client so it does not raise on head_bucket.
-    act: Run S3Client.can_use_bucket.
-    assert: Check that the function returns True.
-    """
-    s3_client = backup.S3Client(s3_parameters_backup)
-    monkeypatch.setattr(s3_client._client, "head_bucket", MagicMock())
-
-    assert s3_client.can_use_bucket()
-
-
-def test_can_use_bucket_bucket_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create S3Parameters and mock boto3 library so it fails when checking the bucket.
-    act: Run can_use_bucket.
-    assert: Check that the function returns False.
-    """
-    s3_client = backup.S3Client(s3_parameters_backup)
-    monkeypatch.setattr(
-        s3_client._client, "head_bucket", MagicMock(side_effect=ClientError({}, "HeadBucket"))
-    )
-
-    assert not s3_client.can_use_bucket()
-
-
-def test_delete_backup_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. Mock delete_object to return a realistic correct response.
-    act: Run delete_backup.
-    assert: The function delete_object called with the right arguments.
-    """
-    backup_id = "backup-20240101"
-    s3_client = backup.S3Client(s3_parameters_backup)
-    s3_example_response = {
-        "ResponseMetadata": {
-            "RequestId": "17B23CD508D801F2",
-            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
-            "HTTPStatusCode": 204,
-            "HTTPHeaders": {
-                "server": "nginx/1.24.0 (Ubuntu)",
-                "date": "Fri, 09 Feb 2024 15:54:54 GMT",
-            },
-            "RetryAttempts": 0,
-        }
-    }
-    delete_object_mock = MagicMock(return_value=s3_example_response)
-    monkeypatch.setattr(s3_client._client, "delete_object", delete_object_mock)
-
-    s3_client.delete_backup(backup_id)
-
-    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
-    delete_object_mock.assert_called_once_with(Bucket=s3_parameters_backup.bucket, Key=key)
-
-
-def test_delete_backup_boto_client_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. On delete_object return a boto exception.
-    act: Run delete_backup.
-    assert: The function delete_object throws an exception.
-    """
-    backup_id = "backup-20240101"
-    backups = [backup.S3Backup(backup_id=backup_id, last_modified=datetime.datetime.now(), size=1)]
-    s3_client = backup.S3Client(s3_parameters_backup)
-    monkeypatch.setattr(s3_client, "list_backups", MagicMock(return_value=backups))
-    monkeypatch.setattr(
-        s3_client._client, "delete_object", MagicMock(side_effect=ClientError({}, "Generic Error"))
-    )
-
-    with pytest.raises(backup.S3Error) as err:
-        s3_client.delete_backup(backup_id)
-    assert "Cannot delete backup_id" in str(err.value)
-
-
-def test_exists_backup_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. mock head_object to return a correct response.
-    act: Run exists_backup.
-    assert: Check exists backup returns true and the head_object was called.
-    """
-    backup_id = "backup-20240101"
-    head_object_mock = MagicMock()
-    s3_client = backup.S3Client(s3_parameters_backup)
-    monkeypatch.setattr(s3_client._client, "head_object", head_object_mock)
-
-    assert s3_client.exists_backup(backup_id)
-
-    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
-    head_object_mock.assert_called_once_with(
-        Bucket=s3_parameters_backup.bucket,
-        Key=key,
-    )
-
-
-def test_exists_backup_does_not_exist(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. mock head_object to raise a ClientError similar to what a real
-        S3 storage would return when the object does not exist.
-    act: Run exists_backup.
-    assert: It should return False and head_object should be called.
-    """
-    error_response = {
-        "Error": {"Code": "404", "Message": "Not Found"},
-        "ResponseMetadata": {
-            "HTTPStatusCode": 404,
-            "HTTPHeaders": {
-                "server": "nginx/1.24.0 (Ubuntu)",
-            },
-            "RetryAttempts": 0,
-        },
-    }
-    backup_id = "backup-20240101"
-    head_object_mock = MagicMock(side_effect=ClientError(error_response, ""))
-    s3_client = backup.S3Client(s3_parameters_backup)
-    monkeypatch.setattr(s3_client._client, "head_object", head_object_mock)
-
-    assert not s3_client.exists_backup(backup_id)
-
-    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
-    head_object_mock.assert_called_once_with(
-        Bucket=s3_parameters_backup.bucket,
-        Key=key,
-    )
-
-
-def test_exists_backup_boto_client_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. mock head_object to raise a ClientError.
-    act: Run exists_backup.
-    assert: It should raise and head_bucket should be called.
-    """
-    backup_id = "backup-20240101"
-    head_object_mock = MagicMock(side_effect=ClientError({}, "No Such Bucket"))
-    s3_client = backup.S3Client(s3_parameters_backup)
-    monkeypatch.setattr(s3_client._client, "head_object", head_object_mock)
-
-    with pytest.raises(backup.S3Error):
-        s3_client.exists_backup(backup_id)
-
-    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
-    head_object_mock.assert_called_once_with(
-        Bucket=s3_parameters_backup.bucket,
-        Key=key,
-    )
-
-
-def test_list_backups_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. Mock response to return a real response in list_objects_v2.
-    act: Run list_backups.
-    assert: The expected list of backups is correctly parsed.
-    """
-    s3_client = backup.S3Client(s3_parameters_backup)
-    s3_example_response = {
-        "ResponseMetadata": {
-            "RequestId": "17AFBDF4A3306A4F",
-            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
-            "HTTPStatusCode": 200,
-        },
-        "IsTruncated": False,
-        "Contents": [
-            {
-                "Key": "synapse-backups/20240201122721",
-                "LastModified": datetime.datetime(2024, 2, 1, 12, 27, 23, 749000, tzinfo=tzutc()),
-                "ETag": '"ed4a010045db523f7adc1ddc19e26971"',
-                "Size": 38296,
-            },
-            {
-                "Key": "synapse-backups/20240201122942",
-                "LastModified": datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
-                "ETag": '"200e44b3b6e4c1e98b1a902e5260b9be"',
-                "Size": 50000,
-            },
-        ],
-        "Name": "backups-bucket",
-        "Prefix": "synapse-backups",
-        "MaxKeys": 1000,
-        "EncodingType": "url",
-        "KeyCount": 2,
-    }
-    list_objects_v2_mock = MagicMock(return_value=s3_example_response)
-    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
-
-    backups = s3_client.list_backups()
-
-    assert backups == [
-        backup.S3Backup(
-            backup_id="20240201122721",
-            last_modified=datetime.datetime(2024, 2, 1, 12, 27, 23, 749000, tzinfo=tzutc()),
-            size=38296,
-        ),
-        backup.S3Backup(
-            backup_id="20240201122942",
-            last_modified=datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
-            size=50000,
-        ),
-    ]
-
-
-def test_list_backups_correct_no_root_slash(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. Mock response to return a real response in list_objects_v2 with
-        Keys without root slash as returned by MinIO even when created with root slash.
-    act: Run list_backups.
-    assert: The expected list of backups is correctly parsed.
-    """
-    s3_parameters_backup.path = s3_parameters_backup.path.strip("/")
-    s3_client = backup.S3Client(s3_parameters_backup)
-    s3_example_response = {
-        "ResponseMetadata": {
-            "RequestId": "17AFBDF4A3306A4F",
-            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
-            "HTTPStatusCode": 200,
-        },
-        "IsTruncated": False,
-        "Contents": [
-            {
-                "Key": "synapse-backups/20240201122942",
-                "LastModified": datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
-                "ETag": '"200e44b3b6e4c1e98b1a902e5260b9be"',
-                "Size": 50000,
-            },
-        ],
-        "Name": "backups-bucket",
-        "Prefix": "synapse-backups/",
-        "MaxKeys": 1000,
-        "EncodingType": "url",
-        "KeyCount": 2,
-    }
-    list_objects_v2_mock = MagicMock(return_value=s3_example_response)
-    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
-
-    backups = s3_client.list_backups()
-
-    assert backups == [
-        backup.S3Backup(
-            backup_id="20240201122942",
-            last_modified=datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
-            size=50000,
-        ),
-    ]
-
-
-def test_list_backups_empty(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. Mock response to return a real empty response in list_objects_v2.
-    act: Run list_backups.
-    assert: The expected list of backups is correctly parsed.
-    """
-    s3_client = backup.S3Client(s3_parameters_backup)
-    s3_example_response = {
-        "ResponseMetadata": {
-            "RequestId": "17AFBDF4A3306A4F",
-            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
-            "HTTPStatusCode": 200,
-        },
-        "IsTruncated": False,
-        "Name": "backups-bucket",
-        "Prefix": "synapse",
-        "MaxKeys": 1000,
-        "EncodingType": "url",
-        "KeyCount": 0,
-    }
-    list_objects_v2_mock = MagicMock(return_value=s3_example_response)
-    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
-
-    backups = s3_client.list_backups()
-
-    assert not backups
-
-
-def test_list_backups_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
-    """
-    arrange: Create a S3Client. Mock response to raise a ClientError Exception.
-    act: Run list_backups.
-    assert: A S3Error should be raised.
-    """
-    s3_client = backup.S3Client(s3_parameters_backup)
-    list_objects_v2_mock = MagicMock(side_effect=ClientError({}, "No Such Bucket"))
-    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
-
-    with pytest.raises(backup.S3Error) as err:
-        s3_client.list_backups()
-    assert "Error iterating" in str(err.value)
-
-
 def test_create_backup_correct(
     harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
 ):
     """
     arrange: Given the Synapse container, s3parameters, passphrase, the backup key and its location
-        mock prepare_container, calculate_size and get paths
+        mock prepare_container and get paths
     act: Call create_backup
     assert: A command is executed to backup and has at least the paths.
     """
     container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
     passphrase = token_hex(16)
     monkeypatch.setattr(backup, "_prepare_container", MagicMock())
-    monkeypatch.setattr(backup, "_calculate_size", MagicMock(return_value=1000))
     monkeypatch.setattr(backup, "_get_paths_to_backup", MagicMock(return_value=["file1", "dir1"]))
+    monkeypatch.setattr(
+        backup, "build_manifest", MagicMock(return_value=(backup.BackupManifest(None, {}), []))
+    )
+    monkeypatch.setattr(backup, "_put_manifest", MagicMock())
 
     def backup_command_handler(args: list[str]) -> synapse.ExecResult:
         """Handler for the exec of the backup command.
@@ -484,7 +177,6 @@ def test_create_backup_no_files(
     container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
     passphrase = token_hex(16)
     monkeypatch.setattr(backup, "_prepare_container", MagicMock())
-    monkeypatch.setattr(backup, "_calculate_size", MagicMock(return_value=1000))
     monkeypatch.setattr(backup, "_get_paths_to_backup", MagicMock(return_value=[]))
     with pytest.raises(backup.BackupError) as err:
         backup.create_backup(container, s3_parameters_backup, passphrase)
@@ -503,8 +195,11 @@ def test_create_backup_failure(
     container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
     passphrase = token_hex(16)
     monkeypatch.setattr(backup, "_prepare_container", MagicMock())
-    monkeypatch.setattr(backup, "_calculate_size", MagicMock(return_value=1000))
     monkeypatch.setattr(backup, "_get_paths_to_backup", MagicMock(return_value=["file1", "dir1"]))
+    monkeypatch.setattr(
+        backup, "build_manifest", MagicMock(return_value=(backup.BackupManifest(None, {}), []))
+    )
+    monkeypatch.setattr(backup, "_put_manifest", MagicMock())
 
     def backup_command_handler(_: list[str]) -> synapse.ExecResult:
         """Handler for the exec of the backup command.
@@ -540,6 +235,7 @@ def test_restore_backup_correct(
     passphrase = token_hex(16)
     backup_id = token_hex(16)
     monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(backup, "_get_manifest", MagicMock(return_value=None))
     stop_mock = MagicMock(side_effect=container.stop)
     monkeypatch.setattr(container, "stop", stop_mock)
     monkeypatch.setattr(synapse, "get_media_store_path", MagicMock(return_value="/data/media"))
@@ -572,6 +268,341 @@ def test_restore_backup_correct(
     assert container.get_service(synapse.SYNAPSE_SERVICE_NAME).is_running()
 
 
+def test_create_backup_incremental(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container and the manifest of a parent backup,
+        mock prepare_container, get paths and the manifest building.
+    act: Call create_backup with the parent backup.
+    assert: Only the changed files are archived, read from the standard input, and the
+        manifest of the new backup lists all the files with the parent backup.
+    """
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    manifest = backup.BackupManifest(
+        parent="backup-parent",
+        files={
+            "/data/unchanged": (10, "1.0", "hash-unchanged", None),
+            "/data/modified": (31, "3.5", "hash-modified-2", None),
+            "/data/new": (50, "5.0", None, None),
+        },
+    )
+    parent_manifest = backup.BackupManifest(parent=None, files={})
+    monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(backup, "_get_paths_to_backup", MagicMock(return_value=["/data"]))
+    monkeypatch.setattr(backup, "_get_manifest", MagicMock(return_value=parent_manifest))
+    build_manifest_mock = MagicMock(return_value=(manifest, ["/data/modified", "/data/new"]))
+    monkeypatch.setattr(backup, "build_manifest", build_manifest_mock)
+    put_manifest_mock = MagicMock()
+    monkeypatch.setattr(backup, "_put_manifest", put_manifest_mock)
+    exec_mock = MagicMock()
+    exec_mock.return_value.wait_output.return_value = ("", "")
+    monkeypatch.setattr(container, "exec", exec_mock)
+
+    backup_id = backup.create_backup(
+        container,
+        s3_parameters_backup,
+        token_hex(16),
+        backup.BackupSettings(parent_backup_id="backup-parent"),
+    )
+
+    build_manifest_mock.assert_called_once_with(
+        container, ["/data"], "backup-parent", parent_manifest
+    )
+    backup_command = exec_mock.call_args.args[0][2]
+    assert "tar -c --null -T -" in backup_command
+    assert f"--expected-size={backup_manifest.TAR_RECORD_SIZE}" in backup_command
+    assert "parent-backup=backup-parent" in backup_command
+    assert exec_mock.call_args.kwargs["stdin"] == "/data/modified\0/data/new"
+    put_manifest_mock.assert_called_once_with(
+        container,
+        s3_parameters_backup,
+        backup_id,
+        backup.BackupManifest(
+            parent="backup-parent",
+            files={
+                "/data/unchanged": (10, "1.0", "hash-unchanged", None),
+                "/data/modified": (31, "3.5", "hash-modified-2", 0),
+                "/data/new": (50, "5.0", None, 0),
+            },
+        ),
+    )
+
+
+def test_create_backup_incremental_no_parent_manifest(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container and a parent backup without manifest.
+    act: Call create_backup with the parent backup.
+    assert: BackupError exception because the changed files cannot be found.
+    """
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(backup, "_get_paths_to_backup", MagicMock(return_value=["/data"]))
+    monkeypatch.setattr(backup, "_get_manifest", MagicMock(return_value=None))
+
+    with pytest.raises(backup.BackupError) as err:
+        backup.create_backup(
+            container,
+            s3_parameters_backup,
+            token_hex(16),
+            backup.BackupSettings(parent_backup_id="backup-parent"),
+        )
+    assert "has no manifest" in str(err.value)
+
+
+def test_restore_backup_incremental(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container and an incremental backup with two parents.
+    act: Call restore_backup.
+    assert: The backups are restored from the full backup to the requested one, and the
+        files deleted since the parent backups are removed.
+    """
+    harness.begin_with_initial_hooks()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    manifests = {
+        "backup-1": backup.BackupManifest(
+            parent=None,
+            files={"/data/a": (1, "1.0", "a", 0), "/data/b": (1, "1.0", "b", 0)},
+        ),
+        "backup-2": backup.BackupManifest(
+            parent="backup-1",
+            files={"/data/a": (1, "1.0", "a", None), "/data/c": (1, "2.0", "c", 0)},
+        ),
+        "backup-3": backup.BackupManifest(
+            parent="backup-2",
+            files={"/data/c": (1, "2.0", "c", None), "/data/d": (1, "3.0", "d", 0)},
+        ),
+    }
+    monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(
+        backup,
+        "_get_manifest",
+        MagicMock(side_effect=lambda _, __, backup_id: manifests[backup_id]),
+    )
+    monkeypatch.setattr(synapse, "get_media_store_path", MagicMock(return_value="/data/media"))
+    exec_mock = MagicMock()
+    exec_mock.return_value.wait_output.return_value = ("", "")
+    monkeypatch.setattr(container, "exec", exec_mock)
+
+    backup.restore_backup(container, s3_parameters_backup, token_hex(16), "backup-3")
+
+    commands = [exec_call.args[0][2] for exec_call in exec_mock.call_args_list]
+    assert len(commands) == 4
+    for exec_call, backup_id in zip(
+        exec_mock.call_args_list, ("backup-1", "backup-2", "backup-3")
+    ):
+        assert f"--key 'synapse-backups/{backup_id}'" in exec_call.args[0][2]
+        assert f"/synapse-backups/{backup_id}?" in exec_call.kwargs["stdin"]
+    assert "rm -f" in commands[3]
+    assert exec_mock.call_args.kwargs["stdin"] == "/data/a\0/data/b"
+    assert container.get_service(synapse.SYNAPSE_SERVICE_NAME).is_running()
+
+
+def test_restore_backup_incremental_missing_parent(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container and an incremental backup whose parent has
+        no manifest.
+    act: Call restore_backup.
+    assert: BackupError exception is raised before Synapse is stopped.
+    """
+    harness.begin_with_initial_hooks()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    manifest = backup.BackupManifest(parent="backup-1", files={})
+    monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(backup, "_get_manifest", MagicMock(side_effect=[manifest, None]))
+    stop_mock = MagicMock()
+    monkeypatch.setattr(container, "stop", stop_mock)
+
+    with pytest.raises(backup.BackupError) as err:
+        backup.restore_backup(container, s3_parameters_backup, token_hex(16), "backup-2")
+    assert "Backup backup-1 has no manifest" in str(err.value)
+    stop_mock.assert_not_called()
+
+
+def test_create_backup_sharded(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container with files for three shards, mock prepare_container,
+        get paths and the manifest building.
+    act: Call create_backup with up to 3 shards.
+    assert: The shards are archived in parallel, each of them from the files it lists,
+        and the index and the manifest record them.
+    """
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    size = backup_manifest.MIN_SHARD_SIZE
+    files: dict[str, tuple[int, str, Optional[str], Optional[int]]] = {
+        path: (size, "1.0", None, None) for path in ("/data/a", "/data/b", "/data/c")
+    }
+    monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(backup, "_get_paths_to_backup", MagicMock(return_value=["/data"]))
+    monkeypatch.setattr(
+        backup,
+        "build_manifest",
+        MagicMock(return_value=(backup.BackupManifest(None, files), list(files))),
+    )
+    put_index_mock = MagicMock()
+    monkeypatch.setattr(backup, "_put_index", put_index_mock)
+    put_manifest_mock = MagicMock()
+    monkeypatch.setattr(backup, "_put_manifest", put_manifest_mock)
+    exec_mock = MagicMock()
+    exec_mock.return_value.wait_output.return_value = ("", "")
+    monkeypatch.setattr(container, "exec", exec_mock)
+
+    backup_id = backup.create_backup(
+        container, s3_parameters_backup, token_hex(16), backup.BackupSettings(shards=3)
+    )
+
+    shard_names = [f"{backup_id}{backup.SHARD_SUFFIX}{shard}" for shard in range(3)]
+    assert [
+        (exec_call.kwargs["stdin"], exec_call.args[0][2].rsplit("/", 1)[1])
+        for exec_call in exec_mock.call_args_list
+    ] == [
+        ("/data/a", f"{shard_names[0]}'"),
+        ("/data/b", f"{shard_names[1]}'"),
+        ("/data/c", f"{shard_names[2]}'"),
+    ]
+    manifest = put_manifest_mock.call_args.args[3]
+    put_index_mock.assert_called_once_with(container, s3_parameters_backup, backup_id, manifest)
+    assert manifest.get_archive_names(backup_id) == shard_names
+
+
+def test_restore_backup_sharded(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container and a backup in two shards.
+    act: Call restore_backup with a memory budget of 64 MiB.
+    assert: Both shards are restored, each of them buffering half of the memory budget.
+    """
+    harness.begin_with_initial_hooks()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    manifest = backup.BackupManifest(parent=None, files={}, shards=2)
+    prepare_container_mock = MagicMock()
+    monkeypatch.setattr(backup, "_prepare_container", prepare_container_mock)
+    monkeypatch.setattr(backup, "_get_manifest", MagicMock(return_value=manifest))
+    monkeypatch.setattr(synapse, "get_media_store_path", MagicMock(return_value="/data/media"))
+    exec_mock = MagicMock()
+    exec_mock.return_value.wait_output.return_value = ("", "")
+    monkeypatch.setattr(container, "exec", exec_mock)
+
+    backup.restore_backup(
+        container,
+        s3_parameters_backup,
+        token_hex(16),
+        "backup-1",
+        backup.RestoreSettings(
+            transfer_settings=backup.TransferSettings(memory_budget=64 * backup_transfer.MIB)
+        ),
+    )
+
+    assert len(exec_mock.call_args_list) == 2
+    for shard, exec_call in enumerate(exec_mock.call_args_list):
+        assert f"/synapse-backups/backup-1{backup.SHARD_SUFFIX}{shard}?" in (
+            exec_call.kwargs["stdin"]
+        )
+        # 32 MiB of 8 MiB chunks for each of the two shards.
+        assert "--concurrency 2 --buffer-chunks 4" in exec_call.args[0][2]
+    assert prepare_container_mock.call_count == 2
+    assert container.get_service(synapse.SYNAPSE_SERVICE_NAME).is_running()
+
+
+def test_restore_backup_selected_paths(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container and an incremental backup of a sharded backup,
+        the signing key being archived in the first shard of the full backup.
+    act: Call restore_backup with the signing keys as paths.
+    assert: Only the shard holding the signing key is downloaded and only the key is
+        extracted, the media is left untouched.
+    """
+    harness.begin_with_initial_hooks()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    manifests = {
+        "backup-1": backup.BackupManifest(
+            parent=None,
+            files={
+                "/data/a.signing.key": (1, "1.0", "key", 0),
+                "/data/media/a": (1, "1.0", "a", 1),
+            },
+            shards=2,
+        ),
+        "backup-2": backup.BackupManifest(
+            parent="backup-1",
+            files={
+                "/data/a.signing.key": (1, "1.0", "key", None),
+                "/data/media/a": (1, "2.0", "a2", 0),
+            },
+        ),
+    }
+    monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(
+        backup,
+        "_get_manifest",
+        MagicMock(side_effect=lambda _, __, backup_id: manifests[backup_id]),
+    )
+    remove_path_mock = MagicMock()
+    monkeypatch.setattr(container, "remove_path", remove_path_mock)
+    push_mock = MagicMock()
+    monkeypatch.setattr(container, "push", push_mock)
+    exec_mock = MagicMock()
+    exec_mock.return_value.wait_output.return_value = ("", "")
+    monkeypatch.setattr(container, "exec", exec_mock)
+
+    backup.restore_backup(
+        container,
+        s3_parameters_backup,
+        token_hex(16),
+        "backup-2",
+        backup.RestoreSettings(paths=["/data/*.key"]),
+    )
+
+    members_file = f"{backup.RESTORE_MEMBERS_FILE}-0"
+    exec_mock.assert_called_once()
+    assert f"/synapse-backups/backup-1{backup.SHARD_SUFFIX}0?" in (
+        exec_mock.call_args.kwargs["stdin"]
+    )
+    assert f"tar -x -C / --null -T '{members_file}'" in exec_mock.call_args.args[0][2]
+    assert push_mock.call_args.args == (members_file, "data/a.signing.key")
+    remove_path_mock.assert_called_once_with(members_file)
+    assert container.get_service(synapse.SYNAPSE_SERVICE_NAME).is_running()
+
+
+def test_restore_backup_selected_paths_no_match(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Given the Synapse container and a backup without files matching the paths.
+    act: Call restore_backup with paths.
+    assert: BackupError exception is raised before Synapse is stopped.
+    """
+    harness.begin_with_initial_hooks()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    manifest = backup.BackupManifest(parent=None, files={"/data/a.key": (1, "1.0", "key", 0)})
+    monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(backup, "_get_manifest", MagicMock(return_value=manifest))
+    stop_mock = MagicMock()
+    monkeypatch.setattr(container, "stop", stop_mock)
+
+    with pytest.raises(backup.BackupError) as err:
+        backup.restore_backup(
+            container,
+            s3_parameters_backup,
+            token_hex(16),
+            "backup-1",
+            backup.RestoreSettings(paths=["/data/media/local_content"]),
+        )
+    assert "No file of backup-1 matches" in str(err.value)
+    stop_mock.assert_not_called()
+
+
 def test_restore_backup_failure(
     harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
 ):
@@ -587,6 +618,7 @@ def test_restore_backup_failure(
     passphrase = token_hex(16)
     backup_id = token_hex(16)
     monkeypatch.setattr(backup, "_prepare_container", MagicMock())
+    monkeypatch.setattr(backup, "_get_manifest", MagicMock(return_value=None))
     stop_mock = MagicMock(side_effect=container.stop)
     monkeypatch.setattr(container, "stop", stop_mock)
     monkeypatch.setattr(synapse, "get_media_store_path", MagicMock(return_value="/data/media"))
@@ -620,7 +652,7 @@ def test_prepare_container_correct(harness: Harness, s3_parameters_backup):
     """
     arrange: Given the Synapse container, s3parameters, passphrase and its location
     act: Call _prepare_container
-    assert: The file with the passphare is in the container. AWS commands did not fail.
+    assert: The files with the passphrase and the AWS configuration are in the container.
     """
     passphrase = token_hex(16)
     container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
@@ -628,66 +660,44 @@ def test_prepare_container_correct(harness: Harness, s3_parameters_backup):
     passphrase_relative_dir = pathlib.Path(backup.PASSPHRASE_FILE).relative_to("/").parent
     passphrase_dir = synapse_root / passphrase_relative_dir
     passphrase_dir.mkdir(exist_ok=True)
-
-    def aws_command_handler(argv: list[str]) -> synapse.ExecResult:
-        """Handler for the exec of the aws command.
-
-        Args:
-            argv: argument given to the container.exec.
-
-        Returns:
-            tuple with status_code, stdout and stderr.
-        """
-        assert argv[0:3] == [
-            backup.AWS_COMMAND,
-            "configure",
-            "set",
-        ]
-        # let the rest of checks for the integration tests.
-        return synapse.ExecResult(0, "", "")
-
-    harness.register_command_handler(  # type: ignore # pylint: disable=no-member
-        container=container,
-        executable=backup.AWS_COMMAND,
-        handler=aws_command_handler,
+    transfer_settings = backup.TransferSettings(
+        max_concurrent_requests=4,
+        multipart_chunksize=16 * backup_transfer.MIB,
+        max_bandwidth="50MB/s",
     )
 
-    backup._prepare_container(container, s3_parameters_backup, passphrase)
+    backup._prepare_container(container, s3_parameters_backup, passphrase, transfer_settings)
 
     assert container.pull(backup.PASSPHRASE_FILE).read() == passphrase
+    assert container.pull(backup.AWS_CONFIG_FILE).read() == (
+        "[default]\n"
+        "s3 =\n"
+        f"  addressing_style = {s3_parameters_backup.addressing_style}\n"
+        "  max_concurrent_requests = 4\n"
+        f"  multipart_chunksize = {16 * backup_transfer.MIB}\n"
+        "  max_bandwidth = 50MB/s\n"
+    )
 
 
-def test_prepare_container_error_aws(harness: Harness, s3_parameters_backup):
+def test_prepare_container_error_aws(
+    harness: Harness, s3_parameters_backup, monkeypatch: pytest.MonkeyPatch
+):
     """
     arrange: Given the Synapse container, s3parameters, passphrase and its location
-        mock container.exec when aws commands are called.
+        mock container.push to fail.
     act: Call prepare_container
     assert: BackupError exception is raised.
     """
     passphrase = token_hex(16)
     container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
-    synapse_root = harness.get_filesystem_root(container)
-    passphrase_relative_dir = pathlib.Path(backup.PASSPHRASE_FILE).relative_to("/").parent
-    passphrase_dir = synapse_root / passphrase_relative_dir
-    passphrase_dir.mkdir(exist_ok=True)
-
-    def aws_command_handler(_: list[str]) -> synapse.ExecResult:
-        """Handler for the exec of the aws command.
-
-        Returns:
-            tuple with status_code, stdout and stderr.
-        """
-        # let the rest of checks for the integration tests.
-        return synapse.ExecResult(1, "", "error")
-
-    harness.register_command_handler(  # type: ignore # pylint: disable=no-member
-        container=container,
-        executable=backup.AWS_COMMAND,
-        handler=aws_command_handler,
+    monkeypatch.setattr(
+        container, "push", MagicMock(side_effect=ops.pebble.PathError("kind", "error"))
     )
 
     with pytest.raises(backup.BackupError) as err:
-        backup._prepare_container(container, s3_parameters_backup, passphrase)
+        backup._prepare_container(
+            container, s3_parameters_backup, passphrase, backup.TransferSettings()
+        )
     assert "Error configuring AWS" in str(err.value)
 
 
@@ -702,13 +712,38 @@ def test_build_backup_command_correct(s3_parameters_backup):
     paths_to_backup = ["/data/homeserver.db", "/data/example.com.signing.key"]
 
     command = backup._build_backup_command(
-        s3_parameters_backup, "20230101231200", paths_to_backup, "/root/.gpg_passphrase", 1000
+        s3_parameters_backup,
+        backup.Archive("20230101231200", None, 1000),
+        paths_to_backup,
+        "/root/.gpg_passphrase",
+    )
+
+    assert list(command) == [
+        backup.BASH_COMMAND,
+        "-c",
+        f"set -euxo pipefail; tar -c '/data/homeserver.db' '/data/example.com.signing.key' | zstd -T0 -3 -c | gpg --batch --no-symkey-cache --compress-algo none --passphrase-file '/root/.gpg_passphrase' --symmetric | {backup.AWS_COMMAND} s3 cp --expected-size=1000 --metadata 'archive-format=tar+zstd' - 's3://synapse-backup-bucket/synapse-backups/20230101231200'",  # noqa: E501
+    ]
+
+
+def test_build_backup_command_no_compression(s3_parameters_backup):
+    """
+    arrange: Given some s3 parameters for backup, paths and no compression.
+    act: run _build_backup_command
+    assert: the archive is not compressed, neither by gpg, and its format is recorded.
+    """
+    # pylint: disable=line-too-long
+    command = backup._build_backup_command(
+        s3_parameters_backup,
+        backup.Archive("20230101231200", None, 1000),
+        ["/data/media_store/local_content"],
+        "/root/.gpg_passphrase",
+        backup.BackupSettings(compression=backup.Compression(algorithm=backup.COMPRESSION_NONE)),
     )
 
     assert list(command) == [
         backup.BASH_COMMAND,
         "-c",
-        f"set -euxo pipefail; tar -c '/data/homeserver.db' '/data/example.com.signing.key' | gpg --batch --no-symkey-cache --passphrase-file '/root/.gpg_passphrase' --symmetric | {backup.AWS_COMMAND} s3 cp --expected-size=1000 - 's3://synapse-backup-bucket/synapse-backups/20230101231200'",  # noqa: E501
+        f"set -euxo pipefail; tar -c '/data/media_store/local_content' | gpg --batch --no-symkey-cache --compress-algo none --passphrase-file '/root/.gpg_passphrase' --symmetric | {backup.AWS_COMMAND} s3 cp --expected-size=1000 --metadata 'archive-format=tar' - 's3://synapse-backup-bucket/synapse-backups/20230101231200'",  # noqa: E501
     ]
 
 
@@ -765,59 +800,29 @@ def test_get_paths_to_backup_empty(harness: Harness):
     assert len(paths_to_backup) == 0
 
 
-def test_calculate_size(harness: Harness):
-    """
-    arrange: given a container and a list of paths
-    act: call backup.calculate_size
-    assert: exec is run in the container, with the correct command and the stdout is parsed to int.
-    """
-    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
-    paths = ["path1", "path2"]
-
-    def du_handler(argv: list[str]) -> synapse.ExecResult:
-        """Handler for the exec of bash.
-
-        Args:
-            argv: argument given to the container.exec.
-
-        Returns:
-            tuple with status_code, stdout and stderr.
-        """
-        assert argv == [
-            "/usr/bin/bash",
-            "-c",
-            "set -euxo pipefail; du -bsc 'path1' 'path2' | tail -n1 | cut -f 1",
-        ]
-        return synapse.ExecResult(0, "1000", "")
-
-    # A better option would be to use run harness.handle_exec,
-    # but the harness is monkey patched in conftest.py
-    harness.register_command_handler(  # type: ignore # pylint: disable=no-member
-        container=container,
-        executable="/usr/bin/bash",
-        handler=du_handler,
-    )
-
-    size = backup._calculate_size(container, paths)
-
-    assert size == 1000
-
-
 def test_build_restore_command_correct(s3_parameters_backup):
     """
     arrange: Given some s3 parameters for backup, a name for the key in the bucket,
          and passphrase file location
     act: run _build_restore_command
-    assert: the command is the correct calling bash with pipes.
+    assert: the command is the correct calling bash with pipes, downloading the backup
+        with range requests bounded by the memory budget.
     """
     # pylint: disable=line-too-long
+    transfer_settings = backup.TransferSettings(
+        max_concurrent_requests=4,
+        multipart_chunksize=8 * backup_transfer.MIB,
+        memory_budget=64 * backup_transfer.MIB,
+    )
 
     command = backup._build_restore_command(
-        s3_parameters_backup, "20230101231200", "/root/.gpg_passphrase"
+        s3_parameters_backup, "20230101231200", "/root/.gpg_passphrase", transfer_settings
     )
 
     assert list(command) == [
         backup.BASH_COMMAND,
         "-c",
-        f"set -euxo pipefail; {backup.AWS_COMMAND} s3 cp 's3://synapse-backup-bucket/synapse-backups/20230101231200' - | gpg --batch --no-symkey-cache --decrypt --passphrase-file '/root/.gpg_passphrase' | tar -x -C /",  # noqa: E501
+        f"set -euxo pipefail; archive_format=$({backup.AWS_COMMAND} s3api head-object --bucket 'synapse-backup-bucket' --key 'synapse-backups/20230101231200' --query 'Metadata.\"archive-format\"' --output text); "  # noqa: E501
+        "case \"$archive_format\" in tar+zstd) decompress='zstd -d -c';; *) decompress=cat;; esac; "  # noqa: E501
+        f"{backup.RANGED_GET_COMMAND} --chunk-size {8 * backup_transfer.MIB} --concurrency 4 --buffer-chunks 8 | gpg --batch --no-symkey-cache --decrypt --passphrase-file '/root/.gpg_passphrase' | $decompress | tar -x -C /",  # noqa: E501
     ]
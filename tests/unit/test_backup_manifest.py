@@ -0,0 +1,377 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Synapse backup manifest unit tests."""
+
+# pylint: disable=protected-access
+
+import io
+import tarfile
+from typing import Optional
+from unittest.mock import MagicMock
+
+import pytest
+from ops.testing import Harness
+
+import backup_manifest
+import synapse
+
+
+def test_backup_manifest_from_json_without_archive_index():
+    """
+    arrange: Given a JSON manifest written before the archive index was recorded.
+    act: Call BackupManifest.from_json.
+    assert: The files have no archive index and the backup is not sharded.
+    """
+    content = '{"files":{"/data/a":[1,"1.0","a"]},"parent":"backup-1"}'
+
+    manifest = backup_manifest.BackupManifest.from_json(content)
+
+    assert manifest == backup_manifest.BackupManifest(
+        parent="backup-1", files={"/data/a": (1, "1.0", "a", None)}
+    )
+    assert backup_manifest.BackupManifest.from_json(manifest.to_json()) == manifest
+
+
+def test_build_manifest_incremental(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Given the Synapse container and the manifest of a parent backup, mock the
+        listing and the hashing of the files.
+    act: Call build_manifest with the parent backup.
+    assert: Only the files of the parent whose size or modification time changed are
+        hashed, and the modified and new files are the ones to archive.
+    """
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    parent_manifest = backup_manifest.BackupManifest(
+        parent=None,
+        files={
+            "/data/unchanged": (10, "1.0", "hash-unchanged", 0),
+            "/data/touched": (20, "2.0", "hash-touched", 0),
+            "/data/modified": (30, "3.0", "hash-modified", 0),
+            "/data/deleted": (40, "4.0", "hash-deleted", 0),
+        },
+    )
+    monkeypatch.setattr(
+        backup_manifest,
+        "_list_files",
+        MagicMock(
+            return_value={
+                "/data/unchanged": (10, "1.0"),
+                "/data/touched": (20, "2.5"),
+                "/data/modified": (31, "3.5"),
+                "/data/new": (50, "5.0"),
+            }
+        ),
+    )
+    hash_files_mock = MagicMock(
+        return_value={"/data/touched": "hash-touched", "/data/modified": "hash-modified-2"}
+    )
+    monkeypatch.setattr(backup_manifest, "_hash_files", hash_files_mock)
+
+    manifest, changed_paths = backup_manifest.build_manifest(
+        container, ["/data"], "backup-parent", parent_manifest
+    )
+
+    hash_files_mock.assert_called_once_with(container, ["/data/touched", "/data/modified"])
+    assert changed_paths == ["/data/modified", "/data/new"]
+    assert manifest == backup_manifest.BackupManifest(
+        parent="backup-parent",
+        files={
+            "/data/unchanged": (10, "1.0", "hash-unchanged", None),
+            "/data/touched": (20, "2.5", "hash-touched", None),
+            "/data/modified": (31, "3.5", "hash-modified-2", None),
+            "/data/new": (50, "5.0", None, None),
+        },
+    )
+
+
+def test_hash_files_unreadable(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Given the Synapse container with two files, mock the hashing command to
+        hash only one of them.
+    act: Call _hash_files for both files, then once the file not hashed is removed.
+    assert: ManifestError exception is raised while the file not hashed still exists,
+        then it is left out of the hashes.
+    """
+    harness.set_can_connect(synapse.SYNAPSE_CONTAINER_NAME, True)
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    container.push("/data/readable", "a", make_dirs=True)
+    container.push("/data/unreadable", "b", make_dirs=True)
+    exec_mock = MagicMock()
+    exec_mock.return_value.wait_output.return_value = ("hash-a  /data/readable\0", "")
+    monkeypatch.setattr(container, "exec", exec_mock)
+
+    with pytest.raises(backup_manifest.ManifestError) as err:
+        backup_manifest._hash_files(container, ["/data/readable", "/data/unreadable"])
+    assert "1 files cannot be hashed" in str(err.value)
+
+    container.remove_path("/data/unreadable")
+
+    assert backup_manifest._hash_files(container, ["/data/readable", "/data/unreadable"]) == {
+        "/data/readable": "hash-a"
+    }
+
+
+@pytest.mark.parametrize(
+    "shards, file_sizes, expected_shard_count",
+    [
+        pytest.param(4, {"a": backup_manifest.MIN_SHARD_SIZE * 8}, 1, id="single file"),
+        pytest.param(
+            4,
+            {"a": backup_manifest.MIN_SHARD_SIZE, "b": backup_manifest.MIN_SHARD_SIZE - 1},
+            1,
+            id="small",
+        ),
+        pytest.param(
+            2,
+            {path: backup_manifest.MIN_SHARD_SIZE for path in ("a", "b", "c")},
+            2,
+            id="limited by configuration",
+        ),
+        pytest.param(
+            0,
+            {str(path): backup_manifest.MIN_SHARD_SIZE for path in range(256)},
+            8,
+            id="one per CPU",
+        ),
+        pytest.param(0, {"a": backup_manifest.MIN_SHARD_SIZE}, 1, id="small, one per CPU"),
+    ],
+)
+def test_get_shard_count(
+    shards: int,
+    file_sizes: dict[str, int],
+    expected_shard_count: int,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """
+    arrange: Given the maximum number of shards and the files to archive, with 8 CPUs
+        available to the container.
+    act: Call _get_shard_count.
+    assert: The backup is split in as many shards as allowed by the configuration,
+        the number of files and the minimum shard size. The CPUs are only read for
+        the backups large enough to be split.
+    """
+    container = MagicMock()
+    get_cpu_count_mock = MagicMock(return_value=8)
+    monkeypatch.setattr(synapse, "get_cpu_count", get_cpu_count_mock)
+
+    shard_count = backup_manifest._get_shard_count(container, shards, file_sizes)
+
+    assert shard_count == expected_shard_count
+    if expected_shard_count == 1:
+        get_cpu_count_mock.assert_not_called()
+    elif not shards:
+        get_cpu_count_mock.assert_called_once_with(container)
+
+
+def test_plan_archives_sharded():
+    """
+    arrange: Given the manifest of a full backup with files for three shards.
+    act: Call plan_archives with up to 3 shards.
+    assert: The files are split in 3 archives of about the same size and the manifest
+        records the archive of each file.
+    """
+    size = backup_manifest.MIN_SHARD_SIZE
+    files: dict[str, tuple[int, str, Optional[str], Optional[int]]] = {
+        "/data/a": (3 * size, "1.0", "a", None),
+        "/data/b": (2 * size, "1.0", "b", None),
+        "/data/c": (size, "1.0", "c", None),
+        "/data/d": (size, "1.0", "d", None),
+    }
+
+    manifest, archives = backup_manifest.plan_archives(
+        MagicMock(), "backup-1", backup_manifest.BackupManifest(None, files), list(files), 3
+    )
+
+    shard_names = [f"backup-1{backup_manifest.SHARD_SUFFIX}{shard}" for shard in range(3)]
+    assert archives == [
+        backup_manifest.Archive(
+            shard_names[0], ["/data/a"], backup_manifest._estimate_archive_size([3 * size])
+        ),
+        backup_manifest.Archive(
+            shard_names[1], ["/data/b"], backup_manifest._estimate_archive_size([2 * size])
+        ),
+        backup_manifest.Archive(
+            shard_names[2],
+            ["/data/c", "/data/d"],
+            backup_manifest._estimate_archive_size([size, size]),
+        ),
+    ]
+    assert manifest.get_archive_names("backup-1") == shard_names
+    assert manifest == backup_manifest.BackupManifest(
+        None,
+        {
+            "/data/a": (3 * size, "1.0", "a", 0),
+            "/data/b": (2 * size, "1.0", "b", 1),
+            "/data/c": (size, "1.0", "c", 2),
+            "/data/d": (size, "1.0", "d", 2),
+        },
+        shards=3,
+    )
+
+
+def test_plan_archives_config_archive():
+    """
+    arrange: Given the manifest of a full backup with a signing key and large media files.
+    act: Call plan_archives with a single shard.
+    assert: The signing key is archived in a shard of its own and the manifest records
+        the archive of each file.
+    """
+    size = backup_manifest.MIN_SHARD_SIZE
+    files: dict[str, tuple[int, str, Optional[str], Optional[int]]] = {
+        "/data/example.com.signing.key": (100, "1.0", "key", None),
+        "/data/media_store/local_content/a": (size, "1.0", "a", None),
+        "/data/media_store/local_content/b": (size, "1.0", "b", None),
+    }
+
+    manifest, archives = backup_manifest.plan_archives(
+        MagicMock(), "backup-1", backup_manifest.BackupManifest(None, files), list(files), 1
+    )
+
+    assert [archive.files for archive in archives] == [
+        ["/data/example.com.signing.key"],
+        ["/data/media_store/local_content/a", "/data/media_store/local_content/b"],
+    ]
+    assert manifest == backup_manifest.BackupManifest(
+        None,
+        {
+            "/data/example.com.signing.key": (100, "1.0", "key", 0),
+            "/data/media_store/local_content/a": (size, "1.0", "a", 1),
+            "/data/media_store/local_content/b": (size, "1.0", "b", 1),
+        },
+        shards=2,
+    )
+
+
+def test_get_restore_steps_selected_paths():
+    """
+    arrange: Given an incremental backup of a sharded backup, the signing key being
+        archived in the first shard of the full backup.
+    act: Call get_restore_steps for the whole backup, then for the signing keys.
+    assert: Every archive of each backup is restored whole, in order, while only the
+        shard holding the signing key is restored for the signing keys.
+    """
+    backup_chain: list[tuple[str, Optional[backup_manifest.BackupManifest]]] = [
+        (
+            "backup-1",
+            backup_manifest.BackupManifest(
+                parent=None,
+                files={
+                    "/data/b.signing.key": (2, "1.0", None, 0),
+                    "/data/media/local_content/b": (2, "1.0", None, 1),
+                },
+                shards=2,
+            ),
+        ),
+        (
+            "backup-2",
+            backup_manifest.BackupManifest(
+                parent="backup-1",
+                files={
+                    "/data/b.signing.key": (2, "1.0", None, None),
+                    "/data/media/local_content/b": (3, "2.0", "b2", 0),
+                },
+            ),
+        ),
+    ]
+
+    shard_names = [f"backup-1{backup_manifest.SHARD_SUFFIX}{shard}" for shard in range(2)]
+    assert backup_manifest.get_restore_steps(backup_chain, None) == [
+        {shard_names[0]: None, shard_names[1]: None},
+        {"backup-2": None},
+    ]
+    assert backup_manifest.get_restore_steps(backup_chain, ["/data/*.key"]) == [
+        {shard_names[0]: ["/data/b.signing.key"]}
+    ]
+
+
+@pytest.mark.parametrize(
+    "manifest, paths, expected_error",
+    [
+        pytest.param(None, ["/data/*.key"], "has no manifest", id="no manifest"),
+        pytest.param(
+            backup_manifest.BackupManifest(
+                parent=None, files={"/data/a.key": (1, "1.0", "key", 0)}
+            ),
+            ["/data/media/local_content"],
+            "No file of backup-1 matches",
+            id="no match",
+        ),
+        pytest.param(
+            backup_manifest.BackupManifest(
+                parent=None, files={"/data/a.key": (1, "1.0", "key", None)}
+            ),
+            ["/data/a.key"],
+            "No archive of /data/a.key",
+            id="no archive index",
+        ),
+    ],
+)
+def test_get_restore_steps_selected_paths_error(
+    manifest: Optional[backup_manifest.BackupManifest], paths: list[str], expected_error: str
+):
+    """
+    arrange: Given a backup whose files cannot be selected.
+    act: Call get_restore_steps with paths.
+    assert: ManifestError exception is raised.
+    """
+    with pytest.raises(backup_manifest.ManifestError) as err:
+        backup_manifest.get_restore_steps([("backup-1", manifest)], paths)
+    assert expected_error in str(err.value)
+
+
+def test_get_deleted_files():
+    """
+    arrange: Given an incremental backup with two parents.
+    act: Call get_deleted_files.
+    assert: The files of the parent backups missing from the last backup are returned.
+    """
+    backup_chain: list[tuple[str, Optional[backup_manifest.BackupManifest]]] = [
+        (
+            "backup-1",
+            backup_manifest.BackupManifest(
+                parent=None,
+                files={"/data/a": (1, "1.0", "a", 0), "/data/b": (1, "1.0", "b", 0)},
+            ),
+        ),
+        (
+            "backup-2",
+            backup_manifest.BackupManifest(
+                parent="backup-1",
+                files={"/data/a": (1, "1.0", "a", None), "/data/c": (1, "2.0", "c", 0)},
+            ),
+        ),
+        (
+            "backup-3",
+            backup_manifest.BackupManifest(
+                parent="backup-2",
+                files={"/data/c": (1, "2.0", "c", None), "/data/d": (1, "3.0", "d", 0)},
+            ),
+        ),
+    ]
+
+    assert backup_manifest.get_deleted_files(backup_chain) == ["/data/a", "/data/b"]
+
+
+@pytest.mark.parametrize(
+    "file_sizes",
+    [
+        pytest.param([], id="empty"),
+        pytest.param([0, 1, 511, 512, 513], id="block boundaries"),
+        pytest.param([100_000] * 30, id="several records"),
+    ],
+)
+def test_estimate_archive_size(file_sizes: list[int]):
+    """
+    arrange: given the sizes of files.
+    act: call _estimate_archive_size.
+    assert: the estimate is the size of a tar archive of such files.
+    """
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w", format=tarfile.GNU_FORMAT) as tar:
+        for index, file_size in enumerate(file_sizes):
+            member = tarfile.TarInfo(f"data/file{index}")
+            member.size = file_size
+            tar.addfile(member, io.BytesIO(b"\0" * file_size))
+
+    assert backup_manifest._estimate_archive_size(file_sizes) == len(archive.getvalue())
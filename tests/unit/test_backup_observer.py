@@ -161,6 +161,73 @@ def test_create_backup_no_passphrase(
     assert "Missing backup_passphrase" in str(err.value.message)
 
 
+def test_create_backup_incremental(
+    s3_relation_data_backup, harness: Harness, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: start the Synapse charm. Integrate with s3-integrator. Mock can_use_bucket,
+        create_backup and two backups in S3, the latest with a manifest.
+    act: Run the backup action with incremental.
+    assert: The backup is created on top of the latest backup.
+    """
+    monkeypatch.setattr(backup.S3Client, "can_use_bucket", MagicMock(return_value=True))
+    backups = [
+        backup.S3Backup("backup-2", datetime.datetime(2024, 2, 2), 10),
+        backup.S3Backup("backup-1", datetime.datetime(2024, 2, 1), 10),
+    ]
+    monkeypatch.setattr(backup.S3Client, "list_backups", MagicMock(return_value=backups))
+    exists_backup = MagicMock(return_value=True)
+    monkeypatch.setattr(backup.S3Client, "exists_backup", exists_backup)
+    create_backup = MagicMock(return_value="backup-3")
+    monkeypatch.setattr(backup, "create_backup", create_backup)
+
+    harness.update_config({"backup_passphrase": token_hex(16)})
+    harness.add_relation("backup", "s3-integrator", app_data=s3_relation_data_backup)
+    harness.begin_with_initial_hooks()
+
+    output = harness.run_action("create-backup", {"incremental": True})
+
+    exists_backup.assert_called_once_with(f"backup-2{backup.MANIFEST_SUFFIX}")
+    assert create_backup.call_args.args[3].parent_backup_id == "backup-2"
+    assert output.results["parent-backup-id"] == "backup-2"
+
+
+@pytest.mark.parametrize(
+    "compression_config, expected_message",
+    [
+        pytest.param({"backup_compression": "xz"}, "Invalid backup_compression", id="algorithm"),
+        pytest.param(
+            {"backup_compression_level": 20}, "Invalid backup_compression_level", id="level"
+        ),
+    ],
+)
+def test_create_backup_invalid_compression(
+    s3_relation_data_backup,
+    harness: Harness,
+    monkeypatch: pytest.MonkeyPatch,
+    compression_config: dict,
+    expected_message: str,
+):
+    """
+    arrange: start the Synapse charm. Integrate with s3-integrator.
+        Mock can_use_bucket and create_backup. Set an invalid compression.
+    act: Run the backup action.
+    assert: Backup should fail without calling create_backup.
+    """
+    monkeypatch.setattr(backup.S3Client, "can_use_bucket", MagicMock(return_value=True))
+    create_backup = MagicMock()
+    monkeypatch.setattr(backup, "create_backup", create_backup)
+
+    harness.update_config({"backup_passphrase": token_hex(16), **compression_config})
+    harness.add_relation("backup", "s3-integrator", app_data=s3_relation_data_backup)
+    harness.begin_with_initial_hooks()
+
+    with pytest.raises(ActionFailed) as err:
+        harness.run_action("create-backup")
+    assert expected_message in str(err.value.message)
+    create_backup.assert_not_called()
+
+
 def test_create_backup_wrong_backup_failure(
     s3_relation_data_backup, harness: Harness, monkeypatch: pytest.MonkeyPatch
 ):
@@ -262,7 +329,13 @@ def test_restore_backup_correct(
 
     assert output.results["result"] == "correct"
     container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
-    restore_backup.assert_called_once_with(container, ANY, backup_passphrase, "backup-2024")
+    restore_backup.assert_called_once_with(
+        container,
+        ANY,
+        backup_passphrase,
+        "backup-2024",
+        backup.RestoreSettings(),
+    )
 
 
 def test_restore_backup_wrong_s3_parameters(harness: Harness):
@@ -355,6 +428,7 @@ def test_delete_backup_correct(
     harness.add_relation("backup", "s3-integrator", app_data=s3_relation_data_backup)
     monkeypatch.setattr(backup.S3Client, "can_use_bucket", MagicMock(return_value=True))
     monkeypatch.setattr(backup.S3Client, "exists_backup", MagicMock(return_value=True))
+    monkeypatch.setattr(backup.S3Client, "get_child_backups", MagicMock(return_value=[]))
     delete_backup_mock = MagicMock()
     monkeypatch.setattr(backup.S3Client, "delete_backup", delete_backup_mock)
 
@@ -401,6 +475,7 @@ def test_delete_backup_s3_error(
     harness.add_relation("backup", "s3-integrator", app_data=s3_relation_data_backup)
     monkeypatch.setattr(backup.S3Client, "can_use_bucket", MagicMock(return_value=True))
     monkeypatch.setattr(backup.S3Client, "exists_backup", MagicMock(return_value=True))
+    monkeypatch.setattr(backup.S3Client, "get_child_backups", MagicMock(return_value=[]))
     delete_backup_mock = MagicMock(side_effect=backup.S3Error("Error"))
     monkeypatch.setattr(backup.S3Client, "delete_backup", delete_backup_mock)
 
@@ -410,3 +485,30 @@ def test_delete_backup_s3_error(
     with pytest.raises(ActionFailed) as err:
         harness.run_action("delete-backup", params={"backup-id": "backup-2024"})
     assert "Error deleting backup" in str(err.value.message)
+
+
+def test_delete_backup_parent(
+    s3_relation_data_backup: dict, harness: Harness, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: Start the Synapse charm. Integrate with S3. Mock can_use_bucket, exists_backup
+        and get_child_backups to return an incremental backup applying on the backup.
+    act: Run action delete-backup.
+    assert: Raises ActionFailed naming the incremental backup, and s3 client
+        delete_backup is not called.
+    """
+    harness.add_relation("backup", "s3-integrator", app_data=s3_relation_data_backup)
+    monkeypatch.setattr(backup.S3Client, "can_use_bucket", MagicMock(return_value=True))
+    monkeypatch.setattr(backup.S3Client, "exists_backup", MagicMock(return_value=True))
+    monkeypatch.setattr(
+        backup.S3Client, "get_child_backups", MagicMock(return_value=["backup-2025"])
+    )
+    delete_backup_mock = MagicMock()
+    monkeypatch.setattr(backup.S3Client, "delete_backup", delete_backup_mock)
+
+    harness.begin_with_initial_hooks()
+
+    with pytest.raises(ActionFailed) as err:
+        harness.run_action("delete-backup", params={"backup-id": "backup-2024"})
+    assert "parent of backup-2025" in str(err.value.message)
+    delete_backup_mock.assert_not_called()
@@ -0,0 +1,426 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Synapse backup S3 client unit tests."""
+
+# pylint: disable=protected-access
+
+import datetime
+from unittest.mock import MagicMock, call
+
+import pytest
+from botocore.exceptions import ClientError
+from dateutil.tz import tzutc  # type: ignore
+
+import backup
+
+
+def test_s3_client_create_correct(s3_parameters_backup):
+    """
+    arrange: Create S3Parameters for the new client.
+    act: Create the new client.
+    assert: The client gets created correctly.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+
+    assert s3_client._client
+
+
+def test_s3_client_create_error(s3_parameters_backup):
+    """
+    arrange: Create S3Parameters for the new client.
+        Put access_key for the boto3 client to fail.
+    act: Create the new client.
+    assert: Raises S3Error.
+    """
+    s3_parameters_backup.access_key = None
+
+    with pytest.raises(backup.S3Error) as err:
+        backup.S3Client(s3_parameters_backup)
+    assert "Error creating S3 client" in str(err.value)
+
+
+def test_can_use_bucket_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create S3Parameters and mock boto3 client so it does not raise on head_bucket.
+    act: Run S3Client.can_use_bucket.
+    assert: Check that the function returns True.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+    monkeypatch.setattr(s3_client._client, "head_bucket", MagicMock())
+
+    assert s3_client.can_use_bucket()
+
+
+def test_can_use_bucket_bucket_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create S3Parameters and mock boto3 library so it fails when checking the bucket.
+    act: Run can_use_bucket.
+    assert: Check that the function returns False.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+    monkeypatch.setattr(
+        s3_client._client, "head_bucket", MagicMock(side_effect=ClientError({}, "HeadBucket"))
+    )
+
+    assert not s3_client.can_use_bucket()
+
+
+def test_delete_backup_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. Mock delete_object to return a realistic correct response.
+    act: Run delete_backup.
+    assert: The function delete_object called with the right arguments.
+    """
+    backup_id = "backup-20240101"
+    s3_client = backup.S3Client(s3_parameters_backup)
+    s3_example_response = {
+        "ResponseMetadata": {
+            "RequestId": "17B23CD508D801F2",
+            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
+            "HTTPStatusCode": 204,
+            "HTTPHeaders": {
+                "server": "nginx/1.24.0 (Ubuntu)",
+                "date": "Fri, 09 Feb 2024 15:54:54 GMT",
+            },
+            "RetryAttempts": 0,
+        }
+    }
+    delete_object_mock = MagicMock(return_value=s3_example_response)
+    monkeypatch.setattr(s3_client._client, "delete_object", delete_object_mock)
+    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
+    list_s3_objects_mock = MagicMock(return_value=[{"Key": f"{key}{backup.SHARD_SUFFIX}0"}])
+    monkeypatch.setattr(s3_client, "_list_s3_objects", list_s3_objects_mock)
+
+    s3_client.delete_backup(backup_id)
+
+    list_s3_objects_mock.assert_called_once_with(f"{key}{backup.SHARD_SUFFIX}")
+    assert delete_object_mock.call_args_list == [
+        call(Bucket=s3_parameters_backup.bucket, Key=key),
+        call(Bucket=s3_parameters_backup.bucket, Key=f"{key}{backup.MANIFEST_SUFFIX}"),
+        call(Bucket=s3_parameters_backup.bucket, Key=f"{key}{backup.SHARD_SUFFIX}0"),
+    ]
+
+
+def test_delete_backup_boto_client_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. On delete_object return a boto exception.
+    act: Run delete_backup.
+    assert: The function delete_object throws an exception.
+    """
+    backup_id = "backup-20240101"
+    backups = [backup.S3Backup(backup_id=backup_id, last_modified=datetime.datetime.now(), size=1)]
+    s3_client = backup.S3Client(s3_parameters_backup)
+    monkeypatch.setattr(s3_client, "list_backups", MagicMock(return_value=backups))
+    monkeypatch.setattr(s3_client, "_list_s3_objects", MagicMock(return_value=[]))
+    monkeypatch.setattr(
+        s3_client._client, "delete_object", MagicMock(side_effect=ClientError({}, "Generic Error"))
+    )
+
+    with pytest.raises(backup.S3Error) as err:
+        s3_client.delete_backup(backup_id)
+    assert "Cannot delete backup_id" in str(err.value)
+
+
+def test_get_child_backups(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. Mock list_backups and head_object to return a full
+        backup, an incremental backup applying on it and another one applying on the
+        incremental backup.
+    act: Run get_child_backups for the full backup.
+    assert: Only the incremental backup applying on the full backup is returned.
+    """
+    parents = {"backup-1": None, "backup-2": "backup-1", "backup-3": "backup-2"}
+    s3_client = backup.S3Client(s3_parameters_backup)
+    monkeypatch.setattr(
+        s3_client,
+        "list_backups",
+        MagicMock(
+            return_value=[
+                backup.S3Backup(backup_id, datetime.datetime.now(), 1) for backup_id in parents
+            ]
+        ),
+    )
+
+    def head_object(Bucket: str, Key: str) -> dict:  # pylint: disable=invalid-name
+        """Get the metadata of a backup object.
+
+        Args:
+            Bucket: bucket of the object.
+            Key: key of the object.
+
+        Returns:
+            The metadata of the object, with the parent backup if it has one.
+        """
+        assert Bucket == s3_parameters_backup.bucket
+        parent = parents[Key.rpartition("/")[2]]
+        return {"Metadata": {backup.PARENT_BACKUP_METADATA_KEY: parent} if parent else {}}
+
+    monkeypatch.setattr(s3_client._client, "head_object", head_object)
+
+    assert s3_client.get_child_backups("backup-1") == ["backup-2"]
+
+
+def test_get_download_url(s3_parameters_backup):
+    """
+    arrange: Create a S3Client.
+    act: Run get_download_url.
+    assert: The URL is presigned for the backup object.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+
+    url = s3_client.get_download_url("backup-20240101")
+
+    assert "/synapse-backup-bucket/synapse-backups/backup-20240101?" in url
+    assert "Signature=" in url
+
+
+def test_exists_backup_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. mock head_object to return a correct response.
+    act: Run exists_backup.
+    assert: Check exists backup returns true and the head_object was called.
+    """
+    backup_id = "backup-20240101"
+    head_object_mock = MagicMock()
+    s3_client = backup.S3Client(s3_parameters_backup)
+    monkeypatch.setattr(s3_client._client, "head_object", head_object_mock)
+
+    assert s3_client.exists_backup(backup_id)
+
+    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
+    head_object_mock.assert_called_once_with(
+        Bucket=s3_parameters_backup.bucket,
+        Key=key,
+    )
+
+
+def test_exists_backup_does_not_exist(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. mock head_object to raise a ClientError similar to what a real
+        S3 storage would return when the object does not exist.
+    act: Run exists_backup.
+    assert: It should return False and head_object should be called.
+    """
+    error_response = {
+        "Error": {"Code": "404", "Message": "Not Found"},
+        "ResponseMetadata": {
+            "HTTPStatusCode": 404,
+            "HTTPHeaders": {
+                "server": "nginx/1.24.0 (Ubuntu)",
+            },
+            "RetryAttempts": 0,
+        },
+    }
+    backup_id = "backup-20240101"
+    head_object_mock = MagicMock(side_effect=ClientError(error_response, ""))
+    s3_client = backup.S3Client(s3_parameters_backup)
+    monkeypatch.setattr(s3_client._client, "head_object", head_object_mock)
+
+    assert not s3_client.exists_backup(backup_id)
+
+    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
+    head_object_mock.assert_called_once_with(
+        Bucket=s3_parameters_backup.bucket,
+        Key=key,
+    )
+
+
+def test_exists_backup_boto_client_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. mock head_object to raise a ClientError.
+    act: Run exists_backup.
+    assert: It should raise and head_bucket should be called.
+    """
+    backup_id = "backup-20240101"
+    head_object_mock = MagicMock(side_effect=ClientError({}, "No Such Bucket"))
+    s3_client = backup.S3Client(s3_parameters_backup)
+    monkeypatch.setattr(s3_client._client, "head_object", head_object_mock)
+
+    with pytest.raises(backup.S3Error):
+        s3_client.exists_backup(backup_id)
+
+    key = f"{s3_parameters_backup.path.strip('/')}/{backup_id}"
+    head_object_mock.assert_called_once_with(
+        Bucket=s3_parameters_backup.bucket,
+        Key=key,
+    )
+
+
+def test_list_backups_correct(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. Mock response to return a real response in list_objects_v2.
+    act: Run list_backups.
+    assert: The expected list of backups is correctly parsed, without the manifests.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+    s3_example_response = {
+        "ResponseMetadata": {
+            "RequestId": "17AFBDF4A3306A4F",
+            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
+            "HTTPStatusCode": 200,
+        },
+        "IsTruncated": False,
+        "Contents": [
+            {
+                "Key": "synapse-backups/20240201122721",
+                "LastModified": datetime.datetime(2024, 2, 1, 12, 27, 23, 749000, tzinfo=tzutc()),
+                "ETag": '"ed4a010045db523f7adc1ddc19e26971"',
+                "Size": 38296,
+            },
+            {
+                "Key": "synapse-backups/20240201122942",
+                "LastModified": datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
+                "ETag": '"200e44b3b6e4c1e98b1a902e5260b9be"',
+                "Size": 50000,
+            },
+            {
+                "Key": "synapse-backups/20240201122942.manifest",
+                "LastModified": datetime.datetime(2024, 2, 1, 12, 29, 44, 102000, tzinfo=tzutc()),
+                "ETag": '"4d6c1f3b7e0f5a8b9c2d1e0f3a4b5c6d"',
+                "Size": 512,
+            },
+        ],
+        "Name": "backups-bucket",
+        "Prefix": "synapse-backups",
+        "MaxKeys": 1000,
+        "EncodingType": "url",
+        "KeyCount": 3,
+    }
+    list_objects_v2_mock = MagicMock(return_value=s3_example_response)
+    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
+
+    backups = s3_client.list_backups()
+
+    assert backups == [
+        backup.S3Backup(
+            backup_id="20240201122721",
+            last_modified=datetime.datetime(2024, 2, 1, 12, 27, 23, 749000, tzinfo=tzutc()),
+            size=38296,
+        ),
+        backup.S3Backup(
+            backup_id="20240201122942",
+            last_modified=datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
+            size=50000,
+        ),
+    ]
+
+
+def test_list_backups_sharded(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. Mock the objects of a sharded backup: index, shards
+        and manifest.
+    act: Run list_backups.
+    assert: The backup is listed once, with the size of its shards.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+    last_modified = datetime.datetime(2024, 2, 1, 12, 27, 23, 749000, tzinfo=tzutc())
+    keys_and_sizes = (
+        ("synapse-backups/backup-1.shard-0", 1000),
+        ("synapse-backups/backup-1.shard-1", 2000),
+        ("synapse-backups/backup-1", 100),
+        ("synapse-backups/backup-1.manifest", 300),
+    )
+    monkeypatch.setattr(
+        s3_client,
+        "_list_s3_objects",
+        MagicMock(
+            return_value=[
+                {"Key": key, "LastModified": last_modified, "Size": size}
+                for key, size in keys_and_sizes
+            ]
+        ),
+    )
+
+    backups = s3_client.list_backups()
+
+    assert backups == [
+        backup.S3Backup(backup_id="backup-1", last_modified=last_modified, size=3000)
+    ]
+
+
+def test_list_backups_correct_no_root_slash(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. Mock response to return a real response in list_objects_v2 with
+        Keys without root slash as returned by MinIO even when created with root slash.
+    act: Run list_backups.
+    assert: The expected list of backups is correctly parsed.
+    """
+    s3_parameters_backup.path = s3_parameters_backup.path.strip("/")
+    s3_client = backup.S3Client(s3_parameters_backup)
+    s3_example_response = {
+        "ResponseMetadata": {
+            "RequestId": "17AFBDF4A3306A4F",
+            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
+            "HTTPStatusCode": 200,
+        },
+        "IsTruncated": False,
+        "Contents": [
+            {
+                "Key": "synapse-backups/20240201122942",
+                "LastModified": datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
+                "ETag": '"200e44b3b6e4c1e98b1a902e5260b9be"',
+                "Size": 50000,
+            },
+        ],
+        "Name": "backups-bucket",
+        "Prefix": "synapse-backups/",
+        "MaxKeys": 1000,
+        "EncodingType": "url",
+        "KeyCount": 2,
+    }
+    list_objects_v2_mock = MagicMock(return_value=s3_example_response)
+    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
+
+    backups = s3_client.list_backups()
+
+    assert backups == [
+        backup.S3Backup(
+            backup_id="20240201122942",
+            last_modified=datetime.datetime(2024, 2, 1, 12, 29, 43, 804000, tzinfo=tzutc()),
+            size=50000,
+        ),
+    ]
+
+
+def test_list_backups_empty(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. Mock response to return a real empty response in list_objects_v2.
+    act: Run list_backups.
+    assert: The expected list of backups is correctly parsed.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+    s3_example_response = {
+        "ResponseMetadata": {
+            "RequestId": "17AFBDF4A3306A4F",
+            "HostId": "dd9025bab4ad464b049177c95eb6ebf374d3b3fd1af9251148b658df7ac2e3e8",
+            "HTTPStatusCode": 200,
+        },
+        "IsTruncated": False,
+        "Name": "backups-bucket",
+        "Prefix": "synapse",
+        "MaxKeys": 1000,
+        "EncodingType": "url",
+        "KeyCount": 0,
+    }
+    list_objects_v2_mock = MagicMock(return_value=s3_example_response)
+    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
+
+    backups = s3_client.list_backups()
+
+    assert not backups
+
+
+def test_list_backups_error(s3_parameters_backup, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: Create a S3Client. Mock response to raise a ClientError Exception.
+    act: Run list_backups.
+    assert: A S3Error should be raised.
+    """
+    s3_client = backup.S3Client(s3_parameters_backup)
+    list_objects_v2_mock = MagicMock(side_effect=ClientError({}, "No Such Bucket"))
+    monkeypatch.setattr(s3_client._client, "list_objects_v2", list_objects_v2_mock)
+
+    with pytest.raises(backup.S3Error) as err:
+        s3_client.list_backups()
+    assert "Error iterating" in str(err.value)
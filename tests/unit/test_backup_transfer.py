@@ -0,0 +1,107 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Synapse backup transfer settings unit tests."""
+
+from typing import Optional
+
+import pytest
+from ops.testing import Harness
+
+import backup_transfer
+import synapse
+
+
+@pytest.mark.parametrize(
+    "transfer_settings, memory_limit, expected_size, expected_settings",
+    [
+        pytest.param(
+            backup_transfer.TransferSettings(),
+            None,
+            0,
+            backup_transfer.TransferSettings(
+                10, 8 * backup_transfer.MIB, "", 512 * backup_transfer.MIB
+            ),
+            id="auto without memory limit",
+        ),
+        pytest.param(
+            backup_transfer.TransferSettings(),
+            "268435456",
+            200 * 1024 * backup_transfer.MIB,
+            backup_transfer.TransferSettings(
+                1, 21 * backup_transfer.MIB, "", 64 * backup_transfer.MIB
+            ),
+            id="auto with memory limit and large backup",
+        ),
+        pytest.param(
+            backup_transfer.TransferSettings(),
+            "max",
+            20 * backup_transfer.MIB,
+            backup_transfer.TransferSettings(
+                3, 8 * backup_transfer.MIB, "", 512 * backup_transfer.MIB
+            ),
+            id="auto capped by the number of parts",
+        ),
+        pytest.param(
+            backup_transfer.TransferSettings(
+                memory_budget=64 * backup_transfer.MIB, max_bandwidth="1MB/s"
+            ),
+            None,
+            0,
+            backup_transfer.TransferSettings(
+                4, 8 * backup_transfer.MIB, "1MB/s", 64 * backup_transfer.MIB
+            ),
+            id="memory budget",
+        ),
+        pytest.param(
+            backup_transfer.TransferSettings(2, 32 * backup_transfer.MIB),
+            None,
+            backup_transfer.MIB,
+            backup_transfer.TransferSettings(
+                2, 32 * backup_transfer.MIB, "", 512 * backup_transfer.MIB
+            ),
+            id="explicit",
+        ),
+    ],
+)
+def test_resolve_transfer_settings(
+    harness: Harness,
+    transfer_settings: backup_transfer.TransferSettings,
+    memory_limit: Optional[str],
+    expected_size: int,
+    expected_settings: backup_transfer.TransferSettings,
+):
+    """
+    arrange: Given the Synapse container with or without a memory limit.
+    act: Call resolve_transfer_settings with the expected size of the backup.
+    assert: The settings set to 0 are picked from the memory and the size.
+    """
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    if memory_limit is not None:
+        container.push(backup_transfer.MEMORY_LIMIT_PATH, memory_limit, make_dirs=True)
+
+    resolved_settings = backup_transfer.resolve_transfer_settings(
+        container, transfer_settings, expected_size
+    )
+
+    assert resolved_settings == expected_settings
+
+
+@pytest.mark.parametrize(
+    "parallel_transfers", [pytest.param(1, id="single"), pytest.param(4, id="four")]
+)
+def test_resolve_transfer_settings_parallel(harness: Harness, parallel_transfers: int):
+    """
+    arrange: Given the Synapse container and a memory budget of 64 MiB.
+    act: Call resolve_transfer_settings for transfers running in parallel.
+    assert: Each transfer gets its share of the memory budget.
+    """
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    transfer_settings = backup_transfer.TransferSettings(memory_budget=64 * backup_transfer.MIB)
+
+    resolved_settings = backup_transfer.resolve_transfer_settings(
+        container, transfer_settings, 0, parallel_transfers
+    )
+
+    assert resolved_settings.memory_budget == 64 * backup_transfer.MIB // parallel_transfers
+    assert resolved_settings.max_concurrent_requests == 4 // parallel_transfers
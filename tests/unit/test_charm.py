@@ -237,6 +237,8 @@ def test_server_name_change(harness: Harness, monkeypatch: pytest.MonkeyPatch) -
     monkeypatch.setattr(
         harness.charm, "build_charm_state", MagicMock(return_value=charm_state_mock)
     )
+    # The mocked charm state cannot be fingerprinted.
+    monkeypatch.setattr(harness.charm, "_reconcile_fingerprint", MagicMock(return_value=""))
 
     harness.update_config({"server_name": TEST_SERVER_NAME_CHANGED})
 
@@ -337,6 +339,65 @@ def test_nginx_replan(harness: Harness, monkeypatch: pytest.MonkeyPatch) -> None
     restart_nginx_mock.assert_called_once()
 
 
+@pytest.mark.parametrize(
+    "exit_codes,commands,restarted",
+    [
+        pytest.param((0, 0), [["-t"], ["-s", "reload"]], False, id="reloaded"),
+        pytest.param((0, 1), [["-t"], ["-s", "reload"]], True, id="reload failure"),
+        pytest.param((1, 0), [["-t"]], False, id="invalid configuration"),
+    ],
+)
+def test_nginx_reload(
+    harness: Harness,
+    monkeypatch: pytest.MonkeyPatch,
+    exit_codes: tuple[int, int],
+    commands: list[list[str]],
+    restarted: bool,
+) -> None:
+    """
+    arrange: start the Synapse charm and NGINX.
+    act: apply the same NGINX configuration, then a new one.
+    assert: NGINX is untouched for the same configuration, the new one is tested and
+        reloaded, NGINX is only restarted if the reload fails.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+    pebble.restart_nginx(container, synapse.NginxSettings("synapse-0.synapse-endpoints"))
+    executed = []
+
+    def nginx_handler(argv: list[str]) -> synapse.ExecResult:
+        """Handle the NGINX command execution inside the Synapse container.
+
+        Args:
+            argv: arguments list.
+
+        Returns:
+            ExecResult instance.
+        """
+        executed.append(argv[1:])
+        test_exit_code, reload_exit_code = exit_codes
+        exit_code = test_exit_code if argv[1:] == ["-t"] else reload_exit_code
+        return synapse.ExecResult(exit_code, "", "")
+
+    harness.register_command_handler(  # type: ignore # pylint: disable=no-member
+        container=container, executable=synapse.NGINX_COMMAND_PATH, handler=nginx_handler
+    )
+    restart_mock = MagicMock()
+    monkeypatch.setattr(container, "restart", restart_mock)
+
+    pebble.restart_nginx(container, synapse.NginxSettings("synapse-0.synapse-endpoints"))
+
+    assert not executed
+    restart_mock.assert_not_called()
+
+    pebble.restart_nginx(
+        container, synapse.NginxSettings("synapse-0.synapse-endpoints", worker_role="media")
+    )
+
+    assert executed == commands
+    assert restart_mock.called == restarted
+
+
 def test_nginx_replan_failure(harness: Harness, monkeypatch: pytest.MonkeyPatch) -> None:
     """
     arrange: start the Synapse charm, mock restart_nginx call and set the NGINX container as down.
@@ -444,3 +505,74 @@ def test_redis_enabled_reconcile_pebble_error(
 
     assert isinstance(harness.model.unit.status, ops.BlockedStatus)
     assert error_message in str(harness.model.unit.status)
+
+
+def test_reconcile_pulls_configuration_once(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: start the Synapse charm, keep the environment unchanged and spy on the
+        container pull calls.
+    act: emit config changed.
+    assert: the configuration file is pulled only once.
+    """
+    harness.set_leader(True)
+    harness.begin_with_initial_hooks()
+    monkeypatch.setattr(pebble, "_environment_has_changed", MagicMock(return_value=False))
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+    pull_mock = MagicMock(wraps=container.pull)
+    monkeypatch.setattr(container, "pull", pull_mock)
+
+    harness.update_config({"enable_room_list_search": False})
+
+    pulled_paths = [pull_call.args[0] for pull_call in pull_mock.call_args_list]
+    assert pulled_paths.count(synapse.SYNAPSE_CONFIG_PATH) == 1
+
+
+def test_reconcile_skipped_when_unchanged(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: start the Synapse charm and spy on pebble reconcile.
+    act: emit config changed without changing the configuration.
+    assert: pebble reconcile is not called and the unit stays active.
+    """
+    harness.set_leader(True)
+    harness.begin_with_initial_hooks()
+    reconcile_mock = MagicMock(wraps=pebble.reconcile)
+    monkeypatch.setattr(pebble, "reconcile", reconcile_mock)
+
+    harness.charm.on.config_changed.emit()
+
+    reconcile_mock.assert_not_called()
+    assert isinstance(harness.model.unit.status, ops.ActiveStatus)
+
+
+def test_reconcile_runs_when_config_changed(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: start the Synapse charm and spy on pebble reconcile.
+    act: change the charm configuration.
+    assert: pebble reconcile is called.
+    """
+    harness.set_leader(True)
+    harness.begin_with_initial_hooks()
+    reconcile_mock = MagicMock(wraps=pebble.reconcile)
+    monkeypatch.setattr(pebble, "reconcile", reconcile_mock)
+
+    harness.update_config({"enable_room_list_search": False})
+
+    reconcile_mock.assert_called_once()
+
+
+def test_reconcile_runs_when_service_stopped(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: start the Synapse charm, stop the Synapse service and spy on pebble reconcile.
+    act: emit config changed without changing the configuration.
+    assert: pebble reconcile is called.
+    """
+    harness.set_leader(True)
+    harness.begin_with_initial_hooks()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+    container.stop(synapse.SYNAPSE_SERVICE_NAME)
+    reconcile_mock = MagicMock(wraps=pebble.reconcile)
+    monkeypatch.setattr(pebble, "reconcile", reconcile_mock)
+
+    harness.charm.on.config_changed.emit()
+
+    reconcile_mock.assert_called_once()
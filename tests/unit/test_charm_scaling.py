@@ -3,6 +3,9 @@
 
 """Synapse charm scaling unit tests."""
 
+# pylint: disable=protected-access
+
+import dataclasses
 import unittest
 from unittest.mock import ANY, MagicMock, call
 
@@ -257,13 +260,33 @@ def test_scaling_main_unit_changed_nginx_reconfigured(
     harness.begin_with_initial_hooks()
     harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
     harness.set_leader(False)
-    restart_nginx_mock.assert_called_with(nginx_container, "synapse-0.synapse-endpoints")
+    restart_nginx_mock.assert_called_with(
+        nginx_container,
+        synapse.NginxSettings(
+            main_unit_address="synapse-0.synapse-endpoints",
+            worker_role="generic",
+            worker_processes=1,
+            is_main=True,
+            sync_servers=[],
+        ),
+    )
+    # Restart coordination is covered by test_restart_coordinator.
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
 
     harness.update_relation_data(
         peer_relation_id, harness.charm.app.name, {"main_unit_id": "synapse/1"}
     )
 
-    restart_nginx_mock.assert_called_with(nginx_container, "synapse-1.synapse-endpoints")
+    restart_nginx_mock.assert_called_with(
+        nginx_container,
+        synapse.NginxSettings(
+            main_unit_address="synapse-1.synapse-endpoints",
+            worker_role="generic",
+            worker_processes=1,
+            is_main=False,
+            sync_servers=[],
+        ),
+    )
 
 
 def test_scaling_stream_writers_not_configured(harness: Harness) -> None:
@@ -285,7 +308,7 @@ def test_scaling_stream_writers_not_configured(harness: Harness) -> None:
         assert "stream_writers" not in content
 
 
-def test_scaling_worker_name_configured(harness: Harness) -> None:
+def test_scaling_worker_name_configured(harness: Harness, monkeypatch: pytest.MonkeyPatch) -> None:
     """
     arrange: charm deployed, integrated with Redis, not set as leader and unit
         name is worker1.
@@ -298,6 +321,7 @@ def test_scaling_worker_name_configured(harness: Harness) -> None:
     harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
     harness.set_leader(False)
     harness.charm.unit.name = "synapse/1"
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
 
     harness.charm.on.config_changed.emit()
 
@@ -351,6 +375,7 @@ def test_scaling_signing_key_pushed_worker(
     container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
     push_mock = MagicMock()
     monkeypatch.setattr(container, "push", push_mock)
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
 
     harness.charm.on.config_changed.emit()
 
@@ -360,7 +385,6 @@ def test_scaling_signing_key_pushed_worker(
                 f"/data/{TEST_SERVER_NAME}.signing.key",
                 signing_key,
                 make_dirs=True,
-                encoding="utf-8",
             ),
             call(ANY, ANY),
         ],
@@ -391,7 +415,6 @@ def test_scaling_signing_key_found(harness: Harness, monkeypatch: pytest.MonkeyP
                 f"/data/{TEST_SERVER_NAME}.signing.key",
                 signing_key,
                 make_dirs=True,
-                encoding="utf-8",
             )
         ]
     )
@@ -420,7 +443,6 @@ def test_scaling_signing_not_found(harness: Harness, monkeypatch: pytest.MonkeyP
                 f"/data/{TEST_SERVER_NAME}.signing.key",
                 signing_key,
                 make_dirs=True,
-                encoding="utf-8",
             )
         ]
     )
@@ -606,3 +628,308 @@ def test_scaling_instance_map_configured_ignoring_workers(
         content = yaml.safe_load(config_file)
         assert "instance_map" in content
         assert content["instance_map"] == instance_map_content
+
+
+@pytest.mark.parametrize(
+    "event_persisters,persisters",
+    [
+        pytest.param("2", ["worker1", "worker2"], id="count"),
+        pytest.param("10", ["worker1", "worker2", "worker3", "worker4"], id="count above workers"),
+        pytest.param("worker2, worker4", ["worker2", "worker4"], id="workers"),
+    ],
+)
+def test_scaling_event_persisters(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch, event_persisters, persisters
+) -> None:
+    """
+    arrange: charm deployed with event_persisters set and 4 workers in peer relation.
+    act: emit config-changed event, then add another worker.
+    assert: only the persisters are in instance_map and stream_writers, and the new
+        worker does not change the configuration.
+    """
+    rel_id = harness.add_relation(synapse.SYNAPSE_PEER_RELATION_NAME, "synapse")
+    for unit_number in range(1, 5):
+        harness.add_relation_unit(rel_id, f"synapse/{unit_number}")
+    harness.update_config({"event_persisters": event_persisters})
+    harness.begin_with_initial_hooks()
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
+    harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
+    harness.set_leader(True)
+    harness.charm.on.config_changed.emit()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    config = container.pull(synapse.SYNAPSE_CONFIG_PATH).read()
+
+    harness.add_relation_unit(rel_id, "synapse/5")
+
+    content = yaml.safe_load(config)
+    assert sorted(content["instance_map"]) == sorted(["main", "federationsender1", *persisters])
+    assert content["stream_writers"] == {"events": persisters}
+    assert container.pull(synapse.SYNAPSE_CONFIG_PATH).read() == config
+
+
+def test_scaling_worker_roles_configured(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    arrange: charm deployed with worker_roles set and 4 workers in peer relation.
+    act: emit config-changed event, then unset worker_roles.
+    assert: the tasks of the roles run on their workers, then on the main process
+        again.
+    """
+    rel_id = harness.add_relation(synapse.SYNAPSE_PEER_RELATION_NAME, "synapse")
+    for unit_number in range(1, 5):
+        harness.add_relation_unit(rel_id, f"synapse/{unit_number}")
+    harness.update_config({"worker_roles": "1:pusher,2:pusher,3:media,4:background,5:sync"})
+    harness.begin_with_initial_hooks()
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
+    harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
+    harness.set_leader(True)
+    harness.charm.on.config_changed.emit()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+
+    content = yaml.safe_load(container.pull(synapse.SYNAPSE_CONFIG_PATH).read())
+
+    assert content["pusher_instances"] == ["worker1", "worker2"]
+    assert content["media_instance_running_background_jobs"] == "worker3"
+    assert content["run_background_tasks_on"] == "worker4"
+    assert "notify_appservices_from_worker" not in content
+
+    harness.update_config(unset=["worker_roles"])
+
+    content = yaml.safe_load(container.pull(synapse.SYNAPSE_CONFIG_PATH).read())
+    assert "pusher_instances" not in content
+    assert "run_background_tasks_on" not in content
+
+
+def test_scaling_worker_role_invalid(harness: Harness) -> None:
+    """
+    arrange: charm deployed.
+    act: set worker_roles with an unknown role.
+    assert: Synapse charm is blocked.
+    """
+    harness.begin_with_initial_hooks()
+
+    harness.update_config({"worker_roles": "1:unknown"})
+
+    assert isinstance(harness.model.unit.status, ops.BlockedStatus)
+    assert "worker_roles" in str(harness.model.unit.status)
+
+
+def test_scaling_sync_affinity(harness: Harness, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    arrange: charm deployed with sync_affinity, an event persister, a media worker and
+        3 workers in peer relation, one of them running 2 processes.
+    act: emit config-changed event, then unset sync_affinity.
+    assert: the sync requests are balanced by access token between the processes of
+        the sync-capable workers, then proxied like the other client requests.
+    """
+    rel_id = harness.add_relation(synapse.SYNAPSE_PEER_RELATION_NAME, "synapse")
+    for unit_number in range(1, 4):
+        harness.add_relation_unit(rel_id, f"synapse/{unit_number}")
+    harness.update_relation_data(rel_id, "synapse/3", {"worker_processes": "2"})
+    harness.update_config(
+        {
+            "sync_affinity": True,
+            "event_persisters": "1",
+            "worker_processes": 0,
+            "worker_roles": "2:media",
+        }
+    )
+    harness.begin_with_initial_hooks()
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
+    harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
+    harness.set_leader(True)
+    harness.charm.on.config_changed.emit()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+
+    upstreams = container.pull("/etc/nginx/upstreams.conf").read()
+    sync_location = container.pull("/etc/nginx/sync_location.conf").read()
+
+    assert "hash $http_authorization$arg_access_token consistent;" in upstreams
+    sync_upstream = upstreams.split("upstream synapse_sync")[1]
+    assert [line.split()[1] for line in sync_upstream.splitlines() if "server" in line] == [
+        "synapse-1.synapse-endpoints:8008",
+        "synapse-3.synapse-endpoints:8008",
+        "synapse-3.synapse-endpoints:8102",
+    ]
+    assert "proxy_pass http://synapse_sync;" in sync_location
+
+    harness.update_config(unset=["sync_affinity"])
+
+    upstreams = container.pull("/etc/nginx/upstreams.conf").read()
+    sync_location = container.pull("/etc/nginx/sync_location.conf").read()
+    assert "synapse_sync" not in upstreams
+    assert "proxy_pass http://synapse_local;" in sync_location
+
+
+def test_scaling_federation_senders_placed_on_workers(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    arrange: charm deployed with 3 federation senders and 2 workers in peer relation.
+    act: emit config-changed event, then add another worker.
+    assert: the extra federation senders are in instance_map on the workers and the
+        list of federation senders does not change when scaling.
+    """
+    rel_id = harness.add_relation(synapse.SYNAPSE_PEER_RELATION_NAME, "synapse")
+    harness.add_relation_unit(rel_id, "synapse/1")
+    harness.add_relation_unit(rel_id, "synapse/2")
+    harness.update_config({"federation_senders": 3})
+    harness.begin_with_initial_hooks()
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
+    harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
+    harness.set_leader(True)
+    harness.charm.on.config_changed.emit()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+
+    content = yaml.safe_load(container.pull(synapse.SYNAPSE_CONFIG_PATH).read())
+
+    assert content["instance_map"]["federationsender2"] == {
+        "host": "synapse-1.synapse-endpoints",
+        "port": 8042,
+    }
+    assert content["instance_map"]["federationsender3"] == {
+        "host": "synapse-2.synapse-endpoints",
+        "port": 8043,
+    }
+    federation_sender_instances = ["federationsender1", "federationsender2", "federationsender3"]
+    assert content["federation_sender_instances"] == federation_sender_instances
+    assert content["stream_writers"] == {"events": ["worker1", "worker2"]}
+
+    harness.add_relation_unit(rel_id, "synapse/3")
+
+    content = yaml.safe_load(container.pull(synapse.SYNAPSE_CONFIG_PATH).read())
+    assert content["federation_sender_instances"] == federation_sender_instances
+
+
+def test_scaling_federation_senders_replanned_on_worker(harness: Harness) -> None:
+    """
+    arrange: charm deployed and a charm state with a federation sender on worker1.
+    act: replan the federation senders of worker1, then without federation sender.
+    assert: the federation sender service is added with its configuration, then
+        disabled.
+    """
+    harness.begin()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    charm_state = harness.charm.build_charm_state()
+    charm_state = dataclasses.replace(
+        charm_state,
+        instance_map_config={
+            "federationsender2": {"host": "synapse-1.synapse-endpoints", "port": 8042}
+        },
+        federation_sender_workers={"federationsender2": "worker1"},
+    )
+    unit_settings = pebble.UnitSettings(is_main=False, unit_number="1")
+
+    service_names = pebble.replan_federation_senders(container, charm_state, unit_settings)
+
+    assert service_names == ["synapse-federationsender2"]
+    service = container.get_plan().services["synapse-federationsender2"]
+    assert service.startup == "enabled"
+    assert "/data/federationsender2.yaml" in service.command
+    sender_config = yaml.safe_load(container.pull("/data/federationsender2.yaml").read())
+    assert sender_config["worker_listeners"][0]["port"] == 8042
+
+    charm_state = dataclasses.replace(charm_state, federation_sender_workers={})
+    assert not pebble.replan_federation_senders(container, charm_state, unit_settings)
+    service = container.get_plan().services["synapse-federationsender2"]
+    assert service.startup == "disabled"
+
+
+def test_scaling_worker_processes(harness: Harness, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    arrange: charm deployed with worker_processes set to 0, a worker in peer
+        relation running 3 processes and one that did not publish it.
+    act: emit config-changed event.
+    assert: the extra processes of the worker are in instance_map with their
+        replication port.
+    """
+    rel_id = harness.add_relation(synapse.SYNAPSE_PEER_RELATION_NAME, "synapse")
+    harness.add_relation_unit(rel_id, "synapse/1")
+    harness.add_relation_unit(rel_id, "synapse/2")
+    harness.update_relation_data(rel_id, "synapse/1", {"worker_processes": "3"})
+    harness.update_config({"worker_processes": 0})
+    harness.begin_with_initial_hooks()
+    monkeypatch.setattr(harness.charm._restart_coordinator, "_get_relation", lambda: None)
+    harness.add_relation("redis", "redis", unit_data={"hostname": "redis-host", "port": "1010"})
+    harness.set_leader(True)
+    harness.charm.on.config_changed.emit()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+
+    content = yaml.safe_load(container.pull(synapse.SYNAPSE_CONFIG_PATH).read())
+
+    assert content["instance_map"]["worker1-2"] == {
+        "host": "synapse-1.synapse-endpoints",
+        "port": 8202,
+    }
+    assert content["instance_map"]["worker1-3"] == {
+        "host": "synapse-1.synapse-endpoints",
+        "port": 8203,
+    }
+    assert "worker2-2" not in content["instance_map"]
+    assert content["stream_writers"] == {
+        "events": ["worker1", "worker1-2", "worker1-3", "worker2"]
+    }
+
+
+def test_scaling_worker_processes_replanned(harness: Harness) -> None:
+    """
+    arrange: charm deployed.
+    act: replan 3 worker processes, then 2.
+    assert: a service is added for each extra process with its configuration, then
+        the third one is disabled.
+    """
+    harness.begin()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    charm_state = harness.charm.build_charm_state()
+    unit_settings = pebble.UnitSettings(is_main=False, unit_number="1", worker_processes=3)
+
+    service_names = pebble.replan_worker_processes(container, charm_state, unit_settings, "sync")
+
+    assert service_names == ["synapse-worker-process2", "synapse-worker-process3"]
+    worker_config = yaml.safe_load(container.pull("/data/worker_process3.yaml").read())
+    assert worker_config["worker_name"] == "worker1-3"
+    assert worker_config["worker_listeners"][1]["port"] == 8103
+    assert worker_config["worker_listeners"][1]["resources"] == [{"names": ["client"]}]
+
+    unit_settings = unit_settings._replace(worker_processes=2)
+    assert pebble.replan_worker_processes(container, charm_state, unit_settings, "sync") == [
+        "synapse-worker-process2"
+    ]
+    services = container.get_plan().services
+    assert services["synapse-worker-process2"].startup == "enabled"
+    assert services["synapse-worker-process3"].startup == "disabled"
+
+
+def test_scaling_worker_processes_replan_waits_for_restart(harness: Harness) -> None:
+    """
+    arrange: charm deployed with Synapse and 3 worker processes running.
+    act: replan the same 3 worker processes, then 2 while the restart is not granted.
+    assert: the unchanged processes are kept without asking for a restart, the
+        process is not stopped before the restart is granted.
+    """
+    harness.begin_with_initial_hooks()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    charm_state = harness.charm.build_charm_state()
+    acquire_restart = MagicMock(return_value=False)
+    unit_settings = pebble.UnitSettings(
+        is_main=False, unit_number="1", worker_processes=3, acquire_restart=acquire_restart
+    )
+    pebble.replan_worker_processes(
+        container, charm_state, unit_settings._replace(acquire_restart=None), "sync"
+    )
+    container.start(synapse.SYNAPSE_SERVICE_NAME)
+
+    pebble.replan_worker_processes(container, charm_state, unit_settings, "sync")
+
+    acquire_restart.assert_not_called()
+
+    with pytest.raises(pebble.RestartNotGrantedError):
+        pebble.replan_worker_processes(
+            container, charm_state, unit_settings._replace(worker_processes=2), "sync"
+        )
+
+    acquire_restart.assert_called_once()
+    assert container.get_services("synapse-worker-process3")[
+        "synapse-worker-process3"
+    ].is_running()
@@ -6,11 +6,15 @@
 # Disable attribute-defined-outside-init as this would imply many unnecessary init methods.
 # pylint: disable=attribute-defined-outside-init,duplicate-code
 
+import dataclasses
+
 import ops
 import pytest
 from ops.testing import ActionFailed, Harness
 
+from charm_types import DatasourcePostgreSQL
 from state.charm_state import CharmConfigInvalidError, CharmState, SynapseConfig
+from state.fingerprint import compute_fingerprint
 from state.validation import CharmBaseWithState, validate_charm_state
 
 
@@ -192,3 +196,35 @@ def test_validate_charm_state_action_failed() -> None:
         harness.run_action("create-backup")
     assert "Invalid configuration" in str(err.value.message)
     assert not hasattr(charm, "charm_state")
+
+
+def test_compute_fingerprint() -> None:
+    """
+    arrange: build charm states with the same and with a different datasource.
+    act: compute their fingerprints.
+    assert: fingerprints only differ when the content differs.
+    """
+    datasource = DatasourcePostgreSQL(
+        user="user", password="password", host="10.0.0.1", port="5432", db="synapse"
+    )
+    rotated_datasource = DatasourcePostgreSQL(**{**datasource, "password": "rotated"})
+    charm_states = [
+        dataclasses.replace(SimpleCharm.build_charm_state(None), datasource=value)  # type: ignore
+        for value in (datasource, dict(datasource), rotated_datasource)
+    ]
+
+    fingerprints = [compute_fingerprint(charm_state, True) for charm_state in charm_states]
+
+    assert fingerprints[0] == fingerprints[1]
+    assert fingerprints[0] != fingerprints[2]
+    assert fingerprints[0] != compute_fingerprint(charm_states[0], False)
+
+
+def test_compute_fingerprint_unsupported_type() -> None:
+    """
+    arrange: build an object without a stable representation.
+    act: compute its fingerprint.
+    assert: a TypeError is raised instead of fingerprinting its repr.
+    """
+    with pytest.raises(TypeError):
+        compute_fingerprint(object())
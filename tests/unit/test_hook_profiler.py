@@ -0,0 +1,123 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""HookProfiler unit tests."""
+
+# pylint: disable=protected-access
+
+import pathlib
+from unittest.mock import MagicMock
+
+import ops
+import pytest
+from ops.testing import Harness
+
+import hook_profiler
+
+
+@pytest.fixture(name="profile_dir")
+def profile_dir_fixture(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> pathlib.Path:
+    """Directory of the hook profiles, set once the charm is started."""
+    monkeypatch.setenv("JUJU_DISPATCH_PATH", "hooks/config-changed")
+    return tmp_path
+
+
+def test_hook_profile_disabled(harness: Harness, profile_dir: pathlib.Path):
+    """
+    arrange: start the Synapse charm with profile_hooks disabled.
+    act: emit config-changed and commit the framework.
+    assert: no hook profile is stored.
+    """
+    harness.begin()
+    harness.charm._hook_profiler.profile_dir = profile_dir
+
+    harness.charm.on.config_changed.emit()
+    harness.framework.commit()
+
+    assert not hook_profiler.get_profiles(profile_dir)
+
+
+def test_hook_profile_stored(
+    harness: Harness, profile_dir: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: start the Synapse charm with profile_hooks enabled and a full ring buffer.
+    act: emit config-changed and commit the framework.
+    assert: the hook profile is stored and the oldest profile is dropped.
+    """
+    monkeypatch.setattr(hook_profiler, "PROFILE_RING_SIZE", 2)
+    for timestamp in (1, 2):
+        (profile_dir / f"{timestamp:020d}-update-status.pstats").touch()
+    harness.update_config({"profile_hooks": True})
+    harness.begin()
+    harness.charm._hook_profiler.profile_dir = profile_dir
+
+    harness.charm.on.config_changed.emit()
+    harness.framework.commit()
+
+    profiles = hook_profiler.get_profiles(profile_dir)
+    assert len(profiles) == 2
+    assert profiles[0].name == f"{2:020d}-update-status.pstats"
+    assert profiles[1].name.endswith("-config-changed.pstats")
+    assert "_on_config_changed" in hook_profiler.format_profile(profiles[1], 50)
+
+
+def test_hook_profile_stored_on_exit(
+    harness: Harness, profile_dir: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: start the Synapse charm with profile_hooks enabled.
+    act: exit the hook without committing the framework, as a failing hook does.
+    assert: the hook profile is stored once, and not again on a later commit.
+    """
+    atexit_mock = MagicMock()
+    monkeypatch.setattr(hook_profiler, "atexit", atexit_mock)
+    harness.update_config({"profile_hooks": True})
+    harness.begin()
+    harness.charm._hook_profiler.profile_dir = profile_dir
+
+    atexit_mock.register.call_args.args[0]()
+    harness.framework.commit()
+
+    assert len(hook_profiler.get_profiles(profile_dir)) == 1
+    atexit_mock.unregister.assert_called_once()
+
+
+def test_get_hook_profile_action(
+    harness: Harness, profile_dir: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: start the Synapse charm with profile_hooks enabled and profile config-changed.
+    act: run the get-hook-profile action.
+    assert: the top functions of the config-changed hook are returned.
+    """
+    harness.update_config({"profile_hooks": True})
+    harness.begin()
+    harness.charm._hook_profiler.profile_dir = profile_dir
+    harness.charm.on.config_changed.emit()
+    harness.framework.commit()
+    monkeypatch.setenv("JUJU_DISPATCH_PATH", "actions/get-hook-profile")
+
+    output = harness.run_action("get-hook-profile", {"hooks": 5, "limit": 10})
+
+    assert list(output.results["profiles"]) == ["1"]
+    profile = output.results["profiles"]["1"]
+    assert profile["hook"] == "config-changed"
+    assert "cumulative" in profile["stats"]
+    assert len(hook_profiler.get_profiles(profile_dir)) == 1
+
+
+def test_get_hook_profile_action_no_profile(harness: Harness, profile_dir: pathlib.Path):
+    """
+    arrange: start the Synapse charm with profile_hooks disabled.
+    act: run the get-hook-profile action.
+    assert: the action fails since there is no hook profile.
+    """
+    harness.begin()
+    harness.charm._hook_profiler.profile_dir = profile_dir
+
+    with pytest.raises(ops.testing.ActionFailed) as err:
+        harness.run_action("get-hook-profile", {"hooks": 5, "limit": 10})
+
+    assert "profile_hooks" in err.value.message
+    assert not hook_profiler.get_profiles(profile_dir)
@@ -0,0 +1,59 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Charm import time unit tests."""
+
+import os
+import pathlib
+import subprocess  # nosec B404
+import sys
+
+# Modules only needed by some hooks, so they must not be imported with the charm.
+LAZY_MODULES = (
+    "boto3",
+    "botocore",
+    "psycopg2",
+    "deepdiff",
+    "jinja2",
+    "cryptography.hazmat.primitives.asymmetric.rsa",
+    "cProfile",
+    "pstats",
+)
+PROJECT_ROOT = pathlib.Path(__file__).parents[2]
+
+
+def import_charm() -> dict[str, int]:
+    """Import the charm in a new interpreter with -X importtime.
+
+    Returns:
+        The cumulative import time of each imported module, in microseconds.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(str(PROJECT_ROOT / path) for path in (".", "lib", "src"))
+    result = subprocess.run(  # nosec B603
+        [sys.executable, "-X", "importtime", "-c", "import charm"],
+        cwd=PROJECT_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        cumulative_times[module.strip()] = int(cumulative)
+    return cumulative_times
+
+
+def test_import_charm_lazy_modules():
+    """
+    arrange: nothing.
+    act: import the charm module in a new interpreter.
+    assert: the modules only needed by some hooks are not imported.
+    """
+    imported_modules = import_charm()
+
+    assert "charm" in imported_modules
+    assert not [module for module in LAZY_MODULES if module in imported_modules]
@@ -121,7 +121,7 @@ def test_media_configurations(harness: Harness, relation_data, valid):
 def test_enable_media(harness: Harness, monkeypatch: pytest.MonkeyPatch):
     """
     arrange: Mock the container's can_connect method to return the can_connect parameter.
-    act: Call the _enable_media method.
+    act: rotate the S3 credentials.
     assert: Check if the unit's status is set to the expected_status.
     """
     relation_data = {
@@ -132,7 +132,7 @@ def test_enable_media(harness: Harness, monkeypatch: pytest.MonkeyPatch):
         "secret-key": token_hex(16),
         "path": "media",
     }
-    harness.add_relation("media", "s3-integrator", app_data=relation_data)
+    relation_id = harness.add_relation("media", "s3-integrator", app_data=relation_data)
     harness.begin_with_initial_hooks()
     enable_media_mock = Mock()
     monkeypatch.setattr(synapse, "enable_media", enable_media_mock)
@@ -141,7 +141,7 @@ def test_enable_media(harness: Harness, monkeypatch: pytest.MonkeyPatch):
         synapse.SYNAPSE_CONFIG_PATH, f'server_name: "{TEST_SERVER_NAME}"', make_dirs=True
     )
 
-    relation = harness.charm.framework.model.get_relation("media", 0)
-    harness.charm._media._s3_client.on.credentials_changed.emit(relation)
+    # Rotate the credentials, reconcile is skipped when the integration data is unchanged.
+    harness.update_relation_data(relation_id, "s3-integrator", {"secret-key": token_hex(16)})
 
     enable_media_mock.assert_called_once()
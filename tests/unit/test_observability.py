@@ -14,7 +14,8 @@ def test_prometheus_target(prometheus_configured: Harness) -> None:
     """
     arrange: charm deployed, integrated with Redis and set as a leader.
     act: start the Synapse charm.
-    assert: Synapse charm has Prometheus targets 9000 (Synapse) and 9877 (Stats exporter).
+    assert: Synapse charm has Prometheus targets 9000 (Synapse), 9877 (Stats exporter)
+        and 9878 (charm Pebble metrics).
     """
     harness = prometheus_configured
     harness.set_leader(True)
@@ -43,4 +44,15 @@ def test_prometheus_target(prometheus_configured: Harness) -> None:
                 }
             ],
         },
+        {
+            "job_name": "synapse_charm_pebble",
+            "metrics_path": "/pebble.txt",
+            "static_configs": [
+                {
+                    "targets": [
+                        f"*:{synapse.PEBBLE_METRICS_PORT}",
+                    ]
+                }
+            ],
+        },
     ]
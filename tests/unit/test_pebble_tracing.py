@@ -0,0 +1,75 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Pebble tracing unit tests."""
+
+# pylint: disable=protected-access
+
+import pytest
+from ops.testing import Harness
+
+import pebble_tracing
+import synapse
+
+
+def test_traced_container_counts_operations(harness: Harness):
+    """
+    arrange: start the Synapse charm.
+    act: push and pull a file and run a command in the container.
+    assert: the calls and bytes are counted, the command is timed while waited for.
+    """
+    harness.begin()
+    harness.handle_exec(synapse.SYNAPSE_CONTAINER_NAME, ["true"], result=0)
+    pebble_tracing.reset_operation_stats()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+
+    container.push("/tmp/traced.txt", "hello", make_dirs=True)
+    with container.pull("/tmp/traced.txt") as file:
+        content = file.read()
+    container.pebble.exec(["true"]).wait()
+
+    assert content == "hello"
+    operation_stats = pebble_tracing.get_operation_stats()
+    assert operation_stats["push"].calls == 1
+    assert operation_stats["push"].transferred_bytes == 5
+    assert operation_stats["pull"].calls == 1
+    assert operation_stats["pull"].transferred_bytes == 5
+    assert operation_stats["exec"].calls == 1
+
+
+def test_pebble_metrics_written_on_update_status(
+    harness: Harness, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    arrange: start the Synapse charm.
+    act: reconcile twice, then emit update-status.
+    assert: only the reconciling hooks are added to the totals, which are written to
+        the Pebble metrics textfile on update-status.
+    """
+    monkeypatch.setenv("JUJU_DISPATCH_PATH", "hooks/config-changed")
+    harness.begin()
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+
+    add_layer_calls = []
+    for _ in range(2):
+        harness.charm._stored.reconcile_fingerprint = ""
+        harness.charm.on.config_changed.emit()
+        harness.framework.commit()
+        add_layer_calls.append(
+            harness.charm._pebble_tracer._stored.totals["config-changed add_layer"][0]
+        )
+    harness.charm.on.config_changed.emit()
+    harness.framework.commit()
+    assert not container.exists(synapse.PEBBLE_METRICS_PATH)
+
+    harness.charm.on.update_status.emit()
+
+    metrics = container.pull(synapse.PEBBLE_METRICS_PATH).read()
+    assert 'synapse_charm_pebble_operations_total{hook="config-changed",operation="push"}' in (
+        metrics
+    )
+    assert "# TYPE synapse_charm_pebble_operation_bytes_total counter" in metrics
+    assert add_layer_calls[1] == 2 * add_layer_calls[0]
+    assert harness.charm._pebble_tracer._stored.totals["config-changed add_layer"][0] == (
+        add_layer_calls[1]
+    )
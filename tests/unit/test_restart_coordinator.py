@@ -0,0 +1,152 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""RestartCoordinator unit tests."""
+
+# pylint: disable=protected-access
+
+import json
+
+import pytest
+from ops.testing import Harness
+
+import restart_coordinator
+import synapse
+
+
+@pytest.mark.parametrize(
+    "requests, grants, max_concurrent, expected_grants",
+    [
+        pytest.param(
+            {"synapse/1": "2", "synapse/2": "1"}, {}, 1, {"synapse/2": "1"}, id="oldest first"
+        ),
+        pytest.param(
+            {"synapse/1": "1", "synapse/2": "2", "synapse/3": "3"},
+            {},
+            2,
+            {"synapse/1": "1", "synapse/2": "2"},
+            id="max concurrent",
+        ),
+        pytest.param(
+            {"synapse/0": "1", "synapse/1": "2"}, {}, 2, {"synapse/0": "1"}, id="main alone"
+        ),
+        pytest.param(
+            {"synapse/0": "2", "synapse/1": "1", "synapse/2": "3"},
+            {},
+            3,
+            {"synapse/1": "1"},
+            id="main waits for workers",
+        ),
+        pytest.param(
+            {"synapse/1": "2", "synapse/2": "3"},
+            {"synapse/1": "1", "synapse/3": "1"},
+            1,
+            {"synapse/1": "2"},
+            id="stale grants dropped",
+        ),
+    ],
+)
+def test_compute_grants(requests, grants, max_concurrent, expected_grants):
+    """
+    arrange: given pending restart requests and current grants.
+    act: compute the grants.
+    assert: the expected restarts are granted.
+    """
+    assert (
+        restart_coordinator.compute_grants(requests, grants, "synapse/0", max_concurrent)
+        == expected_grants
+    )
+
+
+def _grants(harness: Harness, rel_id: int) -> dict:
+    """Get the restart grants of the peer relation.
+
+    Args:
+        harness: harness instance.
+        rel_id: peer relation id.
+
+    Returns:
+        The granted restart request of each unit.
+    """
+    app_data = harness.get_relation_data(rel_id, harness.charm.app.name)
+    return json.loads(app_data.get(restart_coordinator.RESTART_GRANTS_KEY, "{}"))
+
+
+def test_leader_rolls_restarts(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: start the Synapse charm as the leader and main unit with a worker unit.
+    act: the worker requests a restart, then the main unit, then the worker releases.
+    assert: the main unit only restarts once the worker released its restart.
+    """
+    rel_id = harness.add_relation(
+        synapse.SYNAPSE_PEER_RELATION_NAME, "synapse", app_data={"main_unit_id": "synapse/0"}
+    )
+    harness.add_relation_unit(rel_id, "synapse/1")
+    harness.set_leader(True)
+    harness.begin()
+    monkeypatch.setattr(harness.charm, "reconcile", lambda *_args: None)
+    coordinator = harness.charm._restart_coordinator
+
+    harness.update_relation_data(
+        rel_id, "synapse/1", {restart_coordinator.RESTART_REQUEST_KEY: "1"}
+    )
+
+    assert _grants(harness, rel_id) == {"synapse/1": "1"}
+    assert not coordinator.acquire()
+
+    harness.update_relation_data(
+        rel_id, "synapse/1", {restart_coordinator.RESTART_RELEASED_KEY: "1"}
+    )
+
+    assert list(_grants(harness, rel_id)) == ["synapse/0"]
+    assert coordinator.acquire()
+
+
+def test_worker_holds_restart_until_ready(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: start the Synapse charm as a worker unit granted to restart.
+    act: restart, then emit update-status while Synapse is stopped, while it is not
+        ready and once it is.
+    assert: the restart is only released once Synapse is running and ready.
+    """
+    rel_id = harness.add_relation(
+        synapse.SYNAPSE_PEER_RELATION_NAME, "synapse", app_data={"main_unit_id": "synapse/1"}
+    )
+    harness.add_relation_unit(rel_id, "synapse/1")
+    harness.begin()
+    monkeypatch.setattr(harness.charm, "reconcile", lambda *_args: None)
+    coordinator = harness.charm._restart_coordinator
+    assert not coordinator.acquire()
+    request = harness.get_relation_data(rel_id, "synapse/0")[
+        restart_coordinator.RESTART_REQUEST_KEY
+    ]
+    harness.update_relation_data(
+        rel_id,
+        "synapse",
+        {restart_coordinator.RESTART_GRANTS_KEY: json.dumps({"synapse/0": request})},
+    )
+    assert coordinator.acquire()
+    coordinator.release_when_ready()
+    unit_data = harness.get_relation_data(rel_id, "synapse/0")
+    container = harness.model.unit.get_container(synapse.SYNAPSE_CONTAINER_NAME)
+    harness.set_can_connect(container, True)
+    container.add_layer(
+        "synapse",
+        {"services": {synapse.SYNAPSE_SERVICE_NAME: {"override": "replace", "command": "s"}}},
+    )
+
+    monkeypatch.setattr(synapse, "is_ready", lambda: True)
+    harness.charm.on.update_status.emit()
+
+    assert restart_coordinator.RESTART_RELEASED_KEY not in unit_data
+
+    container.start(synapse.SYNAPSE_SERVICE_NAME)
+    monkeypatch.setattr(synapse, "is_ready", lambda: False)
+    harness.charm.on.update_status.emit()
+
+    assert restart_coordinator.RESTART_RELEASED_KEY not in unit_data
+
+    monkeypatch.setattr(synapse, "is_ready", lambda: True)
+    harness.charm.on.update_status.emit()
+
+    assert unit_data[restart_coordinator.RESTART_RELEASED_KEY] == request
@@ -6,17 +6,24 @@
 # pylint: disable=protected-access, too-many-lines, duplicate-code
 
 
+import copy
 import io
+import json
 import typing
+from pathlib import Path
 from secrets import token_hex
 from unittest.mock import MagicMock, Mock
 
 import ops
 import pytest
 import yaml
+from deepdiff import DeepDiff
+from hypothesis import given, settings
+from hypothesis import strategies as st
 from ops.testing import Harness
 from pydantic.v1 import ValidationError
 
+import pebble
 import synapse
 from charm_types import SMTPConfiguration
 from state.charm_state import CharmState, SynapseConfig
@@ -364,6 +371,7 @@ def test_generate_mjolnir_config_success(monkeypatch: pytest.MonkeyPatch):
     push_mock = MagicMock()
     container_mock = MagicMock()
     monkeypatch.setattr(container_mock, "push", push_mock)
+    container_mock.pull.side_effect = ops.pebble.PathError("not-found", "not found")
 
     synapse.generate_mjolnir_config(
         container=container_mock, access_token=access_token, room_id=room_id
@@ -372,11 +380,53 @@ def test_generate_mjolnir_config_success(monkeypatch: pytest.MonkeyPatch):
     expected_config = synapse.workload._get_mjolnir_config(
         access_token=access_token, room_id=room_id
     )
-    push_mock.assert_called_once_with(
+    push_mock.assert_any_call(
         synapse.MJOLNIR_CONFIG_PATH, yaml.safe_dump(expected_config), make_dirs=True
     )
 
 
+def test_push_files_skips_unchanged(harness: Harness):
+    """
+    arrange: start the charm, with a file already in the container.
+    act: push the same file, push it again with a new content, then remove it and
+        push it again.
+    assert: only the files with a new content or removed are pushed.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+    container.push("/data/existing.yaml", "existing", make_dirs=True)
+
+    assert not synapse.push_files(container, {"/data/existing.yaml": "existing"})
+    assert synapse.push_files(
+        container, {"/data/existing.yaml": "existing", "/data/new.yaml": "new"}
+    ) == {"/data/new.yaml"}
+    assert not synapse.push_files(container, {"/data/new.yaml": "new"})
+    assert synapse.push_files(container, {"/data/new.yaml": "changed"}) == {"/data/new.yaml"}
+    synapse.get_pushed_files(container).remove(["/data/new.yaml"])
+    assert synapse.push_files(container, {"/data/new.yaml": "changed"}) == {"/data/new.yaml"}
+
+    assert container.pull("/data/new.yaml").read() == "changed"
+
+
+def test_push_files_manifest_shared(harness: Harness, monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: start the charm and push a file.
+    act: push the same file with a new pushed files instance, as in a later hook.
+    assert: the file is not pushed again, its hash is in the manifest.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+    synapse.push_files(container, {"/data/pushed.yaml": "pushed"})
+    push_mock = MagicMock()
+    monkeypatch.setattr(container, "push", push_mock)
+
+    assert not synapse.PushedFiles(container).push({"/data/pushed.yaml": "pushed"})
+
+    push_mock.assert_not_called()
+    manifest = json.loads(container.pull(synapse.PUSHED_FILES_MANIFEST_PATH).read())
+    assert "/data/pushed.yaml" in manifest
+
+
 SMTP_CONFIGURATION = SMTPConfiguration(
     enable_tls=True,
     force_tls=False,
@@ -791,3 +841,516 @@ def test_invite_checker_blocklist_allowlist_url(config_content: dict[str, typing
     }
 
     assert yaml.safe_dump(config_content) == yaml.safe_dump(expected_config_content)
+
+
+def test_config_snapshot_pulls_once(monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: set mock container with configuration file.
+    act: get several configuration fields and views from the snapshot.
+    assert: the configuration file is pulled only once and the desired view
+        can be modified without changing the existing one.
+    """
+    config_content = "server_name: example.com\nmedia_store_path: /media\nlisteners: []\n"
+    pull_mock = MagicMock(side_effect=lambda *_args, **_kwargs: io.StringIO(config_content))
+    container_mock = MagicMock()
+    monkeypatch.setattr(container_mock, "pull", pull_mock)
+
+    media_store_path = synapse.get_media_store_path(container_mock)
+    config_snapshot = synapse.get_config_snapshot(container_mock)
+    desired = config_snapshot.desired()
+    desired["listeners"].append({"port": 9000})
+
+    assert media_store_path == "/media"
+    assert synapse.workload._get_configuration_field(container_mock, "server_name") == (
+        "example.com"
+    )
+    assert config_snapshot.existing()["listeners"] == []
+    pull_mock.assert_called_once()
+
+
+def test_config_snapshot_invalidate(monkeypatch: pytest.MonkeyPatch):
+    """
+    arrange: set mock container with configuration file and read it through the snapshot.
+    act: change the configuration file and invalidate the snapshot.
+    assert: the new configuration is pulled.
+    """
+    config_contents = iter(["server_name: old.example.com", "server_name: new.example.com"])
+    pull_mock = MagicMock(side_effect=lambda *_args, **_kwargs: io.StringIO(next(config_contents)))
+    container_mock = MagicMock()
+    monkeypatch.setattr(container_mock, "pull", pull_mock)
+    config_snapshot = synapse.get_config_snapshot(container_mock)
+    assert config_snapshot.existing()["server_name"] == "old.example.com"
+
+    config_snapshot.invalidate()
+
+    assert config_snapshot.existing()["server_name"] == "new.example.com"
+    assert pull_mock.call_count == 2
+
+
+MIGRATE_CONFIG_FILES = Path(__file__).parent / "files"
+
+
+def _migrate_config_output(database: str, server_name: str = "example.com") -> dict:
+    """Load the configuration written by `/start.py migrate_config`.
+
+    The files are the output of migrate_config in the Synapse rock for example.com,
+    so the tests fail when the charm template drifts from it.
+
+    Args:
+        database: database of the environment, sqlite or postgresql.
+        server_name: server name of the environment.
+
+    Returns:
+        The configuration as parsed from the file written by migrate_config.
+    """
+    content = (MIGRATE_CONFIG_FILES / f"migrate_config_{database}.yaml").read_text()
+    return yaml.safe_load(content.replace("example.com", server_name))
+
+
+def _push_migrate_config_files(container: ops.Container, server_name: str) -> None:
+    """Push the files generated by `/start.py migrate_config` on its first run.
+
+    Args:
+        container: Synapse container.
+        server_name: server name of the environment.
+    """
+    container.push(
+        f"/data/{server_name}.SYNAPSE_REGISTRATION_SHARED_SECRET.key", "registration-secret"
+    )
+    container.push(f"/data/{server_name}.SYNAPSE_MACAROON_SECRET_KEY.key", "macaroon-secret")
+    container.push(synapse.SYNAPSE_LOG_CONFIG_PATH, "version: 1")
+
+
+def test_execute_migrate_config_rendered(harness: Harness):
+    """
+    arrange: push the files generated by migrate_config on its first run.
+    act: call execute_migrate_config.
+    assert: the configuration matches migrate_config output without running it.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+    server_name = harness.charm.build_charm_state().synapse_config.server_name
+    _push_migrate_config_files(container, server_name)
+
+    synapse.execute_migrate_config(container, harness.charm.build_charm_state())
+
+    configuration = yaml.safe_load(container.pull(synapse.SYNAPSE_CONFIG_PATH).read())
+    assert configuration == _migrate_config_output("sqlite", server_name)
+
+
+def test_execute_migrate_config_fallback(harness: Harness):
+    """
+    arrange: start the charm without the files generated by migrate_config.
+    act: call execute_migrate_config.
+    assert: the configuration is the one written by migrate_config.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+
+    synapse.execute_migrate_config(container, harness.charm.build_charm_state())
+
+    configuration = yaml.safe_load(container.pull(synapse.SYNAPSE_CONFIG_PATH).read())
+    assert configuration["listeners"] == [
+        {"type": "http", "port": 8080, "bind_addresses": ["::"]},
+    ]
+
+
+def test_render_homeserver_config_postgresql():
+    """
+    arrange: build the migrate_config variables for a PostgreSQL datasource.
+    act: call render_homeserver_config.
+    assert: the configuration matches migrate_config output.
+    """
+    environment = {
+        "SYNAPSE_SERVER_NAME": "example.com",
+        "SYNAPSE_REPORT_STATS": "no",
+        "SYNAPSE_NO_TLS": True,
+        "SYNAPSE_LOG_CONFIG": synapse.SYNAPSE_LOG_CONFIG_PATH,
+        "SYNAPSE_REGISTRATION_SHARED_SECRET": "registration-secret",
+        "SYNAPSE_MACAROON_SECRET_KEY": "macaroon-secret",
+        "SYNAPSE_APPSERVICES": [],
+        "POSTGRES_DB": "synapse",
+        "POSTGRES_HOST": "10.0.0.1",
+        "POSTGRES_PORT": "5432",
+        "POSTGRES_USER": "user",
+        "POSTGRES_PASSWORD": "password",
+    }
+
+    configuration = yaml.safe_load(synapse.render_homeserver_config(environment))
+
+    assert configuration == _migrate_config_output("postgresql")
+
+
+_HOSTNAMES = st.from_regex(r"[a-z][a-z0-9]{0,8}\.[a-z]{2,4}", fullmatch=True)
+_SEPARATORS = st.sampled_from([",", ", ", " ,"])
+
+
+def _comma_separated(
+    items: st.SearchStrategy[str], separator: st.SearchStrategy[str] = st.just(",")
+) -> st.SearchStrategy[str]:
+    """Build a strategy for comma separated charm configuration values.
+
+    Args:
+        items: strategy for the items.
+        separator: strategy for the separator between items.
+
+    Returns:
+        The strategy.
+    """
+    return st.tuples(st.lists(items, min_size=1, max_size=4), separator).map(
+        lambda values: values[1].join(values[0])
+    )
+
+
+@st.composite
+def _charm_states(draw: st.DrawFn) -> CharmState:
+    """Build a strategy for charm states.
+
+    Args:
+        draw: hypothesis draw function.
+
+    Returns:
+        The charm state.
+    """
+    server_name = draw(_HOSTNAMES)
+    optional = st.none()
+    synapse_config = SynapseConfig(  # type: ignore[call-arg]
+        server_name=server_name,
+        public_baseurl=f"https://{server_name}",
+        block_non_admin_invites=draw(st.booleans()),
+        allow_public_rooms_over_federation=draw(st.booleans()),
+        enable_password_config=draw(st.booleans()),
+        enable_room_list_search=draw(st.booleans()),
+        federation_domain_whitelist=draw(optional | _comma_separated(_HOSTNAMES, _SEPARATORS)),
+        trusted_key_servers=draw(optional | _comma_separated(_HOSTNAMES)),
+        ip_range_whitelist=draw(optional | _comma_separated(st.ip_addresses(v=4).map(str))),
+        invite_checker_policy_rooms=draw(
+            optional | _comma_separated(_HOSTNAMES.map(lambda host: f"room:{host}"))
+        ),
+        invite_checker_blocklist_allowlist_url=draw(
+            optional | _HOSTNAMES.map(lambda host: f"https://{host}/list.json")
+        ),
+        publish_rooms_allowlist=draw(
+            optional | _comma_separated(_HOSTNAMES.map(lambda host: f"user:{host}"))
+        ),
+        limit_remote_rooms_complexity=draw(optional | st.floats(min_value=0.1, max_value=10)),
+    )
+    instance_map_config = draw(
+        optional
+        | st.just(
+            {
+                "main": {"host": "synapse-0.synapse-endpoints", "port": 8035},
+                "federationsender1": {"host": "synapse-0.synapse-endpoints", "port": 8034},
+                "worker1": {"host": "synapse-1.synapse-endpoints", "port": 8034},
+            }
+        )
+    )
+    return CharmState(
+        synapse_config=synapse_config,
+        datasource=None,
+        smtp_config=None,
+        media_config=None,
+        redis_config=None,
+        instance_map_config=instance_map_config,
+        registration_secrets=None,
+    )
+
+
+def _reconcile_config(base_config: dict, charm_state: CharmState, is_main: bool) -> dict:
+    """Change a configuration the same way reconcile does.
+
+    Args:
+        base_config: configuration to start from, it is not modified.
+        charm_state: Instance of CharmState.
+        is_main: if unit is main.
+
+    Returns:
+        The configuration as compared and pushed by reconcile.
+    """
+    current_config = copy.deepcopy(base_config)
+    pebble._change_config(current_config, charm_state=charm_state, is_main=is_main)
+    return synapse.canonicalize_config(current_config)
+
+
+def _push_and_pull(config: dict) -> dict:
+    """Write a configuration the way reconcile pushes it and read it back.
+
+    Args:
+        config: configuration pushed by reconcile.
+
+    Returns:
+        The configuration read from the pushed file.
+    """
+    return yaml.load(yaml.safe_dump(config), Loader=synapse.workload.ConfigLoader)  # nosec B506
+
+
+@given(charm_state=_charm_states(), is_main=st.booleans())
+@settings(max_examples=50, deadline=None)
+def test_reconcile_config_idempotent_after_migrate_config(charm_state: CharmState, is_main: bool):
+    """
+    arrange: reconcile a configuration generated by migrate_config and push it.
+    act: reconcile again with the same inputs on a regenerated configuration.
+    assert: there is no difference with the pushed configuration.
+    """
+    config_content = _migrate_config_output("sqlite")
+    pushed_config = _push_and_pull(_reconcile_config(config_content, charm_state, is_main))
+
+    current_config = _reconcile_config(config_content, charm_state, is_main)
+
+    assert not DeepDiff(
+        synapse.canonicalize_config(pushed_config),
+        current_config,
+        ignore_order=True,
+        ignore_string_case=True,
+    )
+
+
+@given(charm_state=_charm_states(), is_main=st.booleans())
+@settings(max_examples=50, deadline=None)
+def test_reconcile_config_idempotent_on_pushed_config(charm_state: CharmState, is_main: bool):
+    """
+    arrange: reconcile a configuration and push it.
+    act: reconcile again with the same inputs on the pushed configuration.
+    assert: there is no difference with the pushed configuration.
+    """
+    config_content = _migrate_config_output("sqlite")
+    pushed_config = _push_and_pull(_reconcile_config(config_content, charm_state, is_main))
+
+    current_config = _reconcile_config(pushed_config, charm_state, is_main)
+
+    assert not DeepDiff(
+        synapse.canonicalize_config(pushed_config),
+        current_config,
+        ignore_order=True,
+        ignore_string_case=True,
+    )
+    assert current_config == _push_and_pull(current_config)
+
+
+@given(
+    config=st.recursive(
+        st.none() | st.booleans() | st.integers() | st.text(max_size=5),
+        lambda children: st.lists(children, max_size=3)
+        | st.tuples(children, children)
+        | st.dictionaries(st.text(max_size=5), children, max_size=3),
+        max_leaves=10,
+    ).map(lambda value: {"value": value})
+)
+def test_canonicalize_config_idempotent(config: dict):
+    """
+    arrange: build an arbitrary configuration.
+    act: canonicalize it twice.
+    assert: the second canonicalization and a YAML round trip do not change it.
+    """
+    canonical_config = synapse.canonicalize_config(config)
+
+    assert synapse.canonicalize_config(canonical_config) == canonical_config
+    assert _push_and_pull(canonical_config) == canonical_config
+
+
+def test_canonicalize_config_deduplicates():
+    """
+    arrange: build a configuration with tuples, duplicated listeners, modules and
+        trusted key servers.
+    act: canonicalize it.
+    assert: tuples are lists and the last duplicated item is kept at the first position.
+    """
+    metrics_listener = {"port": 9000, "type": "metrics", "bind_addresses": ["::"]}
+    config = {
+        "listeners": [
+            {"port": 8008, "type": "http"},
+            metrics_listener,
+            {"port": 8035, "type": "http"},
+            metrics_listener,
+        ],
+        "modules": [
+            {"module": "synapse_invite_checker.InviteChecker", "config": {}},
+            {"module": "other.Module", "config": {}},
+            {"module": "synapse_invite_checker.InviteChecker", "config": {"a": "b"}},
+        ],
+        "trusted_key_servers": ({"server_name": "a.org"}, {"server_name": "a.org"}),
+        "ip_range_whitelist": ("10.0.0.1", "10.0.0.2"),
+    }
+
+    canonical_config = synapse.canonicalize_config(config)
+
+    assert canonical_config == {
+        "listeners": [
+            {"port": 8008, "type": "http"},
+            {"port": 9000, "type": "metrics", "bind_addresses": ["::"]},
+            {"port": 8035, "type": "http"},
+        ],
+        "modules": [
+            {"module": "synapse_invite_checker.InviteChecker", "config": {"a": "b"}},
+            {"module": "other.Module", "config": {}},
+        ],
+        "trusted_key_servers": [{"server_name": "a.org"}],
+        "ip_range_whitelist": ["10.0.0.1", "10.0.0.2"],
+    }
+
+
+@pytest.mark.parametrize(
+    "worker_role,resources",
+    [
+        pytest.param("generic", ["client", "federation"], id="generic"),
+        pytest.param("sync", ["client"], id="sync"),
+        pytest.param("federation_reader", ["federation"], id="federation_reader"),
+        pytest.param("media", ["media"], id="media"),
+        pytest.param("pusher", ["health"], id="pusher"),
+    ],
+)
+def test_generate_worker_config_role(worker_role: str, resources: list[str]):
+    """
+    arrange: nothing.
+    act: generate the configuration of a worker with a role.
+    assert: the worker HTTP listener serves the resources of the role.
+    """
+    worker_config = synapse.generate_worker_config("1", False, worker_role)
+
+    assert worker_config["worker_name"] == "worker1"
+    assert worker_config["worker_listeners"][1]["resources"] == [{"names": resources}]
+
+
+@pytest.mark.parametrize(
+    "worker_role,local_files",
+    [
+        pytest.param(
+            "generic", ["worker_location.conf", "federation_location.conf"], id="generic"
+        ),
+        pytest.param("federation_reader", ["federation_location.conf"], id="federation_reader"),
+        pytest.param("media", ["media_location.conf"], id="media"),
+        pytest.param("background", [], id="background"),
+    ],
+)
+def test_generate_nginx_config_worker_role(
+    harness: Harness, worker_role: str, local_files: list[str]
+):
+    """
+    arrange: start the charm.
+    act: generate the NGINX configuration for a worker with a role.
+    assert: the requests served by the worker are proxied to it, the others to
+        the main unit.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+
+    synapse.generate_nginx_config(
+        container, synapse.NginxSettings("synapse-0.synapse-endpoints", worker_role)
+    )
+
+    for location_file in synapse.NGINX_LOCATION_FILES.values():
+        upstream = "synapse_main"
+        if location_file in local_files:
+            upstream = "synapse_local"
+        location = container.pull(f"/etc/nginx/{location_file}").read()
+        assert f"proxy_pass http://{upstream};" in location
+
+
+def test_generate_nginx_config_worker_processes(harness: Harness):
+    """
+    arrange: start the charm.
+    act: generate the NGINX configuration for a worker with 3 processes.
+    assert: the local upstream balances between the 3 processes.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+
+    synapse.generate_nginx_config(
+        container, synapse.NginxSettings("synapse-0.synapse-endpoints", worker_processes=3)
+    )
+
+    upstreams = container.pull("/etc/nginx/upstreams.conf").read()
+    local_upstream = upstreams[: upstreams.index("upstream synapse_main")]
+    assert [line.split()[1] for line in local_upstream.splitlines() if "server" in line] == [
+        "localhost:8008",
+        "localhost:8102",
+        "localhost:8103",
+    ]
+
+
+@pytest.mark.parametrize(
+    "is_main,backup",
+    [
+        pytest.param(True, False, id="main"),
+        pytest.param(False, True, id="worker"),
+    ],
+)
+def test_generate_nginx_config_upstreams_keepalive(harness: Harness, is_main: bool, backup: bool):
+    """
+    arrange: start the charm.
+    act: generate the NGINX configuration for the main unit and for a worker.
+    assert: the upstreams keep their connections alive, take failing servers out and
+        the main unit is the backup of the local processes of a worker.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+
+    synapse.generate_nginx_config(
+        container, synapse.NginxSettings("synapse-0.synapse-endpoints", is_main=is_main)
+    )
+
+    upstreams = container.pull("/etc/nginx/upstreams.conf").read()
+    assert upstreams.count("keepalive 32;") == 2
+    assert "server localhost:8008 max_fails=3 fail_timeout=10s;" in upstreams
+    assert "server synapse-0.synapse-endpoints:8008 max_fails=3 fail_timeout=10s;" in upstreams
+    assert ("server synapse-0.synapse-endpoints:8008 backup;" in upstreams) == backup
+    for location_file in synapse.NGINX_LOCATION_FILES.values():
+        location = container.pull(f"/etc/nginx/{location_file}").read()
+        assert 'proxy_set_header Connection "";' in location
+
+
+@pytest.mark.parametrize(
+    "worker_role,sync_servers,sync_upstream",
+    [
+        pytest.param("generic", ["synapse-1.synapse-endpoints:8008"], "synapse_sync", id="sync"),
+        pytest.param("generic", [], "synapse_local", id="generic"),
+        pytest.param("media", [], "synapse_main", id="media"),
+    ],
+)
+def test_generate_nginx_config_sync_servers(
+    harness: Harness, worker_role: str, sync_servers: list[str], sync_upstream: str
+):
+    """
+    arrange: start the charm.
+    act: generate the NGINX configuration with and without sync servers.
+    assert: the sync requests are balanced by access token between the sync servers,
+        or proxied like the other client requests without sync servers.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+
+    synapse.generate_nginx_config(
+        container,
+        synapse.NginxSettings(
+            "synapse-0.synapse-endpoints", worker_role, sync_servers=sync_servers
+        ),
+    )
+
+    upstreams = container.pull("/etc/nginx/upstreams.conf").read()
+    sync_location = container.pull("/etc/nginx/sync_location.conf").read()
+    assert f"proxy_pass http://{sync_upstream};" in sync_location
+    assert ("upstream synapse_sync" in upstreams) == bool(sync_servers)
+    for server in sync_servers:
+        assert f"server {server} max_fails=3 fail_timeout=10s;" in upstreams
+
+
+@pytest.mark.parametrize(
+    "cpu_max,cpus,cpu_count",
+    [
+        pytest.param("250000 100000", "0-7", 3, id="quota"),
+        pytest.param("max 100000", "0-3,6", 5, id="cpuset"),
+        pytest.param("invalid", "0-3", 1, id="invalid"),
+    ],
+)
+def test_get_cpu_count(harness: Harness, cpu_max: str, cpus: str, cpu_count: int):
+    """
+    arrange: start the charm and push the cgroup CPU files.
+    act: get the CPU count of the container.
+    assert: the CPU quota is used, or the CPU set without quota.
+    """
+    harness.begin()
+    container = harness.model.unit.containers[synapse.SYNAPSE_CONTAINER_NAME]
+    container.push("/sys/fs/cgroup/cpu.max", cpu_max, make_dirs=True)
+    container.push("/sys/fs/cgroup/cpuset.cpus.effective", cpus, make_dirs=True)
+
+    assert synapse.get_cpu_count(container) == cpu_count